@@ -0,0 +1,238 @@
+import asyncio
+import heapq
+import http
+import logging
+import os
+import random
+import time
+from itertools import islice
+
+import websockets
+from websockets.connection import State
+
+logger = logging.getLogger("OCPP_Server")
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class Admission:
+    """Bağlantı kabul kontrolü; kesinti sonrası bütün istasyonlar aynı anda döndüğünde.
+
+    - Kaynak (IP) başına token bucket: `source_rate`/s, en fazla `source_burst` üst üste.
+      Proxy arkasında kaynak, X-Forwarded-For'un sondan `proxy_hops`'uncu adresi.
+    - HTTP isteği `open_timeout` saniyede tamamlanmayan TCP bağlantıları kesilir.
+    - Eşzamanlı handshake sınırı: kabul edilip henüz ilk OCPP mesajını göndermemiş
+      bağlantılar `handshake_timeout` saniye boyunca handshake sayılır; `max_handshakes`
+      doluysa yeni bağlantı 503 + Retry-After (jitter'lı) alır.
+    - Takılı bağlantılar: `stuck_after` saniyedir tek mesaj göndermemiş bağlantılar,
+      sınır aşıldığı anda en eskiden başlayarak 1013 (Try Again Later) ile kapatılır.
+    - BootNotification: `boot_rate`/s (`boot_burst`) üzerinde gelenler Pending alır;
+      tekrar deneme aralığı bekleyen erteleme sayısına göre jitter'lı dağıtılır.
+
+    Sınırlar süreç başınadır (WORKERS > 1 ise her worker kendi sınırını uygular).
+    """
+
+    def __init__(self, source_rate=10.0, source_burst=50, max_handshakes=500, handshake_timeout=30.0,
+                 stuck_after=300.0, boot_rate=50.0, boot_burst=200, pending_min=10, pending_max=300,
+                 retry_after=30, proxy_hops=0, open_timeout=10.0, max_sources=100000, shed_batch=100):
+        self.source_rate = source_rate
+        self.source_burst = source_burst
+        self.max_handshakes = max_handshakes
+        self.handshake_timeout = handshake_timeout
+        self.stuck_after = stuck_after
+        self.boot_rate = boot_rate
+        self.pending_min = pending_min
+        self.pending_max = pending_max
+        self.retry_after = retry_after
+        self.proxy_hops = proxy_hops
+        self.open_timeout = open_timeout
+        self.max_sources = max_sources
+        self.shed_batch = shed_batch
+        self.sources = {}  # kaynak -> TokenBucket
+        self.boots = TokenBucket(boot_rate, boot_burst, time.monotonic())
+        # websocket -> kabul zamanı; ikisi de kabul sırasıyla (en eski önde)
+        self.handshakes = {}  # handshake_timeout içinde, henüz mesaj yok
+        self.idle = {}  # handshake süresi geçmiş, hâlâ mesaj yok
+        self.deferred = []  # Pending verilen istasyonların tekrar deneme zamanları (heap)
+        self.rate_limited = 0
+        self.rejected = 0
+        self.shed = 0
+        self.open_timeouts = 0
+        self.pending_boots = 0
+        self._closing = set()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            source_rate=float(os.getenv("ADMISSION_SOURCE_RATE", 10)),
+            source_burst=int(os.getenv("ADMISSION_SOURCE_BURST", 50)),
+            max_handshakes=int(os.getenv("ADMISSION_MAX_HANDSHAKES", 500)),
+            handshake_timeout=float(os.getenv("ADMISSION_HANDSHAKE_TIMEOUT", 30)),
+            stuck_after=float(os.getenv("ADMISSION_STUCK_AFTER", 300)),
+            boot_rate=float(os.getenv("ADMISSION_BOOT_RATE", 50)),
+            boot_burst=int(os.getenv("ADMISSION_BOOT_BURST", 200)),
+            pending_min=int(os.getenv("ADMISSION_PENDING_MIN", 10)),
+            pending_max=int(os.getenv("ADMISSION_PENDING_MAX", 300)),
+            retry_after=int(os.getenv("ADMISSION_RETRY_AFTER", 30)),
+            proxy_hops=int(os.getenv("ADMISSION_PROXY_HOPS", 0)),
+            open_timeout=float(os.getenv("ADMISSION_OPEN_TIMEOUT", 10)),
+        )
+
+    # ----- Handshake -----
+
+    def source(self, websocket, request_headers):
+        if self.proxy_hops:
+            forwarded = [part.strip() for value in request_headers.get_all("X-Forwarded-For")
+                         for part in value.split(",") if part.strip()]
+            if len(forwarded) >= self.proxy_hops:
+                return forwarded[-self.proxy_hops]
+        peer = websocket.remote_address
+        return peer[0] if peer else "unknown"
+
+    def admit(self, websocket, request_headers):
+        """Kabul edilirse None, yoksa process_request'in döneceği HTTP cevabı."""
+        now = time.monotonic()
+        self._expire(now)
+        source = self.source(websocket, request_headers)
+        bucket = self.sources.get(source)
+        if bucket is None:
+            if len(self.sources) >= self.max_sources:
+                self._prune(now)
+            bucket = self.sources[source] = TokenBucket(self.source_rate, self.source_burst, now)
+        if not bucket.take(now):
+            self.rate_limited += 1
+            self._shed(now)
+            return self._reject(http.HTTPStatus.TOO_MANY_REQUESTS)
+        if self.max_handshakes and len(self.handshakes) >= self.max_handshakes:
+            self.rejected += 1
+            self._shed(now)
+            return self._reject(http.HTTPStatus.SERVICE_UNAVAILABLE)
+        self.handshakes[websocket] = now
+        return None
+
+    def seen(self, websocket):
+        # İlk OCPP mesajı geldi; artık handshake ya da takılı sayılmaz
+        if self.handshakes.pop(websocket, None) is None:
+            self.idle.pop(websocket, None)
+
+    def forget(self, websocket):
+        self.handshakes.pop(websocket, None)
+        self.idle.pop(websocket, None)
+
+    def _reject(self, status):
+        # Reddedilenler aynı anda tekrar gelmesin
+        retry = random.randint(1, max(1, self.retry_after))
+        return status, [("Retry-After", str(retry)), ("Content-Type", "text/plain")], b"Try again later\n"
+
+    def _expire(self, now):
+        while self.handshakes:
+            websocket, since = next(iter(self.handshakes.items()))
+            if now - since < self.handshake_timeout:
+                return
+            del self.handshakes[websocket]
+            self.idle[websocket] = since
+
+    def _prune(self, now):
+        # Dolmuş kovalar yeni açılmışla aynı; silmek davranışı değiştirmez
+        for source in [source for source, bucket in self.sources.items() if bucket.full(now)]:
+            del self.sources[source]
+
+    def _shed(self, now):
+        shed = 0
+        for websocket, since in list(islice(self.idle.items(), self.shed_batch)):
+            if now - since < self.stuck_after:
+                break
+            del self.idle[websocket]
+            shed += 1
+            task = asyncio.ensure_future(websocket.close(code=1013, reason="Try again later"))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        if shed:
+            self.shed += shed
+            logger.warning(f"✂️ Takılı bağlantılar kapatıldı - Bağlantı: {shed}, Handshake: {len(self.handshakes)}")
+
+    # ----- BootNotification -----
+
+    def defer_boot(self):
+        """Boot kabul edilecekse None, yoksa Pending ile verilecek tekrar deneme aralığı (s)."""
+        now = time.monotonic()
+        if self.boots.take(now):
+            return None
+        while self.deferred and self.deferred[0] <= now:
+            heapq.heappop(self.deferred)
+        # Bekleyenler boot_rate hızında kabul edilebilecek şekilde yayılır
+        window = min(self.pending_max, max(self.pending_min, len(self.deferred) / self.boot_rate))
+        interval = int(random.uniform(self.pending_min, window + self.pending_min))
+        interval = min(interval, self.pending_max)
+        heapq.heappush(self.deferred, now + interval)
+        self.pending_boots += 1
+        return interval
+
+    def stats(self):
+        return {
+            "handshakes": len(self.handshakes),
+            "idle": len(self.idle),
+            "sources": len(self.sources),
+            "rate_limited": self.rate_limited,
+            "rejected": self.rejected,
+            "shed": self.shed,
+            "open_timeouts": self.open_timeouts,
+            "pending_boots": self.pending_boots,
+            "boot_backlog": len(self.deferred),
+        }
+
+
+class Protocol(websockets.WebSocketServerProtocol):
+    """websockets.serve(create_protocol=...); kabul kontrolü handshake'te, bağlantı nesnesiyle."""
+
+    admission = None  # main() atar
+    _open_timer = None
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        # websockets 10'da sunucu tarafında açılış zaman aşımı yok; isteğini hiç
+        # göndermeyen bağlantı handler task'ı ile birlikte sonsuza kadar bekler
+        if self.admission is not None and self.admission.open_timeout:
+            self._open_timer = self.loop.call_later(self.admission.open_timeout, self._open_expired)
+
+    def _open_expired(self):
+        if self.state is State.CONNECTING:
+            self.admission.open_timeouts += 1
+            self.transport.abort()
+
+    async def process_request(self, path, request_headers):
+        # Düz HTTP (health, metrics) sınırlanmaz
+        if self.admission is not None and request_headers.get("Upgrade", "").lower() == "websocket":
+            response = self.admission.admit(self, request_headers)
+            if response is not None:
+                return response
+        return await super().process_request(path, request_headers)
+
+    def connection_lost(self, exc):
+        if self._open_timer is not None:
+            self._open_timer.cancel()
+        if self.admission is not None:
+            self.admission.forget(self)
+        super().connection_lost(exc)
@@ -0,0 +1,255 @@
+import asyncio
+import csv
+import hmac
+import io
+import logging
+import os
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+from aiohttp import web
+
+import codec
+import db
+from utils import parse_timestamp
+
+logger = logging.getLogger("OCPP_Server")
+
+# Rapor: çıktı kolonları (SELECT sırasıyla), sorgu ({where} doldurulur), zaman aralığı
+# kolonu ve eşitlikle süzülebilen kolonlar. Kolon isimleri sabit; değerler hep parametre.
+Report = namedtuple("Report", "columns query time filters")
+
+REPORTS = {
+    # Faturalama/oturum listesi: ham transactions, başlangıç zamanına göre
+    "sessions": Report(
+        ("transaction_id", "cp_id", "connector_id", "id_tag", "start_time", "stop_time",
+         "meter_start", "meter_stop", "energy_wh"),
+        """
+        SELECT id, cp_id, connector_id, id_tag, start_time, stop_time, start_value, stop_value, total_energy
+        FROM transactions WHERE {where} ORDER BY start_time, id
+        """,
+        "start_time", ("cp_id", "connector_id", "id_tag"),
+    ),
+    # İstasyon başına günlük enerji (UTC günleri); saatlik rollup'tan, ham örneklerden değil
+    "energy-daily": Report(
+        ("cp_id", "day", "energy_wh", "samples"),
+        """
+        SELECT cp_id, hour::date AS day, sum(energy_wh), sum(samples)
+        FROM energy_hourly WHERE {where} GROUP BY cp_id, day ORDER BY cp_id, day
+        """,
+        "hour", ("cp_id",),
+    ),
+    "energy-hourly": Report(
+        ("cp_id", "connector_id", "hour", "energy_wh", "samples"),
+        """
+        SELECT cp_id, connector_id, hour, energy_wh, samples
+        FROM energy_hourly WHERE {where} ORDER BY cp_id, connector_id, hour
+        """,
+        "hour", ("cp_id", "connector_id"),
+    ),
+    # Connector durum zaman çizelgesi; `until` aralıktaki bir sonraki durumun zamanı
+    "status": Report(
+        ("cp_id", "connector_id", "status", "error_code", "since", "until"),
+        """
+        SELECT cp_id, connector_id, status, error_code, timestamp,
+               lead(timestamp) OVER (PARTITION BY cp_id, connector_id ORDER BY timestamp)
+        FROM status_notifications WHERE {where} ORDER BY cp_id, connector_id, timestamp
+        """,
+        "timestamp", ("cp_id", "connector_id"),
+    ),
+}
+
+INTEGER_FILTERS = {"connector_id"}
+
+
+def build_query(report, params, default_days=31):
+    """?from=&to= (ISO tarih/zaman, UTC) ve filtrelerden (sorgu, argümanlar). Hatalı girişte ValueError."""
+    end = parse_timestamp(params["to"]) if "to" in params else datetime.utcnow()
+    start = parse_timestamp(params["from"]) if "from" in params else end - timedelta(days=default_days)
+    args = [start, end]
+    clauses = [f"{report.time} >= $1", f"{report.time} < $2"]
+    for column in report.filters:
+        if column in params:
+            args.append(int(params[column]) if column in INTEGER_FILTERS else params[column])
+            clauses.append(f"{column} = ${len(args)}")
+    return report.query.format(where=" AND ".join(clauses)), args
+
+
+def _plain(value):
+    # Zamanlar transactions to_dict'teki gibi UTC "Z" ile
+    if isinstance(value, datetime):
+        return value.isoformat() + "Z"
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+class NDJSONWriter:
+    content_type = "application/x-ndjson"
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.buffer = io.StringIO()
+
+    def header(self):
+        pass
+
+    def row(self, record):
+        self.buffer.write(codec.default.dumps(dict(zip(self.columns, map(_plain, record)))))
+        self.buffer.write("\n")
+
+    def take(self):
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data.encode()
+
+
+class CSVWriter(NDJSONWriter):
+    content_type = "text/csv; charset=utf-8"
+
+    def __init__(self, columns):
+        super().__init__(columns)
+        self.writer = csv.writer(self.buffer)
+
+    def header(self):
+        self.writer.writerow(self.columns)
+
+    def row(self, record):
+        self.writer.writerow(map(_plain, record))
+
+
+FORMATS = {"ndjson": NDJSONWriter, "csv": CSVWriter}
+
+
+class AnalyticsServer:
+    """Geçmiş veriler için okuma API'si, websocket portundan ayrı bir HTTP portunda.
+
+    GET /analytics/<rapor>?from=&to=&cp_id=&format=ndjson|csv. Sonuçlar sunucu tarafı
+    cursor ile `prefetch`'lik parçalar halinde okunup `chunk_bytes` dolunca chunked
+    olarak yazılır; aylık faturalama dökümü belleğe toplanmaz. Sorgular tek bir
+    REPEATABLE READ, salt okunur transaction'da çalışır (döküm tutarlı bir anlık
+    görüntü). Uzun dökümler OCPP mesajlarının bağlantılarını tutmasın diye ayrı,
+    küçük bir havuz kullanılır. `token` tanımlı değilse bütün istekler 401.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8081, token=None, pool_size=2, prefetch=1000,
+                 chunk_bytes=64 * 1024, default_days=31):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.pool_size = pool_size
+        self.prefetch = prefetch
+        self.chunk_bytes = chunk_bytes
+        self.default_days = default_days
+        self.pool = None
+        self.exports = 0
+        self.rows = 0
+        self.active = 0
+        self._pool_lock = asyncio.Lock()
+        self._runner = None
+
+    @classmethod
+    def from_env(cls):
+        """ANALYTICS_PORT boşsa API kapalı: None."""
+        port = os.getenv("ANALYTICS_PORT")
+        if not port:
+            return None
+        return cls(
+            host=os.getenv("ANALYTICS_HOST", "127.0.0.1"),
+            port=int(port),
+            token=os.getenv("ANALYTICS_TOKEN"),
+            pool_size=int(os.getenv("ANALYTICS_POOL_MAX", 2)),
+            prefetch=int(os.getenv("ANALYTICS_PREFETCH", 1000)),
+            default_days=int(os.getenv("ANALYTICS_DEFAULT_DAYS", 31)),
+        )
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/analytics/{report}", self.handle)
+        return app
+
+    async def start(self, reuse_port=False):
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port, reuse_port=reuse_port).start()
+        logger.info(f"📊 Analitik API dinlemede - {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def _get_pool(self):
+        # Veritabanı açılışta yoksa ilk istekte tekrar denenir
+        async with self._pool_lock:
+            if self.pool is None:
+                try:
+                    self.pool = await db.create_pool(min_size=0, max_size=self.pool_size)
+                except Exception as e:
+                    logger.error(f"❌ Analitik havuzu oluşturulamadı: {str(e)}")
+            return self.pool
+
+    def _authorized(self, request):
+        return bool(self.token) and hmac.compare_digest(
+            request.headers.get("Authorization", "").encode(), f"Bearer {self.token}".encode()
+        )
+
+    async def handle(self, request):
+        if not self._authorized(request):
+            return web.json_response({"error": "unauthorized"}, status=401)
+        name = request.match_info["report"]
+        report = REPORTS.get(name)
+        if report is None:
+            return web.json_response({"error": "unknown report", "reports": sorted(REPORTS)}, status=404)
+        params = dict(request.query)
+        writer_class = FORMATS.get(params.pop("format", "ndjson"))
+        if writer_class is None:
+            return web.json_response({"error": "format must be one of: " + ", ".join(FORMATS)}, status=400)
+        try:
+            query, args = build_query(report, params, self.default_days)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        pool = await self._get_pool()
+        if pool is None:
+            return web.json_response({"error": "database unavailable"}, status=503)
+
+        headers = {"Content-Type": writer_class.content_type}
+        if writer_class is CSVWriter:
+            headers["Content-Disposition"] = f'attachment; filename="{name}.csv"'
+        response = web.StreamResponse(headers=headers)
+        writer = writer_class(report.columns)
+        writer.header()
+        rows = 0
+        self.active += 1
+        try:
+            async with pool.acquire() as conn:
+                async with conn.transaction(isolation="repeatable_read", readonly=True):
+                    async for record in conn.cursor(query, *args, prefetch=self.prefetch):
+                        writer.row(record)
+                        rows += 1
+                        if writer.buffer.tell() >= self.chunk_bytes:
+                            if not response.prepared:
+                                await response.prepare(request)
+                            await response.write(writer.take())
+        except Exception as e:
+            logger.error(f"⚠️ Analitik sorgu hatası - {name}, Satır: {rows}: {str(e)}")
+            if not response.prepared:
+                return web.json_response({"error": "query failed"}, status=500)
+            # Başlık gitti; son chunk yazılmadan bağlantı kesilir, istemci eksik dökümü fark eder
+            raise
+        finally:
+            self.active -= 1
+            self.rows += rows
+        if not response.prepared:
+            await response.prepare(request)
+        await response.write(writer.take())
+        await response.write_eof()
+        self.exports += 1
+        return response
+
+    def stats(self):
+        return {"exports": self.exports, "rows": self.rows, "active": self.active}
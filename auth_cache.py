@@ -0,0 +1,131 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("OCPP_Server")
+
+# users tablosu değişince id_tag'i NOTIFY ile yayınlar; TRUNCATE'te boş payload = hepsi
+DDL = """
+    CREATE OR REPLACE FUNCTION notify_users_changed() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+            PERFORM pg_notify('users_changed', '');
+        ELSIF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify('users_changed', OLD.id_tag);
+        ELSE
+            PERFORM pg_notify('users_changed', NEW.id_tag);
+            IF TG_OP = 'UPDATE' AND OLD.id_tag IS DISTINCT FROM NEW.id_tag THEN
+                PERFORM pg_notify('users_changed', OLD.id_tag);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS users_changed ON users;
+    CREATE TRIGGER users_changed AFTER INSERT OR UPDATE OR DELETE ON users
+        FOR EACH ROW EXECUTE FUNCTION notify_users_changed();
+
+    DROP TRIGGER IF EXISTS users_truncated ON users;
+    CREATE TRIGGER users_truncated AFTER TRUNCATE ON users
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_users_changed();
+"""
+
+CHANNEL = "users_changed"
+
+
+class AuthCache:
+    """id_tag -> yetki durumu önbelleği (LRU + TTL).
+
+    Bilinmeyen tag'ler de (`Invalid`) daha kısa `negative_ttl` ile tutulur, böylece
+    tekrarlanan geçersiz kart okutmaları veritabanına gitmez. Süresi dolan kayıt LRU'dan
+    düşene kadar durur; veritabanına `lookup_timeout` içinde ulaşılamazsa `stale` ile o
+    kullanılır, hiç kayıt yoksa `offline_status` verilir.
+
+    Her invalidate `generation`'ı artırır. Sorgu başlamadan alınan değer `put`'a verilirse
+    sorgu sürerken gelen bir invalidate'ten sonra eski sonuç önbelleğe yazılmaz.
+    """
+
+    def __init__(self, max_size=10000, ttl=300.0, negative_ttl=60.0, lookup_timeout=2.0, offline_status="Accepted"):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lookup_timeout = lookup_timeout
+        self.offline_status = offline_status
+        self._entries = OrderedDict()  # id_tag -> (status, expires_at)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.offline = 0
+        self.generation = 0
+        self.discarded = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_size=int(os.getenv("AUTH_CACHE_SIZE", 10000)),
+            ttl=float(os.getenv("AUTH_CACHE_TTL", 300)),
+            negative_ttl=float(os.getenv("AUTH_CACHE_NEGATIVE_TTL", 60)),
+            lookup_timeout=float(os.getenv("AUTH_LOOKUP_TIMEOUT", 2)),
+            offline_status=os.getenv("AUTH_OFFLINE_STATUS", "Accepted"),
+        )
+
+    def get(self, id_tag):
+        entry = self._entries.get(id_tag)
+        if entry is None:
+            self.misses += 1
+            return None
+        status, expires_at = entry
+        if expires_at <= time.monotonic():
+            # Silinmez; veritabanı yokken `stale` bunu kullanır
+            self.misses += 1
+            return None
+        self._entries.move_to_end(id_tag)
+        self.hits += 1
+        return status
+
+    def put(self, id_tag, status, generation=None):
+        if generation is not None and generation != self.generation:
+            # Sorgu sürerken users değişti; sonuç eski olabilir
+            self.discarded += 1
+            return
+        ttl = self.ttl if status == "Accepted" else self.negative_ttl
+        self._entries[id_tag] = (status, time.monotonic() + ttl)
+        self._entries.move_to_end(id_tag)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stale(self, id_tag):
+        """Veritabanına ulaşılamadığında: süresi dolmuş olsa da son bilinen durum, yoksa `offline_status`."""
+        self.offline += 1
+        entry = self._entries.get(id_tag)
+        return entry[0] if entry is not None else self.offline_status
+
+    def invalidate(self, id_tag=None):
+        # id_tag verilmezse bütün önbellek temizlenir
+        self.generation += 1
+        if id_tag is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(id_tag, None)
+
+    def items(self):
+        # Süresi dolmamış kayıtlar; ileride SendLocalList için kaynak
+        now = time.monotonic()
+        return [(id_tag, status) for id_tag, (status, expires_at) in self._entries.items() if expires_at > now]
+
+    def on_notify(self, connection, pid, channel, payload):
+        # asyncpg add_listener callback imzası
+        self.invalidate(payload or None)
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "offline": self.offline,
+            "discarded": self.discarded,
+        }
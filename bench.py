@@ -0,0 +1,528 @@
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import logging
+import multiprocessing as mp
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import websockets
+from dataclasses import asdict
+from ocpp.charge_point import camel_to_snake_case, remove_nones, snake_to_camel_case
+from ocpp.messages import unpack, validate_payload
+from ocpp.v16 import call_result
+
+import codec
+import loadgen
+import server
+from loadgen import LatencyHistogram
+
+logger = logging.getLogger("OCPP_Bench")
+
+
+# ----- Veritabanı: yerel Postgres ya da process içi taklit -----
+
+class StandInConnection:
+    """asyncpg bağlantısının benchmark için yeterli kısmı; sorgu çalıştırmaz."""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    async def _round_trip(self):
+        self._pool.round_trips += 1
+        if self._pool.latency:
+            await asyncio.sleep(self._pool.latency)
+
+    async def execute(self, query, *args, **kwargs):
+        await self._round_trip()
+        return "OK"
+
+    async def executemany(self, query, args, **kwargs):
+        await self._round_trip()
+
+    async def fetch(self, query, *args, **kwargs):
+        await self._round_trip()
+        if "RETURNING" in query:
+            # Upsert/UPDATE ... RETURNING id: hepsi yazılmış sayılır
+            return [(tx_id,) for tx_id in args[0]]
+        return []
+
+    async def fetchrow(self, query, *args, **kwargs):
+        await self._round_trip()
+        return None
+
+    async def fetchval(self, query, *args, **kwargs):
+        await self._round_trip()
+        if "generate_series" in query:
+            # Transaction id bloğu
+            start = self._pool.next_id
+            self._pool.next_id += args[0]
+            return list(range(start, start + args[0]))
+        if "max(id)" in query:
+            return None
+        return 1
+
+    async def copy_records_to_table(self, table, *, records, columns=None, **kwargs):
+        await self._round_trip()
+        self._pool.rows += len(records)
+
+    async def add_listener(self, channel, callback):
+        pass
+
+
+class StandInPool:
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self.round_trips = 0
+        self.rows = 0
+        self.next_id = 1
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield StandInConnection(self)
+
+    async def release(self, conn):
+        pass
+
+    async def close(self):
+        pass
+
+
+class CountingPool:
+    """Gerçek asyncpg havuzunu sarar ve bağlantı üzerinden yapılan sorguları sayar."""
+
+    # db.fetchval/db.execute hazırlanmış sorgu için `statements`'a sorgu başına bir kez bakar
+    COUNTED = ("execute", "executemany", "fetch", "fetchrow", "fetchval", "copy_records_to_table", "statements")
+
+    def __init__(self, pool):
+        self._pool = pool
+        self.round_trips = 0
+        self.rows = 0
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        async with self._pool.acquire() as conn:
+            yield _CountingConnection(conn, self)
+
+    async def release(self, conn):
+        await self._pool.release(conn)
+
+    async def close(self):
+        await self._pool.close()
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+class _CountingConnection:
+    def __init__(self, conn, pool):
+        self._conn = conn
+        self._pool = pool
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name in CountingPool.COUNTED:
+            self._pool.round_trips += 1
+        return attr
+
+
+async def open_pool(args):
+    if args.db == "postgres":
+        pool = await server.create_db_pool()
+        if pool is None:
+            raise SystemExit("Postgres'e bağlanılamadı (DB_* ortam değişkenlerini kontrol edin)")
+        return CountingPool(pool)
+    return StandInPool(args.db_latency_ms)
+
+
+def attach_pool(pool):
+    server.db_pool = pool
+    server.ChargePoint.db_pool = pool
+    server.writer.pool = pool
+    server.transactions.pool = pool
+
+
+def disable_boot_deferral():
+    # Bench saniyede binlerce BootNotification üretir; Pending yolu ölçülmesin
+    server.admission.boots.rate = server.admission.boots.burst = server.admission.boots.tokens = float("inf")
+
+
+# ----- Handler benchmark'ı: websocket olmadan route_message -----
+
+class NullConnection:
+    """Cevapları sayan ve sonuncusunu tutan sahte websocket."""
+
+    def __init__(self):
+        self.sent = 0
+        self.last = None
+
+    async def send(self, message):
+        self.sent += 1
+        self.last = message
+
+    async def recv(self):
+        await asyncio.Future()
+
+
+def utc_now():
+    return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def build_frames():
+    now = utc_now()
+    sampled = [
+        {"value": "12345", "measurand": "Energy.Active.Import.Register", "unit": "Wh"},
+        {"value": "7200", "measurand": "Power.Active.Import", "unit": "W"},
+    ] + [
+        {"value": "16.0", "measurand": "Current.Import", "unit": "A", "phase": phase}
+        for phase in ("L1", "L2", "L3")
+    ]
+    return {
+        "Heartbeat": {},
+        "BootNotification": {"chargePointModel": "BenchModel", "chargePointVendor": "BenchVendor"},
+        "Authorize": {"idTag": "BENCH_TAG"},
+        "StatusNotification": {"connectorId": 1, "errorCode": "NoError", "status": "Available", "timestamp": now},
+        "MeterValues": {"connectorId": 1, "transactionId": 1, "meterValue": [{"timestamp": now, "sampledValue": sampled}]},
+        "StartTransaction": {"connectorId": 1, "idTag": "BENCH_TAG", "meterStart": 0, "timestamp": now},
+        "StopTransaction": {"transactionId": 1, "meterStop": 1000, "timestamp": now},
+    }
+
+
+async def bench_handlers(args):
+    pool = await open_pool(args)
+    attach_pool(pool)
+    disable_boot_deferral()
+    server.writer.start()
+    connections = [NullConnection() for _ in range(args.stations)]
+    stations = [server.ChargePoint(f"BENCH_{i}", connection) for i, connection in enumerate(connections)]
+    # Sunucu açılırken olduğu gibi ilk id bloğu hazır; sonrakileri arka plan görevi alır
+    await server.transactions._fetch_block()
+
+    frames = build_frames()
+    actions = args.actions or list(frames)
+    started_ids = []  # StartTransaction cevaplarındaki id'ler; Stop'lar bunları kapatır
+    results = {}
+    for action in actions:
+        payload = frames[action]
+        histogram = LatencyHistogram()
+        round_trips_before = pool.round_trips
+        started = time.perf_counter()
+        for i in range(args.messages):
+            cp = stations[i % len(stations)]
+            if action == "StartTransaction":
+                # Her Start ayrı connector'da yeni bir transaction; tekrar sayılmasın
+                payload = dict(payload, connectorId=i // len(stations) + 1, meterStart=i)
+            elif action == "StopTransaction":
+                # Her Stop ayrı bir açık transaction'a ait olsun; Start ölçülmediyse bilinmeyen id'ler
+                payload = dict(payload, transactionId=started_ids[i] if i < len(started_ids) else i + 1)
+            raw = json.dumps([2, str(i), action, payload])
+            t0 = time.perf_counter()
+            await cp.route_message(raw)
+            histogram.record((time.perf_counter() - t0) * 1000)
+            if action == "StartTransaction":
+                started_ids.append(json.loads(connections[i % len(stations)].last)[2]["transactionId"])
+            # Gerçek sunucuda her mesajda websocket okunurken arka plan görevleri (id bloğu) çalışır
+            await asyncio.sleep(0)
+        # Write-behind kuyruğunda kalanlar da bu action'ın maliyetine dahil
+        await server.writer.flush()
+        await server.transactions.flush()
+        elapsed = time.perf_counter() - started
+        round_trips = pool.round_trips - round_trips_before
+        results[action] = dict(
+            histogram.summary(),
+            msg_per_s=round(args.messages / elapsed, 1),
+            db_round_trips_per_msg=round(round_trips / args.messages, 4),
+        )
+    await server.writer.stop()
+    return {"db": args.db, "messages_per_action": args.messages, "stations": args.stations, "actions": results}
+
+
+# ----- Uçtan uca: localhost üzerinden websocket -----
+
+def _loadgen_process(loadgen_args):
+    return loadgen.run(loadgen_args)
+
+
+async def start_local_server(port=0):
+    ws_server = await websockets.serve(
+        server.on_connect, "127.0.0.1", port, subprotocols=["ocpp1.6"],
+        **server.websocket_options()
+    )
+    port = ws_server.sockets[0].getsockname()[1]
+    return ws_server, port
+
+
+async def bench_e2e(args):
+    pool = await open_pool(args)
+    attach_pool(pool)
+    disable_boot_deferral()
+    server.writer.start()
+    ws_server, port = await start_local_server()
+
+    loadgen_args = loadgen.build_parser().parse_args([
+        "--url", f"ws://127.0.0.1:{port}",
+        "--stations", str(args.stations),
+        "--processes", str(args.client_processes),
+        "--scenario", args.scenario,
+        "--duration", str(args.duration),
+        "--ramp-rate", str(args.ramp_rate),
+        "--heartbeat-interval", str(args.heartbeat_interval),
+        "--meter-hz", str(args.meter_hz),
+    ])
+    # İstemciler ayrı process'te; sunucu bu event loop'ta ölçülür
+    loop = asyncio.get_running_loop()
+    round_trips_before = pool.round_trips
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("fork")) as executor:
+        result = await loop.run_in_executor(executor, _loadgen_process, loadgen_args)
+    await server.writer.flush()
+    round_trips = pool.round_trips - round_trips_before
+
+    ws_server.close()
+    await ws_server.wait_closed()
+    await server.writer.stop()
+    result["db"] = args.db
+    result["db_round_trips_per_msg"] = round(round_trips / result["messages"], 4) if result["messages"] else 0.0
+    return result
+
+
+# ----- Codec: handler hariç mesaj başına CPU -----
+
+def build_responses():
+    now = utc_now()
+    accepted = {"status": "Accepted"}
+    return {
+        "Heartbeat": call_result.HeartbeatPayload(current_time=now),
+        "BootNotification": call_result.BootNotificationPayload(current_time=now, interval=300, status="Accepted"),
+        "Authorize": call_result.AuthorizePayload(id_tag_info=accepted),
+        "StatusNotification": call_result.StatusNotificationPayload(),
+        "MeterValues": call_result.MeterValuesPayload(),
+        "StartTransaction": call_result.StartTransactionPayload(transaction_id=1, id_tag_info=accepted),
+        "StopTransaction": call_result.StopTransactionPayload(id_tag_info=accepted),
+    }
+
+
+def _stock_path(raw, response):
+    # ocpp'nin ChargePoint'te yaptığı: unpack, doğrula, anahtar dönüşümü, cevap, doğrula, to_json
+    msg = unpack(raw)
+    validate_payload(msg, "1.6")
+    camel_to_snake_case(msg.payload)
+    result = msg.create_call_result(snake_to_camel_case(remove_nones(asdict(response))))
+    validate_payload(result, "1.6")
+    return result.to_json()
+
+
+def _codec_path(message_codec, trusted):
+    def run(raw, response):
+        msg = message_codec.unpack(raw)
+        message_codec.validate(msg)
+        message_codec.to_snake(msg.payload)
+        result = msg.create_call_result(message_codec.to_camel(asdict(response)))
+        if not trusted:
+            message_codec.validate(result)
+        return message_codec.pack(result)
+    return run
+
+
+def _cpu_us(path, raw, response, count):
+    started = time.process_time()
+    for _ in range(count):
+        path(raw, response)
+    return (time.process_time() - started) / count * 1e6
+
+
+async def bench_codec(args):
+    frames = build_frames()
+    responses = build_responses()
+    json_codec = codec.Codec(backend="json")
+    json_codec.warm()
+    paths = {"ocpp": _stock_path, "codec_json": _codec_path(json_codec, trusted=False)}
+    if codec.orjson is not None:
+        fast_codec = codec.Codec(backend="orjson")
+        fast_codec.warm()
+        paths["codec_orjson"] = _codec_path(fast_codec, trusted=False)
+        paths["codec_orjson_trusted"] = _codec_path(fast_codec, trusted=True)
+    else:
+        paths["codec_json_trusted"] = _codec_path(json_codec, trusted=True)
+
+    results = {}
+    for action in args.actions or list(frames):
+        raw = json.dumps([2, "1", action, frames[action]])
+        response = responses[action]
+        # Aynı çıktıyı üretmeyen yol karşılaştırılmaz
+        expected = json.loads(_stock_path(raw, response))
+        for name, path in paths.items():
+            assert json.loads(path(raw, response)) == expected, (action, name)
+            path(raw, response)
+        timings = {name: round(_cpu_us(path, raw, response, args.messages), 2) for name, path in paths.items()}
+        best = min(timings.values())
+        results[action] = dict(
+            {f"{name}_us_per_msg": value for name, value in timings.items()},
+            frame_bytes=len(raw),
+            saved_us_per_msg=round(timings["ocpp"] - best, 2),
+            speedup=round(timings["ocpp"] / best, 2) if best else None,
+        )
+    return {"messages_per_action": args.messages, "orjson": codec.orjson is not None, "actions": results}
+
+
+# ----- Bellek: bağlı istasyon başına byte -----
+
+def rss_bytes():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def _hold_connections(port, count, hold_seconds):
+    async def run():
+        loadgen.raise_fd_limit()
+        connections = []
+        for i in range(count):
+            connections.append(await websockets.connect(
+                f"ws://127.0.0.1:{port}/MEM_{i}", subprotocols=["ocpp1.6"], ping_interval=None, compression=None
+            ))
+        await asyncio.sleep(hold_seconds)
+        for ws in connections:
+            await ws.close()
+        return len(connections)
+    return asyncio.run(run())
+
+
+async def bench_memory(args):
+    attach_pool(await open_pool(args))
+    loadgen.raise_fd_limit()
+    ws_server, port = await start_local_server()
+    gc.collect()
+    before = rss_bytes()
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("fork")) as executor:
+        future = loop.run_in_executor(executor, _hold_connections, port, args.stations, args.hold)
+        # Bağlantılar açıkken ölç
+        while len(server.registry) < args.stations and not future.done():
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(1.0)
+        gc.collect()
+        during = rss_bytes()
+        connected = len(server.registry)
+        python_bytes = tracemalloc.get_traced_memory()[0] if args.tracemalloc else None
+        await future
+    tracemalloc.stop()
+
+    ws_server.close()
+    await ws_server.wait_closed()
+    return {
+        "connection_mode": server.connection_mode,
+        "stations": connected,
+        "python_bytes_per_station": round(python_bytes / connected) if python_bytes and connected else None,
+        "rss_before_bytes": before,
+        "rss_connected_bytes": during,
+        "bytes_per_station": round((during - before) / connected) if connected else None,
+    }
+
+
+# ----- Çıktı -----
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit or None,
+        "timestamp": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def flatten(data, prefix=""):
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline, current):
+    # Sadece sayısal metrikler; yüzde değişim
+    old, new = flatten(baseline["results"]), flatten(current["results"])
+    print(f"{'metric':<60}{'baseline':>14}{'current':>14}{'change':>10}")
+    for name in sorted(set(old) & set(new)):
+        change = f"{(new[name] - old[name]) / old[name] * 100:+.1f}%" if old[name] else "-"
+        print(f"{name:<60}{old[name]:>14}{new[name]:>14}{change:>10}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="OCPP sunucu benchmark'ları")
+    parser.add_argument("suite", choices=("handlers", "e2e", "memory", "codec", "all"))
+    parser.add_argument("--db", choices=("stand-in", "postgres"), default="stand-in",
+                        help="postgres: DB_* ortam değişkenleriyle yerel veritabanı")
+    parser.add_argument("--db-latency-ms", type=float, default=0.0, help="stand-in için yapay sorgu gecikmesi")
+    parser.add_argument("--messages", type=int, default=5000, help="handlers/codec: action başına mesaj")
+    parser.add_argument("--actions", nargs="*", help="handlers/codec: sadece bu action'lar")
+    parser.add_argument("--stations", type=int, default=None)
+    parser.add_argument("--scenario", choices=loadgen.SCENARIOS, default="heartbeat")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--ramp-rate", type=float, default=1000.0)
+    parser.add_argument("--heartbeat-interval", type=float, default=1.0)
+    parser.add_argument("--meter-hz", type=float, default=1.0)
+    parser.add_argument("--client-processes", type=int, default=1)
+    parser.add_argument("--connection-mode", choices=tuple(server.CONNECTION_MODES),
+                        help="Sunucu websocket ayarları (varsayılan CONNECTION_MODE)")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="memory: Python nesnelerinin istasyon başına byte'ını da ölç (yavaş)")
+    parser.add_argument("--hold", type=float, default=3.0, help="memory: bağlantıların açık tutulacağı süre")
+    parser.add_argument("--output", help="Sonuçların yazılacağı JSON dosyası")
+    parser.add_argument("--compare", help="Karşılaştırılacak önceki JSON sonucu")
+    parser.add_argument("--with-logging", action="store_true", help="Handler loglarını kapatma")
+    return parser
+
+
+async def run_suites(args):
+    if args.connection_mode:
+        server.connection_mode = args.connection_mode
+    suites = ("codec", "handlers", "e2e", "memory") if args.suite == "all" else (args.suite,)
+    defaults = {"handlers": 100, "e2e": 500, "memory": 2000, "codec": 1}
+    runners = {"handlers": bench_handlers, "e2e": bench_e2e, "memory": bench_memory, "codec": bench_codec}
+    results = {}
+    # Tek event loop: server modülündeki asyncio nesneleri loop'a bağlanıyor
+    for suite in suites:
+        suite_args = argparse.Namespace(**vars(args))
+        suite_args.stations = args.stations or defaults[suite]
+        results[suite] = await runners[suite](suite_args)
+    return results
+
+
+def main():
+    args = build_parser().parse_args()
+    if not args.with_logging:
+        logging.disable(logging.CRITICAL)
+
+    report = {"meta": metadata(), "results": asyncio.run(run_suites(args))}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,25 @@
 import asyncio
 import datetime
 import logging
+import os
 import ssl
 import websockets
 from ocpp.v16 import ChargePoint as CP
 from ocpp.v16 import call
 
+import codec
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger('OCPP_Client')
 
-class ChargePoint(CP):
+
+def utc_now():
+    return datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+class ChargePoint(codec.CodecMixin, CP):
     async def send_boot_notification(self):
         try:
             request = call.BootNotificationPayload(
@@ -36,48 +43,71 @@ class ChargePoint(CP):
             logger.error(f"Heartbeat gönderim hatası: {str(e)}")
             return None
 
-    async def simulate_charging(self):
+    async def send_status_notification(self, connector_id, status="Available", error_code="NoError"):
+        return await self.call(call.StatusNotificationPayload(
+            connector_id=connector_id,
+            error_code=error_code,
+            status=status,
+            timestamp=utc_now()
+        ))
+
+    async def start_transaction(self, connector_id, id_tag, meter_start=0):
+        return await self.call(call.StartTransactionPayload(
+            connector_id=connector_id,
+            id_tag=id_tag,
+            meter_start=meter_start,
+            timestamp=utc_now()
+        ))
+
+    async def send_meter_values(self, connector_id, energy_wh, transaction_id=None, power_w=None):
+        sampled_value = [{
+            "value": str(energy_wh),
+            "measurand": "Energy.Active.Import.Register",
+            "unit": "Wh"
+        }]
+        if power_w is not None:
+            sampled_value.append({
+                "value": str(power_w),
+                "measurand": "Power.Active.Import",
+                "unit": "W"
+            })
+        return await self.call(call.MeterValuesPayload(
+            connector_id=connector_id,
+            transaction_id=transaction_id,
+            meter_value=[{"timestamp": utc_now(), "sampledValue": sampled_value}]
+        ))
+
+    async def stop_transaction(self, transaction_id, meter_stop):
+        return await self.call(call.StopTransactionPayload(
+            transaction_id=transaction_id,
+            meter_stop=meter_stop,
+            timestamp=utc_now()
+        ))
+
+    async def simulate_charging(self, id_tag="TEST_TAG_123", samples=5, interval=5):
         try:
-            auth = await self.call(call.AuthorizePayload(id_tag="TEST_TAG_123"))
+            auth = await self.call(call.AuthorizePayload(id_tag=id_tag))
             if auth.id_tag_info["status"] != "Accepted":
                 raise Exception("Yetkilendirme reddedildi")
 
-            start_tx = await self.call(call.StartTransactionPayload(
-                connector_id=1,
-                id_tag="TEST_TAG_123",
-                meter_start=0,
-                timestamp=datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-            ))
+            start_tx = await self.start_transaction(1, id_tag, meter_start=0)
             logger.info(f"Transaction başladı. ID: {start_tx.transaction_id}")
 
-            for i in range(1, 6):
-                await asyncio.sleep(5)
-                await self.call(call.MeterValuesPayload(
-                    connector_id=1,
-                    meter_value=[{
-                        "timestamp": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
-                        "sampledValue": [{
-                            "value": str(i * 1000),
-                            "measurand": "Energy.Active.Import.Register",
-                            "unit": "Wh"
-                        }]
-                    }]
-                ))
+            for i in range(1, samples + 1):
+                await asyncio.sleep(interval)
+                await self.send_meter_values(1, i * 1000, transaction_id=start_tx.transaction_id)
                 logger.info(f"Meter value gönderildi: {i * 1000} Wh")
 
-            await self.call(call.StopTransactionPayload(
-                transaction_id=start_tx.transaction_id,
-                meter_stop=5000,
-                timestamp=datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-            ))
+            await self.stop_transaction(start_tx.transaction_id, samples * 1000)
             logger.info("Transaction başarıyla durduruldu")
 
         except Exception as e:
             logger.error(f"Şarj simülasyonu hatası: {str(e)}")
 
 async def main():
-    render_url = "test-ocpp-16.onrender.com"  # Render'daki domain
-    uri = f"wss://{render_url}/CP_1"
+    render_url = os.getenv("OCPP_HOST", "test-ocpp-16.onrender.com")  # Render'daki domain
+    cp_id = os.getenv("CP_ID", "CP_1")
+    uri = os.getenv("OCPP_URL", f"wss://{render_url}") + f"/{cp_id}"
 
     ssl_context = ssl.create_default_context()
     ssl_context.check_hostname = False
@@ -87,15 +117,18 @@ async def main():
         async with websockets.connect(
             uri,
             subprotocols=["ocpp1.6"],
-            ssl=ssl_context,
+            ssl=ssl_context if uri.startswith("wss://") else None,
             extra_headers={"Origin": f"https://{render_url}"}
         ) as ws:
             logger.info(f"Sunucuya bağlandı: {uri}")
-            cp = ChargePoint("CP_1", ws)
+            cp = ChargePoint(cp_id, ws)
+            # Cevapları okuyan döngü; bu olmadan call() hiçbir yanıt alamaz
+            reader = asyncio.create_task(cp.start())
             if not await cp.send_boot_notification():
                 raise Exception("BootNotification başarısız")
-            asyncio.create_task(cp.send_heartbeat())
+            await cp.send_heartbeat()
             await cp.simulate_charging()
+            reader.cancel()
 
     except Exception as e:
         logger.error(f"Bağlantı hatası: {str(e)}")
@@ -0,0 +1,415 @@
+import asyncio
+import decimal
+import inspect
+import json
+import logging
+import numbers
+import os
+from dataclasses import asdict
+
+from ocpp.charge_point import camel_to_snake_case, snake_to_camel_case
+from ocpp.exceptions import FormatViolationError, NotImplementedError, OCPPError, ProtocolError
+from ocpp.exceptions import PropertyConstraintViolationError
+from ocpp.messages import Call, CallError, CallResult, MessageType, get_validator, validate_payload
+
+try:
+    import orjson
+except ImportError:  # İsteğe bağlı; yoksa standart json
+    orjson = None
+
+logger = logging.getLogger("OCPP_Server")
+LOGGER = logging.getLogger("ocpp")  # ocpp kütüphanesinin kendi kayıtlarıyla aynı logger
+
+_MESSAGE_CLASSES = {cls.message_type_id: cls for cls in (Call, CallResult, CallError)}
+
+
+def _decimal(obj):
+    # ocpp'nin _DecimalEncoder'ı ile aynı: Decimal tek ondalıkla float
+    if isinstance(obj, decimal.Decimal):
+        return float("%.1f" % obj)
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+class _DecimalEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, decimal.Decimal):
+            return _decimal(obj)
+        return super().default(obj)
+
+
+# ----- Şemadan derlenmiş doğrulayıcılar -----
+
+class _Unsupported(Exception):
+    """Şema derleyicinin bilmediği bir kural; o şema jsonschema ile doğrulanır."""
+
+
+# Doğrulamayı etkilemeyen anahtarlar (format jsonschema'da da FormatChecker olmadan kontrol edilmez)
+_IGNORED = frozenset(("$schema", "$id", "id", "title", "description", "format", "javaType", "definitions"))
+_SUPPORTED = _IGNORED | {"$ref", "type", "enum", "maxLength", "properties", "required",
+                         "additionalProperties", "items", "minItems"}
+
+# Draft 4 tip kuralları: bool integer/number sayılmaz
+_TYPE_TESTS = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, numbers.Number) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+def _all(tests):
+    if len(tests) == 1:
+        return tests[0]
+
+    def check(value):
+        for test in tests:
+            if not test(value):
+                return False
+        return True
+    return check
+
+
+def _compile(schema, root):
+    """Şemayı `check(değer) -> bool` fonksiyonuna çevirir.
+
+    Sadece OCPP 1.6 şemalarında geçen kurallar desteklenir; diğerlerinde _Unsupported.
+    Sonuç jsonschema'dan daha katı olamaz: False dönerse mesaj yine de jsonschema'ya
+    gider ve hata (ya da geçerlilik) oradan gelir.
+    """
+    if "$ref" in schema:
+        # Draft 4'te $ref yanındaki anahtarlar yok sayılır
+        ref = schema["$ref"]
+        if not ref.startswith("#/definitions/"):
+            raise _Unsupported(ref)
+        return _compile(root["definitions"][ref[len("#/definitions/"):]], root)
+    unknown = set(schema) - _SUPPORTED
+    if unknown:
+        raise _Unsupported(", ".join(sorted(unknown)))
+
+    tests = []
+    if "type" in schema:
+        kinds = [schema["type"]] if isinstance(schema["type"], str) else schema["type"]
+        type_tests = [_TYPE_TESTS[kind] for kind in kinds]
+        tests.append(type_tests[0] if len(type_tests) == 1 else lambda v: any(t(v) for t in type_tests))
+    if "enum" in schema:
+        if not all(isinstance(item, str) for item in schema["enum"]):
+            raise _Unsupported("enum")
+        allowed = frozenset(schema["enum"])
+        tests.append(lambda v: isinstance(v, str) and v in allowed)
+    if "maxLength" in schema:
+        limit = schema["maxLength"]
+        tests.append(lambda v: not isinstance(v, str) or len(v) <= limit)
+    if {"properties", "required", "additionalProperties"} & set(schema):
+        tests.append(_compile_object(schema, root))
+    if "items" in schema or "minItems" in schema:
+        tests.append(_compile_array(schema, root))
+    if not tests:
+        return lambda v: True
+    return _all(tests)
+
+
+def _compile_object(schema, root):
+    properties = {key: _compile(sub, root) for key, sub in schema.get("properties", {}).items()}
+    required = tuple(schema.get("required", ()))
+    additional = schema.get("additionalProperties", True)
+    if not isinstance(additional, bool):
+        raise _Unsupported("additionalProperties")
+
+    def check(value):
+        if not isinstance(value, dict):
+            return True
+        for key in required:
+            if key not in value:
+                return False
+        for key, item in value.items():
+            test = properties.get(key)
+            if test is None:
+                if not additional:
+                    return False
+            elif not test(item):
+                return False
+        return True
+    return check
+
+
+def _compile_array(schema, root):
+    items = schema.get("items", {})
+    if not isinstance(items, dict):
+        raise _Unsupported("items")
+    item_test = _compile(items, root)
+    min_items = schema.get("minItems", 0)
+
+    def check(value):
+        if not isinstance(value, list):
+            return True
+        if len(value) < min_items:
+            return False
+        for item in value:
+            if not item_test(item):
+                return False
+        return True
+    return check
+
+
+def _schema_dir(ocpp_version):
+    import ocpp
+    return os.path.join(os.path.dirname(ocpp.__file__), "v" + ocpp_version.replace(".", ""), "schemas")
+
+
+class Codec:
+    """OCPP çerçevelerini çözme/kodlama ve şema doğrulama.
+
+    `backend` "orjson" ya da "json"; "auto" kuruluysa orjson. Doğrulama önce şemadan
+    derlenmiş Python fonksiyonuyla yapılır; geçmeyen mesajlar (ve derlenemeyen
+    şemalar) ocpp'nin validate_payload'una gider, hata kodları aynı kalır.
+    `trusted` içindeki istasyonlarda CALLRESULT doğrulaması atlanır; "*" hepsi.
+    """
+
+    def __init__(self, backend="auto", trusted=(), ocpp_version="1.6"):
+        if backend == "auto":
+            backend = "orjson" if orjson is not None else "json"
+        if backend == "orjson" and orjson is None:
+            raise ValueError("orjson kurulu değil")
+        self.backend = backend
+        self.trusted = frozenset(trusted)
+        self.trust_all = "*" in self.trusted
+        self.ocpp_version = ocpp_version
+        self._checks = {}  # (message_type_id, action) -> check ya da None (jsonschema)
+        self._snake_keys = {}
+        self._camel_keys = {}
+        if backend == "orjson":
+            self.loads = orjson.loads
+            self.dumps = self._orjson_dumps
+        else:
+            self.loads = json.loads
+            self.dumps = self._json_dumps
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            backend=os.getenv("OCPP_JSON_BACKEND", "auto"),
+            trusted=[cp_id.strip() for cp_id in os.getenv("OCPP_TRUSTED_STATIONS", "").split(",") if cp_id.strip()],
+        )
+
+    @staticmethod
+    def _orjson_dumps(obj):
+        # Websocket text frame için str; orjson bytes döner
+        return orjson.dumps(obj, default=_decimal).decode()
+
+    @staticmethod
+    def _json_dumps(obj):
+        return json.dumps(obj, separators=(",", ":"), cls=_DecimalEncoder)
+
+    # ----- Çerçeve -----
+
+    def unpack(self, raw):
+        """ocpp.messages.unpack ile aynı sonuç ve hatalar."""
+        try:
+            msg = self.loads(raw)
+        except ValueError as e:  # json ve orjson JSONDecodeError'ı ValueError alt sınıfı
+            raise FormatViolationError(f"Message is not valid JSON: {e}")
+        if not isinstance(msg, list):
+            raise ProtocolError("OCPP message hasn't the correct format. It "
+                                f"should be a list, but got {type(msg)} instead")
+        if not msg:
+            raise ProtocolError("Message doesn't contain MessageTypeID")
+        cls = _MESSAGE_CLASSES.get(msg[0]) if isinstance(msg[0], int) else None
+        if cls is None:
+            raise PropertyConstraintViolationError(f"MessageTypeId '{msg[0]}' isn't valid")
+        try:
+            return cls(*msg[1:])
+        except TypeError:
+            raise ProtocolError(f"Wrong number of elements for MessageTypeId '{msg[0]}'")
+
+    def pack(self, msg):
+        if msg.message_type_id == MessageType.Call:
+            return self.dumps([msg.message_type_id, msg.unique_id, msg.action, msg.payload])
+        if msg.message_type_id == MessageType.CallResult:
+            return self.dumps([msg.message_type_id, msg.unique_id, msg.payload])
+        return self.dumps([msg.message_type_id, msg.unique_id, msg.error_code,
+                           msg.error_description, msg.error_details])
+
+    # ----- Anahtar dönüşümü: ocpp'nin regex'leri anahtar başına bir kez -----
+
+    def to_snake(self, data):
+        if isinstance(data, dict):
+            keys = self._snake_keys
+            result = {}
+            for key, value in data.items():
+                snake = keys.get(key)
+                if snake is None:
+                    snake = next(iter(camel_to_snake_case({key: None})))
+                    if len(keys) < 4096:
+                        keys[key] = snake
+                result[snake] = self.to_snake(value)
+            return result
+        if isinstance(data, list):
+            return [self.to_snake(value) for value in data]
+        return data
+
+    def to_camel(self, data):
+        """ocpp'deki remove_nones + snake_to_camel_case tek geçişte."""
+        if isinstance(data, dict):
+            keys = self._camel_keys
+            result = {}
+            for key, value in data.items():
+                if value is None:
+                    continue
+                camel = keys.get(key)
+                if camel is None:
+                    camel = keys[key] = next(iter(snake_to_camel_case({key: None})))
+                result[camel] = self.to_camel(value)
+            return result
+        if isinstance(data, list):
+            return [self.to_camel(value) for value in data if value is not None]
+        return data
+
+    # ----- Doğrulama -----
+
+    def _check(self, message_type_id, action):
+        key = (message_type_id, action)
+        try:
+            return self._checks[key]
+        except KeyError:
+            pass
+        check = None
+        try:
+            validator = get_validator(message_type_id, action, self.ocpp_version)
+            check = _compile(validator.schema, validator.schema)
+        except _Unsupported:
+            pass
+        except (OSError, ValueError):
+            # Şema yok; validate_payload ValidationError üretecek
+            return None
+        self._checks[key] = check
+        return check
+
+    def validate(self, message):
+        check = self._check(message.message_type_id, message.action)
+        if check is None or not check(message.payload):
+            # Hata ayrıntısı ve Decimal gerektiren şemalar için ocpp'nin kendi yolu
+            validate_payload(message, self.ocpp_version)
+
+    def is_trusted(self, cp_id):
+        return self.trust_all or cp_id in self.trusted
+
+    def warm(self):
+        """Bütün şemaları başlangıçta derler; ilk mesaj diskten şema okumaz."""
+        compiled = fallback = 0
+        for name in sorted(os.listdir(_schema_dir(self.ocpp_version))):
+            action = name[:-len(".json")]
+            message_type_id = MessageType.Call
+            if action.endswith("Response"):
+                action, message_type_id = action[:-len("Response")], MessageType.CallResult
+            if self._check(message_type_id, action) is None:
+                fallback += 1
+            else:
+                compiled += 1
+        logger.info("🧩 OCPP şemaları hazır - derlenen: %d, jsonschema: %d, JSON: %s", compiled, fallback, self.backend)
+        return {"compiled": compiled, "jsonschema": fallback}
+
+    def stats(self):
+        return {"backend": self.backend, "schemas": len(self._checks), "trusted": "*" if self.trust_all else len(self.trusted)}
+
+
+default = Codec.from_env()
+
+
+class CodecMixin:
+    """ocpp ChargePoint'in çözme/doğrulama/kodlama yolunu `codec` üzerinden geçirir.
+
+    ocpp'deki route_message, _handle_call ve call ile aynı akış; sadece JSON, anahtar
+    dönüşümü ve doğrulama Codec'ten gelir. ChargePoint'ten önce miras alınır:
+    `class ChargePoint(CodecMixin, ocpp.v16.ChargePoint)`.
+    """
+
+    __slots__ = ()
+
+    codec = default
+
+    async def route_message(self, raw_msg):
+        try:
+            msg = self.codec.unpack(raw_msg)
+        except OCPPError as e:
+            LOGGER.exception("Unable to parse message: '%s', it doesn't seem "
+                             "to be valid OCPP: %s", raw_msg, e)
+            return
+
+        if msg.message_type_id == MessageType.Call:
+            try:
+                await self._handle_call(msg)
+            except OCPPError as error:
+                LOGGER.exception("Error while handling request '%s'", msg)
+                await self._send(self.codec.pack(msg.create_call_error(error)))
+        else:
+            self._response_queue.put_nowait(msg)
+
+    async def _handle_call(self, msg):
+        codec = self.codec
+        try:
+            handlers = self.route_map[msg.action]
+        except KeyError:
+            raise NotImplementedError(f"No handler for '{msg.action}' registered.")
+
+        validate = not handlers.get("_skip_schema_validation", False)
+        if validate:
+            codec.validate(msg)
+        snake_case_payload = codec.to_snake(msg.payload)
+
+        try:
+            handler = handlers["_on_action"]
+        except KeyError:
+            raise NotImplementedError(f"No handler for '{msg.action}' registered.")
+
+        try:
+            response = handler(**snake_case_payload)
+            if inspect.isawaitable(response):
+                response = await response
+        except Exception as e:
+            LOGGER.exception("Error while handling request '%s'", msg)
+            await self._send(codec.pack(msg.create_call_error(e)))
+            return
+
+        response = msg.create_call_result(codec.to_camel(asdict(response)))
+        # Cevabı kendi handler'ımız üretiyor; güvenilen istasyonlarda tekrar doğrulanmaz
+        if validate and not codec.is_trusted(self.id):
+            codec.validate(response)
+        await self._send(codec.pack(response))
+
+        handler = handlers.get("_after_action")
+        if handler is not None:
+            # after handler içinden call() yapılabilsin diye beklenmez
+            response = handler(**snake_case_payload)
+            if inspect.isawaitable(response):
+                asyncio.ensure_future(response)
+
+    async def call(self, payload, suppress=True):
+        codec = self.codec
+        call = Call(
+            unique_id=str(self._unique_id_generator()),
+            action=payload.__class__.__name__[:-7],
+            payload=codec.to_camel(asdict(payload)),
+        )
+        codec.validate(call)
+
+        async with self._call_lock:
+            await self._send(codec.pack(call))
+            try:
+                response = await self._get_specific_response(call.unique_id, self._response_timeout)
+            except asyncio.TimeoutError:
+                raise asyncio.TimeoutError(f"Waited {self._response_timeout}s for response on {codec.pack(call)}.")
+
+        if response.message_type_id == MessageType.CallError:
+            LOGGER.warning("Received a CALLError: %s'", response)
+            if suppress:
+                return
+            raise response.to_exception()
+        response.action = call.action
+        if not codec.is_trusted(self.id):
+            codec.validate(response)
+
+        cls = getattr(self._call_result, payload.__class__.__name__)
+        return cls(**codec.to_snake(response.payload))
@@ -0,0 +1,386 @@
+import asyncio
+import logging
+import os
+import time
+
+import asyncpg
+import asyncpg.pool
+
+import auth_cache
+import liveness
+import meter_samples
+import metrics
+import profiling
+import rollups
+
+logger = logging.getLogger("OCPP_Server")
+
+# ----- Sıcak sorgular: her havuz bağlantısında bir kez hazırlanır -----
+
+QUERIES = {
+    "user_exists": "SELECT 1 FROM users WHERE id_tag = $1",
+    # transactions.TransactionStore: id'ler bloklar halinde, satırlar toplu upsert ile
+    "allocate_transaction_ids": """
+        SELECT array_agg(nextval(pg_get_serial_sequence('transactions', 'id')))
+        FROM generate_series(1, $1)
+    """,
+    "upsert_transactions": """
+        INSERT INTO transactions (id, cp_id, id_tag, connector_id, start_value, start_time,
+                                  stop_value, stop_time, total_energy)
+        SELECT * FROM unnest($1::integer[], $2::text[], $3::text[], $4::integer[], $5::integer[],
+                             $6::timestamp[], $7::integer[], $8::timestamp[], $9::integer[])
+        ON CONFLICT (id) DO UPDATE
+        -- Stop bir kez yazılır; spool'dan sonra gelen eski (Active) satır onu silmez
+        SET stop_value = COALESCE(EXCLUDED.stop_value, transactions.stop_value),
+            stop_time = COALESCE(EXCLUDED.stop_time, transactions.stop_time),
+            total_energy = COALESCE(EXCLUDED.total_energy, transactions.total_energy)
+        -- Veritabanısız verilmiş bir id başka bir transaction'la çakışırsa üzerine yazılmaz;
+        -- dönmeyen id'ler çağıran tarafta reddedilmiş sayılır
+        WHERE transactions.cp_id = EXCLUDED.cp_id AND transactions.start_time = EXCLUDED.start_time
+        RETURNING id
+    """,
+    # Yerel id aralığında veritabanına zaten yazılmış en büyük id (kira dosyası kaybolsa da)
+    "max_transaction_id_between": "SELECT max(id) FROM transactions WHERE id >= $1 AND id < $2",
+    # Bu süreçte oturumu olmayan transaction'lar için (yeniden başlatma sonrası Stop);
+    # id başka istasyonunsa ya da stop zaten yazılmışsa dokunulmaz
+    "stop_transactions": """
+        UPDATE transactions
+        SET stop_value = s.stop_value,
+            stop_time = s.stop_time,
+            total_energy = s.stop_value - transactions.start_value
+        FROM unnest($1::integer[], $2::text[], $3::integer[], $4::timestamp[]) AS s(id, cp_id, stop_value, stop_time)
+        WHERE transactions.id = s.id AND transactions.cp_id = s.cp_id AND transactions.stop_time IS NULL
+        RETURNING transactions.id
+    """,
+}
+
+
+# Veritabanına ulaşılamıyor ya da şu an kabul etmiyor: aynı kayıt sonra tekrar denenebilir
+UNAVAILABLE = (
+    asyncpg.PostgresConnectionError,  # bağlantı koptu / kurulamadı
+    asyncpg.exceptions.OperatorInterventionError,  # kapanıyor, açılıyor, recovery
+    asyncpg.exceptions.InsufficientResourcesError,  # bağlantı sınırı, disk dolu
+    asyncpg.InterfaceError,  # havuz kapalı, bağlantı kullanılamaz
+    OSError,
+    asyncio.TimeoutError,
+)
+
+
+def unavailable(error):
+    """Hata veritabanına erişimle mi ilgili; değilse kaydın kendisinde (unique ihlali, aralık dışı değer).
+
+    asyncpg istemci tarafındaki kodlama hatasını (ör. SMALLINT'e sığmayan değer)
+    InterfaceError + ValueError olarak verir; o bir veri hatasıdır.
+    """
+    return isinstance(error, UNAVAILABLE) and not isinstance(error, ValueError)
+
+
+class Connection(asyncpg.Connection):
+    """Havuz bağlantısı; hazırlanmış sorgular `statements` içinde, isimle."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = {}
+
+
+async def init_connection(conn):
+    # Havuz her yeni bağlantıda çağırır. Hazırlama başarısız olursa (ör. tablo yok)
+    # o sorgu düz metin olarak çalışır; bağlantı yine kullanılabilir.
+    if os.getenv("DB_PREPARE", "1") == "0":
+        return
+    for name, query in QUERIES.items():
+        try:
+            conn.statements[name] = await conn.prepare(query)
+        except Exception as e:
+            logger.warning(f"⚠️ Sorgu hazırlanamadı - {name}: {str(e)}")
+
+
+def _statement(conn, name):
+    statements = getattr(conn, "statements", None)
+    return statements.get(name) if statements else None
+
+
+async def fetchval(conn, name, *args):
+    span = profiling.current()
+    started = time.perf_counter()
+    try:
+        statement = _statement(conn, name)
+        if statement is None:
+            return await conn.fetchval(QUERIES[name], *args)
+        return await statement.fetchval(*args)
+    finally:
+        if span is not None:
+            span.db += time.perf_counter() - started
+
+
+async def fetch(conn, name, *args):
+    span = profiling.current()
+    started = time.perf_counter()
+    try:
+        statement = _statement(conn, name)
+        if statement is None:
+            return await conn.fetch(QUERIES[name], *args)
+        return await statement.fetch(*args)
+    finally:
+        if span is not None:
+            span.db += time.perf_counter() - started
+
+
+async def execute(conn, name, *args):
+    span = profiling.current()
+    started = time.perf_counter()
+    try:
+        statement = _statement(conn, name)
+        if statement is None:
+            return await conn.execute(QUERIES[name], *args)
+        await statement.fetch(*args)
+        return statement.get_statusmsg()
+    finally:
+        if span is not None:
+            span.db += time.perf_counter() - started
+
+
+class Pool(asyncpg.pool.Pool):
+    """Bağlantı almak için geçen bekleme süresini ölçen havuz."""
+
+    async def _acquire(self, timeout):
+        started = time.perf_counter()
+        try:
+            return await super()._acquire(timeout)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.DB_ACQUIRE_SECONDS.observe(elapsed)
+            span = profiling.current()
+            if span is not None:
+                span.db += elapsed
+
+    def in_use(self):
+        return self.get_size() - self.get_idle_size()
+
+
+def connection_options():
+    return {
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASS"),
+        "database": os.getenv("DB_NAME"),
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+        # pgbouncer (transaction modu) arkasında DB_PREPARE=0 ve DB_STATEMENT_CACHE_SIZE=0
+        "statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100)),
+    }
+
+
+async def create_pool(min_size=None, max_size=None):
+    # asyncpg.create_pool ile aynı varsayılanlar; sadece havuz sınıfı farklı
+    return await Pool(
+        min_size=int(os.getenv("DB_POOL_MIN", 1)) if min_size is None else min_size,
+        max_size=int(os.getenv("DB_POOL_MAX", 10)) if max_size is None else max_size,
+        max_queries=50000,
+        max_inactive_connection_lifetime=300.0,
+        loop=None,
+        connection_class=Connection,
+        record_class=asyncpg.Record,
+        init=init_connection,
+        **connection_options()
+    )
+
+
+# ----- Şema: sürümlü migration'lar -----
+
+BASE_TABLES = """
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        id_tag VARCHAR(50) UNIQUE NOT NULL,
+        name VARCHAR(100),
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+
+    CREATE TABLE IF NOT EXISTS transactions (
+        id SERIAL PRIMARY KEY,
+        id_tag VARCHAR(50) NOT NULL,
+        connector_id INTEGER NOT NULL,
+        start_value INTEGER NOT NULL,
+        stop_value INTEGER,
+        start_time TIMESTAMP NOT NULL,
+        stop_time TIMESTAMP,
+        total_energy INTEGER,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+
+    CREATE TABLE IF NOT EXISTS status_notifications (
+        id SERIAL PRIMARY KEY,
+        cp_id TEXT NOT NULL,
+        connector_id INTEGER,
+        status TEXT,
+        error_code TEXT,
+        vendor_id TEXT,
+        timestamp TIMESTAMP,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+
+    CREATE TABLE IF NOT EXISTS boot_notifications (
+        id SERIAL PRIMARY KEY,
+        cp_id TEXT NOT NULL,
+        model TEXT,
+        vendor TEXT,
+        timestamp TIMESTAMP,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+
+    CREATE TABLE IF NOT EXISTS heartbeats (
+        id SERIAL PRIMARY KEY,
+        cp_id TEXT NOT NULL,
+        timestamp TIMESTAMP,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+
+    CREATE TABLE IF NOT EXISTS authorizations (
+        id SERIAL PRIMARY KEY,
+        cp_id TEXT NOT NULL,
+        id_tag VARCHAR(50),
+        status TEXT,
+        timestamp TIMESTAMP,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+
+    CREATE TABLE IF NOT EXISTS meter_values (
+        id SERIAL PRIMARY KEY,
+        cp_id TEXT NOT NULL,
+        connector_id INTEGER,
+        meter_value TEXT,
+        timestamp TIMESTAMP,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+
+    CREATE TABLE IF NOT EXISTS firmware_status_notifications (
+        id SERIAL PRIMARY KEY,
+        cp_id TEXT NOT NULL,
+        status TEXT,
+        timestamp TIMESTAMP DEFAULT NOW(),
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+
+    CREATE TABLE IF NOT EXISTS diagnostics_status_notifications (
+        id SERIAL PRIMARY KEY,
+        cp_id TEXT NOT NULL,
+        status TEXT,
+        timestamp TIMESTAMP DEFAULT NOW(),
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+
+    CREATE TABLE IF NOT EXISTS reservations (
+        id SERIAL PRIMARY KEY,
+        cp_id TEXT NOT NULL,
+        connector_id INTEGER,
+        id_tag VARCHAR(50),
+        expiry_date TIMESTAMP,
+        status TEXT,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+"""
+
+# İstasyonun verdiği reservationId ayrı kolonda; OCPP 1.6 aynı id ile rezervasyonun
+# yenilenmesine izin verir, SERIAL birincil anahtara yazılınca ikinci ReserveNow çakışıyordu.
+# Eski satırlarda id zaten reservationId; sekans hiç ilerlemediği için en büyük id'ye taşınır.
+RESERVATION_ID = """
+    ALTER TABLE reservations ADD COLUMN IF NOT EXISTS reservation_id INTEGER;
+    UPDATE reservations SET reservation_id = id WHERE reservation_id IS NULL;
+    SELECT setval(pg_get_serial_sequence('reservations', 'id'), COALESCE(max(id), 0) + 1, false)
+    FROM reservations;
+"""
+
+# (isim, tablo, tanım). Büyük tablolarda yazmaları kilitlememek için CONCURRENTLY ile kurulur.
+HOT_INDEXES = [
+    ("transactions_id_tag_idx", "transactions", "(id_tag)"),
+    ("transactions_cp_id_start_idx", "transactions", "(cp_id, start_time)"),
+    ("status_notifications_cp_ts_idx", "status_notifications", "(cp_id, connector_id, timestamp)"),
+    ("boot_notifications_cp_ts_idx", "boot_notifications", "(cp_id, timestamp)"),
+    ("authorizations_cp_ts_idx", "authorizations", "(cp_id, timestamp)"),
+    ("authorizations_id_tag_idx", "authorizations", "(id_tag)"),
+    ("firmware_status_notifications_cp_ts_idx", "firmware_status_notifications", "(cp_id, timestamp)"),
+    ("diagnostics_status_notifications_cp_ts_idx", "diagnostics_status_notifications", "(cp_id, timestamp)"),
+    ("reservations_cp_expiry_idx", "reservations", "(cp_id, expiry_date)"),
+]
+
+# Sadece eklenen tablolarda zaman kolonu fiziksel sırayla uyumlu; BRIN birkaç sayfada
+# zaman aralığı taramasını daraltır. İstasyonun gönderdiği `timestamp` yerine created_at.
+BRIN_INDEXES = [
+    ("transactions_start_time_brin", "transactions", "USING brin (start_time)"),
+    ("status_notifications_created_brin", "status_notifications", "USING brin (created_at)"),
+    ("boot_notifications_created_brin", "boot_notifications", "USING brin (created_at)"),
+    ("heartbeats_created_brin", "heartbeats", "USING brin (created_at)"),
+    ("authorizations_created_brin", "authorizations", "USING brin (created_at)"),
+    ("meter_values_created_brin", "meter_values", "USING brin (created_at)"),
+]
+
+# (sürüm, isim, adım). Adım SQL metniyse tek transaction'da çalışır; index listesiyse
+# her index CONCURRENTLY ile ayrı kurulur (transaction içinde yapılamaz).
+# Yayınlanmış bir migration değiştirilmez; değişiklik yeni sürüm olarak eklenir.
+MIGRATIONS = [
+    (1, "base_tables", BASE_TABLES),
+    (2, "meter_samples", meter_samples.DDL),
+    (3, "users_notify", auth_cache.DDL),
+    (4, "charge_point_liveness", liveness.DDL),
+    (5, "transactions_cp_id", "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS cp_id TEXT;"),
+    (6, "hot_indexes", HOT_INDEXES),
+    (7, "brin_time_indexes", BRIN_INDEXES),
+    # Partitioned tabloda CONCURRENTLY yok; BRIN kurulumu hızlı olduğu için normal index
+    (8, "meter_samples_brin", "CREATE INDEX IF NOT EXISTS meter_samples_ts_brin ON meter_samples USING brin (timestamp);"),
+    (9, "energy_hourly", rollups.DDL),
+    (10, "reservations_reservation_id", RESERVATION_ID),
+]
+
+MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT NOW()
+    );
+"""
+
+# Birden fazla worker aynı anda başlarsa migration'ları sadece biri çalıştırır
+MIGRATION_LOCK = 0x6F637070
+
+
+async def _create_index_concurrently(conn, name, table, definition):
+    # Yarıda kalmış CONCURRENTLY kurulumu geçersiz bir index bırakır; IF NOT EXISTS onu atlardı
+    invalid = await conn.fetchval(
+        "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)", name
+    )
+    if invalid:
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}")
+
+
+async def migrate(conn):
+    """Uygulanmamış migration'ları sırayla çalıştırır; uygulanan sürümleri döner."""
+    await conn.execute(MIGRATIONS_TABLE)
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK)
+    try:
+        applied = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+        done = []
+        for version, name, step in MIGRATIONS:
+            if version in applied:
+                continue
+            logger.info(f"🧱 Migration uygulanıyor - {version}: {name}")
+            if isinstance(step, str):
+                async with conn.transaction():
+                    await conn.execute(step)
+                    await conn.execute("INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name)
+            else:
+                for index in step:
+                    await _create_index_concurrently(conn, *index)
+                await conn.execute("INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name)
+            done.append(version)
+        return done
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK)
+
+
+async def migrate_database():
+    # Havuzdan önce ayrı bir bağlantıyla; havuz bağlantıları hazırlarken tablolar var olsun
+    conn = await asyncpg.connect(**connection_options())
+    try:
+        return await migrate(conn)
+    finally:
+        await conn.close()
@@ -0,0 +1,126 @@
+import asyncio
+import http
+import json
+import logging
+import os
+from urllib.parse import parse_qs
+
+import metrics
+import profiling
+
+logger = logging.getLogger("OCPP_Server")
+
+# Websocket ile aynı portta düz HTTP: path -> async handler(path, request_headers)
+ROUTES = {}
+# /ready için kontroller: (isim, async fonksiyon -> bool); server.main() ekler
+ready_checks = []
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", 2))
+# /debug/* uçları sadece bu token tanımlıysa ve "Authorization: Bearer <token>" ile açılır
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")
+
+
+def route(path):
+    def register(handler):
+        ROUTES[path] = handler
+        return handler
+    return register
+
+
+def json_response(status, body):
+    return status, [("Content-Type", "application/json")], json.dumps(body).encode()
+
+
+def text_response(status, body):
+    return status, [("Content-Type", "text/plain; charset=utf-8")], body.encode()
+
+
+def query(path):
+    return {key: values[-1] for key, values in parse_qs(path.partition("?")[2]).items()}
+
+
+async def process_request(path, request_headers):
+    """websockets.serve(process_request=...) kancası; None dönerse handshake devam eder."""
+    # İstasyon id'si path'ten geldiği için websocket upgrade'i olan istekler hiç yakalanmaz
+    if request_headers.get("Upgrade", "").lower() == "websocket":
+        return None
+    handler = ROUTES.get(path.split("?", 1)[0])
+    if handler is not None and path.startswith("/debug/") and not _authorized(request_headers):
+        handler = None
+    if handler is None:
+        return http.HTTPStatus.NOT_FOUND, [("Content-Type", "text/plain")], b"Not Found\n"
+    try:
+        return await handler(path, request_headers)
+    except Exception as e:
+        logger.error(f"⚠️ HTTP isteği hatası - {path}: {str(e)}")
+        return http.HTTPStatus.INTERNAL_SERVER_ERROR, [("Content-Type", "text/plain")], b"Internal Server Error\n"
+
+
+def _authorized(request_headers):
+    return bool(DEBUG_TOKEN) and request_headers.get("Authorization", "") == f"Bearer {DEBUG_TOKEN}"
+
+
+@route("/health")
+async def health(path, request_headers):
+    # Süreç ayakta ve event loop cevap veriyor
+    return json_response(http.HTTPStatus.OK, {"status": "ok", "pid": os.getpid()})
+
+
+async def _check(name, check):
+    try:
+        return bool(await asyncio.wait_for(check(), READY_TIMEOUT))
+    except Exception as e:
+        logger.warning(f"⚠️ Hazırlık kontrolü başarısız - {name}: {str(e)}")
+        return False
+
+
+@route("/ready")
+async def ready(path, request_headers):
+    results = await asyncio.gather(*(_check(name, check) for name, check in ready_checks))
+    checks = {name: ok for (name, _), ok in zip(ready_checks, results)}
+    status = http.HTTPStatus.OK if all(checks.values()) else http.HTTPStatus.SERVICE_UNAVAILABLE
+    return json_response(status, {"ready": status == http.HTTPStatus.OK, "checks": checks})
+
+
+@route("/metrics")
+async def metrics_endpoint(path, request_headers):
+    return http.HTTPStatus.OK, [("Content-Type", "text/plain; version=0.0.4; charset=utf-8")], metrics.render()
+
+
+# ----- Profiling: yeniden başlatmadan aç/kapat -----
+
+@route("/debug/profiling")
+async def debug_profiling(path, request_headers):
+    """?trace=1|0&slow_ms=50&sampler=1|0&hz=100&slow_callbacks=1|0&callback_ms=100"""
+    params = query(path)
+    profiler = profiling.profiler
+    if "slow_ms" in params:
+        profiler.slow_threshold = float(params["slow_ms"]) / 1000
+    if "trace" in params:
+        profiler.tracing = params["trace"] == "1"
+    if params.get("sampler") == "1":
+        profiler.start_sampling(int(params.get("hz", 100)))
+    elif params.get("sampler") == "0":
+        profiler.stop_sampling()
+    if params.get("slow_callbacks") == "1":
+        profiler.enable_slow_callbacks(float(params.get("callback_ms", 100)) / 1000)
+    elif params.get("slow_callbacks") == "0":
+        profiler.disable_slow_callbacks()
+    return json_response(http.HTTPStatus.OK, profiler.status())
+
+
+@route("/debug/slow-calls")
+async def debug_slow_calls(path, request_headers):
+    profiler = profiling.profiler
+    return json_response(http.HTTPStatus.OK, {
+        "calls": list(profiler.slow_calls),
+        "callbacks": list(profiler.slow_callbacks),
+    })
+
+
+@route("/debug/flamegraph")
+async def debug_flamegraph(path, request_headers):
+    """Katlanmış stack'ler (flamegraph.pl, speedscope). ?source=sampler|phases"""
+    profiler = profiling.profiler
+    if query(path).get("source") == "phases":
+        return text_response(http.HTTPStatus.OK, profiler.phases_folded())
+    return text_response(http.HTTPStatus.OK, profiler.sampled_folded())
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from array import array
+from datetime import datetime
+
+logger = logging.getLogger("OCPP_Server")
+
+DDL = """
+    CREATE TABLE IF NOT EXISTS charge_point_liveness (
+        cp_id TEXT PRIMARY KEY,
+        last_seen TIMESTAMP NOT NULL,
+        online BOOLEAN NOT NULL,
+        updated_at TIMESTAMP DEFAULT NOW()
+    );
+"""
+
+# Tek sorguda bütün değişen istasyonlar; satır başına round-trip yok
+UPSERT = """
+    INSERT INTO charge_point_liveness (cp_id, last_seen, online, updated_at)
+    SELECT cp_id, last_seen, online, NOW()
+    FROM unnest($1::text[], $2::timestamp[], $3::boolean[]) AS t(cp_id, last_seen, online)
+    ON CONFLICT (cp_id) DO UPDATE
+    SET last_seen = EXCLUDED.last_seen, online = EXCLUDED.online, updated_at = NOW()
+"""
+
+
+TABLE = "charge_point_liveness"
+
+
+async def upsert(conn, rows):
+    """(cp_id, last_seen, online) satırları; spool'dan yüklenirken de bu kullanılır."""
+    await conn.execute(UPSERT, *(list(column) for column in zip(*rows)))
+
+
+class Liveness:
+    """İstasyonların son görülme zamanı, bellekte.
+
+    Heartbeat başına veritabanı yazılmaz: her istasyon sabit bir slot'a sahiptir ve
+    değerler düz `array`'lerde tutulur. Değişen slot'lar `flush_interval` saniyede bir
+    `charge_point_liveness` tablosuna tek sorguyla yazılır. Çevrimdışı tespiti bir
+    timer wheel ile yapılır: her istasyon wheel'de en fazla bir kez bulunur, kovası
+    çaldığında gerçek son tarihi kontrol edilir, gerekirse yeniden yerleştirilir.
+    Bağlantısı kopan istasyonun slot'u çevrimdışı durumu yazıldıktan sonra boşaltılır
+    ve yeni istasyonlara verilir; geçici id'li istasyonlar dizileri büyütmez.
+    """
+
+    def __init__(self, pool=None, base_interval=30, max_interval=900, target_rate=200.0, grace=2.5,
+                 flush_interval=10.0, tick=1.0, wheel_size=512):
+        self.pool = pool
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.target_rate = target_rate
+        self.grace = grace
+        self.flush_interval = flush_interval
+        self.tick = tick
+        self.slots = {}  # cp_id -> slot
+        self.ids = []  # slot -> cp_id (boş slot'ta None)
+        self.free = []  # yeniden verilecek slot'lar
+        self.released = set()  # bağlantısı kopmuş; yazılınca boşaltılacak slot'lar
+        self.last_seen = array("d")  # time.monotonic(); yazarken _mono_offset ile duvar saatine çevrilir
+        self.deadline = array("d")
+        self.interval = array("H")  # istasyona verilen heartbeat aralığı (s)
+        self.online = bytearray()
+        self.queued = bytearray()  # slot şu an wheel'de mi
+        self.online_count = 0
+        self.dirty = set()
+        self.writer = None  # WriteBehind verilmişse satırlar onun üzerinden (spool dahil)
+        self.wheel = [[] for _ in range(wheel_size)]
+        self._cursor = int(time.monotonic() / tick)
+        self._mono_offset = time.time() - time.monotonic()
+        self._task = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            base_interval=int(os.getenv("HEARTBEAT_INTERVAL", 30)),
+            max_interval=int(os.getenv("HEARTBEAT_MAX_INTERVAL", 900)),
+            target_rate=float(os.getenv("HEARTBEAT_TARGET_RATE", 200)),
+            grace=float(os.getenv("HEARTBEAT_GRACE", 2.5)),
+            flush_interval=float(os.getenv("LIVENESS_FLUSH_INTERVAL", 10)),
+        )
+
+    def heartbeat_interval(self):
+        # Bağlı istasyon arttıkça aralık uzar; toplam heartbeat hızı target_rate civarında kalır
+        # ±%10 jitter: aynı anda boot eden istasyonlar aynı anda heartbeat atmasın.
+        # Jitter sınırlamadan önce; aralık base_interval altına ya da max_interval üstüne çıkmaz
+        interval = max(self.base_interval, self.online_count / self.target_rate) * random.uniform(0.9, 1.1)
+        return int(min(max(interval, self.base_interval), self.max_interval))
+
+    def _slot(self, cp_id):
+        slot = self.slots.get(cp_id)
+        if slot is None and self.free:
+            # Wheel'de eski sahibinden kalan giriş olabilir; queued olduğu gibi bırakılır,
+            # kova çaldığında yeni son tarihe göre yeniden yerleştirilir
+            slot = self.slots[cp_id] = self.free.pop()
+            self.ids[slot] = cp_id
+            self.last_seen[slot] = 0.0
+            self.deadline[slot] = 0.0
+            self.interval[slot] = self.base_interval
+            self.online[slot] = 0
+        elif slot is None:
+            slot = self.slots[cp_id] = len(self.ids)
+            self.ids.append(cp_id)
+            self.last_seen.append(0.0)
+            self.deadline.append(0.0)
+            self.interval.append(self.base_interval)
+            self.online.append(0)
+            self.queued.append(0)
+        return slot
+
+    def _release(self):
+        # Son durumu yazılmış, bu arada geri bağlanmamış slot'lar boşaltılır
+        for slot in [slot for slot in self.released if slot not in self.dirty]:
+            self.released.discard(slot)
+            del self.slots[self.ids[slot]]
+            self.ids[slot] = None
+            self.free.append(slot)
+
+    def touch(self, cp_id, interval=None):
+        """İstasyondan mesaj geldi: son görülme zamanını ve çevrimdışı son tarihini günceller."""
+        slot = self._slot(cp_id)
+        self.released.discard(slot)
+        if interval is not None:
+            self.interval[slot] = min(interval, 65535)
+        now = time.monotonic()
+        self.last_seen[slot] = now
+        self.deadline[slot] = now + self.interval[slot] * self.grace
+        self.dirty.add(slot)
+        if not self.online[slot]:
+            self.online[slot] = 1
+            self.online_count += 1
+            if not self.queued[slot]:
+                self._schedule(slot)
+
+    def disconnected(self, cp_id):
+        slot = self.slots.get(cp_id)
+        if slot is None:
+            return
+        if self.online[slot]:
+            self._mark_offline(slot)
+        self.released.add(slot)
+
+    def is_online(self, cp_id):
+        slot = self.slots.get(cp_id)
+        return slot is not None and bool(self.online[slot])
+
+    def last_seen_at(self, cp_id):
+        slot = self.slots.get(cp_id)
+        if slot is None or not self.last_seen[slot]:
+            return None
+        return datetime.utcfromtimestamp(self.last_seen[slot] + self._mono_offset)
+
+    def _schedule(self, slot):
+        tick = max(int(self.deadline[slot] / self.tick), self._cursor + 1)
+        self.wheel[tick % len(self.wheel)].append(slot)
+        self.queued[slot] = 1
+
+    def _mark_offline(self, slot):
+        self.online[slot] = 0
+        self.online_count -= 1
+        self.dirty.add(slot)
+
+    def advance(self, now=None):
+        """Wheel'i şu ana kadar ilerletir; süresi dolan istasyonları çevrimdışı yapar."""
+        now = time.monotonic() if now is None else now
+        target = int(now / self.tick)
+        while self._cursor < target:
+            self._cursor += 1
+            bucket = self.wheel[self._cursor % len(self.wheel)]
+            if not bucket:
+                continue
+            self.wheel[self._cursor % len(self.wheel)] = []
+            for slot in bucket:
+                self.queued[slot] = 0
+                if not self.online[slot]:
+                    continue
+                if self.deadline[slot] <= now:
+                    logger.warning(f"📴 Heartbeat zaman aşımı, çevrimdışı - ID: {self.ids[slot]}")
+                    self._mark_offline(slot)
+                else:
+                    self._schedule(slot)
+
+    async def flush(self):
+        # Veritabanı (ya da spool) gelene kadar değişen slot'lar (ve boşaltılacaklar) bekler
+        spool = self.writer.spool if self.writer is not None else None
+        if self.pool is None and spool is None:
+            return
+        if not self.dirty:
+            self._release()
+            return
+        slots, self.dirty = self.dirty, set()
+        rows = [
+            (self.ids[slot], datetime.utcfromtimestamp(self.last_seen[slot] + self._mono_offset),
+             bool(self.online[slot]))
+            for slot in slots
+        ]
+        if self.writer is not None:
+            written = await self.writer.write(TABLE, rows)
+        else:
+            try:
+                async with self.pool.acquire() as conn:
+                    await upsert(conn, rows)
+                written = True
+            except Exception as e:
+                logger.error(f"⚠️ Liveness yazma hatası - İstasyon: {len(rows)}: {str(e)}")
+                written = False
+        if not written:
+            # Bir sonraki turda tekrar denensin
+            self.dirty.update(slots)
+            return
+        self._release()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            await asyncio.sleep(self.tick)
+            self.advance()
+            if time.monotonic() - last_flush >= self.flush_interval:
+                last_flush = time.monotonic()
+                await self.flush()
+
+    def stats(self):
+        return {"stations": len(self.slots), "online": self.online_count, "pending_flush": len(self.dirty)}
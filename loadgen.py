@@ -0,0 +1,353 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import multiprocessing as mp
+import random
+import resource
+import ssl
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import websockets
+
+import client
+
+logger = logging.getLogger("OCPP_LoadGen")
+
+SCENARIOS = ("boot", "heartbeat", "transactions")
+RAMP_PROFILES = ("instant", "linear", "step")
+
+
+class LatencyHistogram:
+    """Logaritmik kovalı gecikme histogramı (ms).
+
+    Sabit bellek kullanır ve process'ler arasında `to_dict()`/`merge()` ile birleştirilebilir.
+    Yüzdelikler kova üst sınırıyla döner; hata payı `GROWTH` oranı kadardır (%5).
+    """
+
+    MIN_MS = 0.01
+    GROWTH = 1.05
+    BUCKETS = 400  # 0.01 ms .. ~3 saat
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.min = math.inf
+
+    def record(self, ms):
+        if ms <= self.MIN_MS:
+            index = 0
+        else:
+            index = min(int(math.log(ms / self.MIN_MS, self.GROWTH)) + 1, self.BUCKETS - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+        if ms < self.min:
+            self.min = ms
+
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        target = self.count * p / 100.0
+        seen = 0
+        for index, bucket in enumerate(self.counts):
+            seen += bucket
+            if seen >= target:
+                return min(self.MIN_MS * self.GROWTH ** index, self.max)
+        return self.max
+
+    def merge(self, other):
+        for index, bucket in enumerate(other.counts):
+            self.counts[index] += bucket
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.min = min(self.min, other.min)
+
+    def to_dict(self):
+        return {"counts": self.counts, "count": self.count, "total": self.total, "max": self.max, "min": self.min}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.counts = list(data["counts"])
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.max = data["max"]
+        histogram.min = data["min"]
+        return histogram
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50), 3),
+            "p95_ms": round(self.percentile(95), 3),
+            "p99_ms": round(self.percentile(99), 3),
+            "max_ms": round(self.max, 3),
+        }
+
+
+class Stats:
+    """Bir process'in topladığı sonuçlar: action başına histogram ve hata sayıları."""
+
+    def __init__(self):
+        self.latency = {}
+        self.errors = {}
+        self.connected = 0
+        self.connect_failures = 0
+
+    def record(self, action, ms):
+        histogram = self.latency.get(action)
+        if histogram is None:
+            histogram = self.latency[action] = LatencyHistogram()
+        histogram.record(ms)
+
+    def error(self, action):
+        self.errors[action] = self.errors.get(action, 0) + 1
+
+    def to_dict(self):
+        return {
+            "latency": {action: h.to_dict() for action, h in self.latency.items()},
+            "errors": self.errors,
+            "connected": self.connected,
+            "connect_failures": self.connect_failures,
+        }
+
+    def merge_dict(self, data):
+        for action, histogram in data["latency"].items():
+            if action in self.latency:
+                self.latency[action].merge(LatencyHistogram.from_dict(histogram))
+            else:
+                self.latency[action] = LatencyHistogram.from_dict(histogram)
+        for action, count in data["errors"].items():
+            self.errors[action] = self.errors.get(action, 0) + count
+        self.connected += data["connected"]
+        self.connect_failures += data["connect_failures"]
+
+
+class MeasuredChargePoint(client.ChargePoint):
+    """Her CALL'un gidiş-dönüş süresini action bazında kaydeden istemci."""
+
+    def __init__(self, id, connection, stats, response_timeout=30):
+        super().__init__(id, connection, response_timeout)
+        self.stats = stats
+
+    async def call(self, payload, suppress=True):
+        action = payload.__class__.__name__[:-7]
+        started = time.perf_counter()
+        try:
+            response = await super().call(payload, suppress=False)
+        except Exception:
+            self.stats.error(action)
+            if suppress:
+                return None
+            raise
+        self.stats.record(action, (time.perf_counter() - started) * 1000)
+        return response
+
+
+def start_offset(index, args):
+    # İstasyonun test başlangıcına göre bağlanacağı saniye
+    if args.ramp_profile == "instant" or args.ramp_rate <= 0:
+        return 0.0
+    if args.ramp_profile == "step":
+        return (index // args.step_size) * args.step_interval
+    return index / args.ramp_rate
+
+
+async def run_station(cp_id, args, stats, deadline):
+    ssl_context = None
+    if args.url.startswith("wss://"):
+        ssl_context = ssl.create_default_context()
+        if args.insecure:
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+
+    started = time.perf_counter()
+    try:
+        ws = await websockets.connect(
+            f"{args.url}/{cp_id}",
+            subprotocols=["ocpp1.6"],
+            ssl=ssl_context,
+            open_timeout=args.timeout,
+            ping_interval=None,
+            compression=None,
+        )
+    except Exception:
+        stats.connect_failures += 1
+        return
+    stats.record("Connect", (time.perf_counter() - started) * 1000)
+    stats.connected += 1
+
+    cp = MeasuredChargePoint(cp_id, ws, stats, response_timeout=args.timeout)
+    reader = asyncio.create_task(cp.start())
+    try:
+        await cp.send_boot_notification()
+        if args.scenario == "boot":
+            # Boot fırtınası: bağlı kal, ara sıra heartbeat
+            while time.monotonic() < deadline:
+                await asyncio.sleep(min(args.heartbeat_interval, max(0.0, deadline - time.monotonic())))
+                if time.monotonic() < deadline:
+                    await cp.send_heartbeat()
+        elif args.scenario == "heartbeat":
+            # İlk heartbeat'leri dağıt; hepsi aynı anda gelmesin
+            await asyncio.sleep(random.uniform(0, args.heartbeat_interval))
+            while time.monotonic() < deadline:
+                await cp.send_heartbeat()
+                await asyncio.sleep(args.heartbeat_interval)
+        else:
+            await run_transactions(cp, args, deadline)
+    except Exception as e:
+        logger.debug(f"{cp_id} hata: {e}")
+    finally:
+        reader.cancel()
+        await ws.close()
+
+
+async def run_transactions(cp, args, deadline):
+    interval = 1.0 / args.meter_hz
+    energy = 0
+    await cp.send_status_notification(1, "Available")
+    while time.monotonic() < deadline:
+        await cp.call(client.call.AuthorizePayload(id_tag=args.id_tag))
+        start_tx = await cp.start_transaction(1, args.id_tag, meter_start=energy)
+        tx_id = start_tx.transaction_id if start_tx else None
+        await cp.send_status_notification(1, "Charging")
+        for _ in range(args.samples_per_tx):
+            if time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(interval)
+            energy += int(args.power_w * interval / 3600) or 1
+            await cp.send_meter_values(1, energy, transaction_id=tx_id, power_w=args.power_w)
+        if tx_id is not None:
+            await cp.stop_transaction(tx_id, energy)
+        await cp.send_status_notification(1, "Available")
+
+
+async def run_range(first, last, args, test_start):
+    """`first`..`last` aralığındaki istasyonları ramp profiline göre başlatır."""
+    stats = Stats()
+    loop = asyncio.get_running_loop()
+    deadline = time.monotonic() + args.duration - (time.time() - test_start)
+    tasks = []
+    for index in range(first, last):
+        delay = test_start + start_offset(index, args) - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if time.monotonic() >= deadline:
+            break
+        cp_id = f"{args.prefix}{index}"
+        tasks.append(loop.create_task(run_station(cp_id, args, stats, deadline)))
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return stats
+
+
+def raise_fd_limit():
+    # On binlerce soket için açık dosya limiti yükseltilir
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def _process_main(first, last, args, test_start):
+    quiet_logging(args)
+    raise_fd_limit()
+    return asyncio.run(run_range(first, last, args, test_start)).to_dict()
+
+
+def quiet_logging(args):
+    # Yük altında istemci ve ocpp logları ölçümü bozar; hatalar zaten Stats'ta sayılıyor
+    if args.verbose:
+        return
+    logging.getLogger("ocpp").setLevel(logging.WARNING)
+    logging.getLogger("websockets").setLevel(logging.WARNING)
+    logging.getLogger("OCPP_Client").setLevel(logging.CRITICAL)
+
+
+def run(args):
+    """Testi çalıştırır ve birleştirilmiş sonuçları dict olarak döner."""
+    quiet_logging(args)
+    raise_fd_limit()
+    test_start = time.time() + 0.5
+    total = args.stations
+    stats = Stats()
+    if args.processes <= 1:
+        stats = asyncio.run(run_range(0, total, args, test_start))
+    else:
+        # İstasyonlar process'lere aralıklı bölünür; ramp sırası korunur
+        ranges = []
+        per_process = math.ceil(total / args.processes)
+        for first in range(0, total, per_process):
+            ranges.append((first, min(first + per_process, total)))
+        with ProcessPoolExecutor(max_workers=len(ranges), mp_context=mp.get_context("fork")) as pool:
+            futures = [pool.submit(_process_main, first, last, args, test_start) for first, last in ranges]
+            for future in futures:
+                stats.merge_dict(future.result())
+    elapsed = time.time() - test_start
+
+    messages = sum(h.count for action, h in stats.latency.items() if action != "Connect")
+    return {
+        "scenario": args.scenario,
+        "stations": total,
+        "processes": args.processes,
+        "duration_s": round(elapsed, 3),
+        "connected": stats.connected,
+        "connect_failures": stats.connect_failures,
+        "messages": messages,
+        "throughput_msg_s": round(messages / elapsed, 1) if elapsed > 0 else 0.0,
+        "errors": stats.errors,
+        "actions": {action: h.summary() for action, h in sorted(stats.latency.items())},
+    }
+
+
+def print_report(result):
+    print(f"Senaryo: {result['scenario']}, İstasyon: {result['stations']}, Bağlanan: {result['connected']}, "
+          f"Bağlanamayan: {result['connect_failures']}, Süre: {result['duration_s']} s")
+    print(f"Mesaj: {result['messages']}, Throughput: {result['throughput_msg_s']} msg/s, Hatalar: {result['errors']}")
+    print(f"{'Action':<28}{'count':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for action, s in result["actions"].items():
+        print(f"{action:<28}{s['count']:>10}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}{s['max_ms']:>10}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="OCPP 1.6 yük testi: çok sayıda sanal istasyon")
+    parser.add_argument("--url", default="ws://127.0.0.1:8080", help="Sunucu adresi (istasyon id'si sona eklenir)")
+    parser.add_argument("--stations", type=int, default=1000)
+    parser.add_argument("--processes", type=int, default=1, help="İstasyonları bölecek process sayısı")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="heartbeat")
+    parser.add_argument("--duration", type=float, default=60.0, help="Toplam test süresi (s), ramp dahil")
+    parser.add_argument("--ramp-profile", choices=RAMP_PROFILES, default="linear")
+    parser.add_argument("--ramp-rate", type=float, default=500.0, help="linear: saniyede bağlanan istasyon")
+    parser.add_argument("--step-size", type=int, default=1000, help="step: her adımda bağlanan istasyon")
+    parser.add_argument("--step-interval", type=float, default=5.0, help="step: adımlar arası saniye")
+    parser.add_argument("--heartbeat-interval", type=float, default=1.0)
+    parser.add_argument("--meter-hz", type=float, default=1.0, help="transactions: saniyede MeterValues")
+    parser.add_argument("--samples-per-tx", type=int, default=60)
+    parser.add_argument("--power-w", type=float, default=11000.0)
+    parser.add_argument("--id-tag", default="TEST_TAG_123")
+    parser.add_argument("--prefix", default="LOAD_")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--insecure", action="store_true", help="wss için sertifika doğrulamasını kapat")
+    parser.add_argument("--output", help="Sonuçların yazılacağı JSON dosyası")
+    parser.add_argument("--verbose", action="store_true")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    result = run(args)
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
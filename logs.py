@@ -0,0 +1,221 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+logger = logging.getLogger("OCPP_Server")
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# LogRecord'un kendi alanları; bunların dışında kalanlar (extra=...) JSON'a alan olarak eklenir
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Her kayıt tek satır JSON: ts, level, logger, msg ve extra alanları (cp_id, action, ...)."""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Kaydı formatlamadan kuyruğa bırakır; mesaj listener thread'inde oluşturulur.
+
+    Standart QueueHandler mesajı çağıran thread'de (event loop) formatlar. Burada
+    argümanlar olduğu gibi taşınır, bu yüzden log argümanları değişmez değerler olmalı.
+    Kuyruk doluysa kayıt düşürülür; event loop log yüzünden hiç beklemez.
+    """
+
+    def __init__(self, queue_):
+        super().__init__(queue_)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # traceback nesnesi thread'ler arası taşınmaz; metne burada çevrilir
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+_listener = None
+
+
+def setup(level=None, fmt=None, queue_size=None):
+    """Root logger'ı kuyruk + arka plan thread'i ile yazacak şekilde kurar."""
+    global _handler, _listener
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    fmt = fmt or os.getenv("LOG_FORMAT", "json")
+    queue_size = queue_size or int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    stop()
+    _handler = _QueueHandler(queue.Queue(queue_size))
+    root = logging.getLogger()
+    root.handlers[:] = [_handler]
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(_handler.queue, output)
+    _listener.start()
+
+
+def stop():
+    # Kuyrukta kalanları yazar; çıkışta ve worker process bitince çağrılır
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _after_fork():
+    # fork'ta listener thread'i çocuğa geçmez; çocuk kendi kuyruğu ve thread'i ile devam eder
+    global _listener
+    if _handler is None or _listener is None:
+        return
+    _handler.queue = queue.Queue(_handler.queue.maxsize)
+    _listener = logging.handlers.QueueListener(_handler.queue, *_listener.handlers)
+    _listener.start()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(stop)
+
+
+def dropped():
+    return _handler.dropped if _handler is not None else 0
+
+
+def queue_depth():
+    return _handler.queue.qsize() if _handler is not None else 0
+
+
+def _level(value):
+    if isinstance(value, int):
+        return value
+    level = logging.getLevelName(str(value).upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Bilinmeyen log seviyesi: {value}")
+    return level
+
+
+class StationLog:
+    """İstasyon bazlı log: çalışırken seviye değiştirme ve yüksek hacimli olaylarda örnekleme.
+
+    `set_level(cp_id, "DEBUG")` sadece o istasyonun kayıtlarını (ocpp kütüphanesinin ham
+    mesaj logları dahil) açar; diğerleri genel seviyede kalır. `sampled_actions`
+    içindeki olayların INFO ve altı kayıtları istasyon başına `sample_every`'de bir
+    yazılır; seviyesi ayarlanmış istasyonlarda örnekleme yapılmaz.
+    """
+
+    def __init__(self, sample_every=100, sampled_actions=("Heartbeat", "MeterValues"), ocpp_level=logging.WARNING):
+        self.sample_every = max(1, sample_every)
+        self.sampled_actions = frozenset(sampled_actions)
+        self.ocpp_level = ocpp_level
+        self.levels = {}  # cp_id -> seviye
+        self._counts = {}  # cp_id -> örneklenen olay sayacı
+        self._ocpp = logging.getLogger("ocpp")
+        self._ocpp.addFilter(self._ocpp_filter)
+        self._sync_ocpp()
+
+    @classmethod
+    def from_env(cls):
+        station_log = cls(
+            sample_every=int(os.getenv("LOG_SAMPLE_EVERY", 100)),
+            sampled_actions=[a for a in os.getenv("LOG_SAMPLED_ACTIONS", "Heartbeat,MeterValues").split(",") if a],
+            ocpp_level=_level(os.getenv("LOG_OCPP_LEVEL", "WARNING")),
+        )
+        # "CP_1=DEBUG,CP_2=WARNING"
+        for item in os.getenv("LOG_STATION_LEVELS", "").split(","):
+            if "=" in item:
+                cp_id, level = item.split("=", 1)
+                station_log.set_level(cp_id.strip(), level.strip())
+        return station_log
+
+    def set_level(self, cp_id, level):
+        """`level` None ise istasyon genel seviyeye döner."""
+        if level is None:
+            self.levels.pop(cp_id, None)
+        else:
+            self.levels[cp_id] = _level(level)
+        self._sync_ocpp()
+
+    def load(self, path):
+        """{cp_id: seviye} JSON dosyasından bütün istasyon seviyelerini değiştirir."""
+        with open(path) as f:
+            levels = {cp_id: _level(level) for cp_id, level in json.load(f).items()}
+        self.levels = levels
+        self._sync_ocpp()
+        logger.info("🔧 İstasyon log seviyeleri yüklendi - %d istasyon", len(levels))
+
+    def forget(self, cp_id):
+        self._counts.pop(cp_id, None)
+
+    def enabled(self, cp_id, level):
+        threshold = self.levels.get(cp_id) if self.levels else None
+        if threshold is None:
+            return logger.isEnabledFor(level)
+        return level >= threshold and level > logger.manager.disable
+
+    def log(self, level, cp_id, action, msg, *args, **fields):
+        if not self.enabled(cp_id, level):
+            return
+        if action in self.sampled_actions and level < logging.WARNING and cp_id not in self.levels:
+            count = self._counts.get(cp_id, 0)
+            self._counts[cp_id] = count + 1
+            if count % self.sample_every:
+                return
+            fields["sample_rate"] = self.sample_every
+        fields["cp_id"] = cp_id
+        fields["action"] = action
+        # Logger seviyesi istasyon seviyesinden yüksek olabilir; kayıt doğrudan handler'lara gider
+        logger.handle(logger.makeRecord(logger.name, level, "server", 0, msg, args, None, extra=fields))
+
+    def debug(self, cp_id, action, msg, *args, **fields):
+        self.log(logging.DEBUG, cp_id, action, msg, *args, **fields)
+
+    def info(self, cp_id, action, msg, *args, **fields):
+        self.log(logging.INFO, cp_id, action, msg, *args, **fields)
+
+    def warning(self, cp_id, action, msg, *args, **fields):
+        self.log(logging.WARNING, cp_id, action, msg, *args, **fields)
+
+    def error(self, cp_id, action, msg, *args, **fields):
+        self.log(logging.ERROR, cp_id, action, msg, *args, **fields)
+
+    def _sync_ocpp(self):
+        # ocpp logger'ı en düşük istasyon seviyesine iner; filtre sadece o istasyonları geçirir
+        self._ocpp.setLevel(min(min(self.levels.values(), default=self.ocpp_level), self.ocpp_level))
+
+    def _ocpp_filter(self, record):
+        if record.levelno >= self.ocpp_level:
+            return True
+        args = record.args
+        level = self.levels.get(args[0]) if isinstance(args, tuple) and args and isinstance(args[0], str) else None
+        return level is not None and record.levelno >= level
+
+    def stats(self):
+        return {"station_overrides": len(self.levels), "dropped": dropped()}
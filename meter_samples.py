@@ -0,0 +1,107 @@
+import logging
+from datetime import datetime
+
+from utils import parse_timestamp
+
+logger = logging.getLogger("OCPP_Server")
+
+# meter_samples kolon sırası; sabit genişlikli kolonlar önde (hizalama boşluğu olmasın)
+COLUMNS = ("timestamp", "value", "transaction_id", "connector_id", "cp_id",
+           "measurand", "phase", "unit", "context", "location")
+
+# OCPP 1.6 sampledValue varsayılanları
+DEFAULT_MEASURAND = "Energy.Active.Import.Register"
+DEFAULT_UNIT = "Wh"
+DEFAULT_CONTEXT = "Sample.Periodic"
+DEFAULT_LOCATION = "Outlet"
+
+# k'li birimler temel birime çevrilir; enerji sorguları tek birimle toplanabilsin
+UNIT_SCALE = {
+    "kWh": ("Wh", 1000.0),
+    "kW": ("W", 1000.0),
+    "kvarh": ("varh", 1000.0),
+    "kvar": ("var", 1000.0),
+}
+
+DDL = """
+    CREATE TABLE IF NOT EXISTS meter_samples (
+        timestamp TIMESTAMP NOT NULL,
+        value DOUBLE PRECISION NOT NULL,
+        transaction_id INTEGER,
+        connector_id SMALLINT NOT NULL,
+        cp_id TEXT NOT NULL,
+        measurand TEXT NOT NULL,
+        phase TEXT,
+        unit TEXT,
+        context TEXT,
+        location TEXT
+    ) PARTITION BY RANGE (timestamp);
+
+    CREATE TABLE IF NOT EXISTS meter_samples_default PARTITION OF meter_samples DEFAULT;
+
+    CREATE INDEX IF NOT EXISTS meter_samples_cp_ts_idx
+        ON meter_samples (cp_id, connector_id, timestamp);
+"""
+
+
+def parse_meter_value(cp_id, connector_id, meter_value, transaction_id=None, received_at=None):
+    """OCPP `meter_value` dizisini her sampledValue için bir satıra düzleştirir.
+
+    Sayısal olmayan değerler (ör. SignedData) atlanır. Satırlar `COLUMNS` sırasındadır.
+    """
+    received_at = received_at or datetime.utcnow()
+    rows = []
+    for entry in meter_value or ():
+        timestamp = received_at
+        timestamp_str = entry.get("timestamp")
+        if timestamp_str:
+            try:
+                timestamp = parse_timestamp(timestamp_str)
+            except ValueError:
+                logger.warning(f"⚠️ MeterValues timestamp parse hatası: {timestamp_str} - ID: {cp_id}")
+
+        for sample in entry.get("sampled_value") or ():
+            try:
+                value = float(sample["value"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            unit = sample.get("unit", DEFAULT_UNIT)
+            if unit in UNIT_SCALE:
+                unit, scale = UNIT_SCALE[unit]
+                value *= scale
+            rows.append((
+                timestamp,
+                value,
+                transaction_id,
+                connector_id,
+                cp_id,
+                sample.get("measurand", DEFAULT_MEASURAND),
+                sample.get("phase"),
+                unit,
+                sample.get("context", DEFAULT_CONTEXT),
+                sample.get("location", DEFAULT_LOCATION),
+            ))
+    return rows
+
+
+def _month_start(year, month):
+    year += (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    return datetime(year, month, 1)
+
+
+async def ensure_partitions(conn, months_ahead=2, now=None):
+    # Bu ay ve ileriki `months_ahead` ay için aylık partition'ları hazırla
+    now = now or datetime.utcnow()
+    for offset in range(months_ahead + 1):
+        start = _month_start(now.year, now.month + offset)
+        end = _month_start(start.year, start.month + 1)
+        name = f"meter_samples_{start:%Y_%m}"
+        try:
+            await conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {name} PARTITION OF meter_samples
+                FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')
+            """)
+        except Exception as e:
+            # Default partition'da bu aralığa düşen satır varsa PostgreSQL izin vermez
+            logger.error(f"⚠️ Partition oluşturma hatası - {name}: {str(e)}")
@@ -0,0 +1,152 @@
+import asyncio
+import bisect
+import logging
+
+logger = logging.getLogger("OCPP_Server")
+
+# Handler ve havuz bekleme süreleri için (saniye)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # label değerleri -> sayı
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for values, value in self.values.items():
+            yield f"{self.name}{_labels(self.labels, values)} {_number(value)}"
+
+
+class Gauge:
+    """Değer ya `set()` ile tutulur ya da scrape anında `collect` fonksiyonundan okunur.
+
+    `collect` etiketsiz gauge için sayı, etiketli gauge için {label değerleri: sayı} döner.
+    """
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.values = {}
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        values = self.values
+        if self.collect is not None:
+            try:
+                collected = self.collect()
+            except Exception as e:
+                logger.error(f"⚠️ Metrik okunamadı - {self.name}: {str(e)}")
+                return
+            if collected is None:
+                return
+            values = collected if self.labels else {(): collected}
+        for label_values, value in values.items():
+            if not isinstance(label_values, tuple):
+                label_values = (label_values,)
+            yield f"{self.name}{_labels(self.labels, label_values)} {_number(value)}"
+
+
+class Histogram:
+    """Sabit kovalı histogram; observe bir bisect ve iki toplama."""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label değerleri -> [kova sayaçları..., +Inf, toplam]
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for values, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                labels = _labels(self.labels + ("le",), values + (_number(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _labels(self.labels, values)
+            yield f"{self.name}_sum{labels} {_number(series[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+REGISTRY = []
+
+
+def register(metric):
+    # Aynı isim ikinci kez kaydedilirse ilki döner; /metrics'te aynı aile iki kez
+    # çıkarsa Prometheus bütün sayfayı reddeder
+    for existing in REGISTRY:
+        if existing.name == metric.name:
+            return existing
+    REGISTRY.append(metric)
+    return metric
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.append("")
+    return "\n".join(lines).encode()
+
+
+# ----- Süreç genelindeki metrikler; gauge'lar server.py'de bağlanır -----
+
+MESSAGES = register(Counter("ocpp_messages_total", "İstasyondan gelen CALL mesajları", ("action",)))
+HANDLER_SECONDS = register(Histogram(
+    "ocpp_handler_duration_seconds", "CALL işleme süresi (doğrulama, handler, cevap gönderimi)", ("action",)
+))
+DB_ACQUIRE_SECONDS = register(Histogram("ocpp_db_pool_acquire_seconds", "Havuzdan bağlantı alma bekleme süresi"))
+LOOP_LAG = register(Gauge("ocpp_event_loop_lag_seconds", "Son ölçülen event loop gecikmesi"))
+LOOP_LAG_SECONDS = register(Histogram(
+    "ocpp_event_loop_lag_distribution_seconds", "Event loop gecikmesi dağılımı",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+))
+
+
+async def monitor_loop_lag(interval=0.5):
+    # Uyanma gecikmesi = loop'u başka işlerin ne kadar meşgul ettiği
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        LOOP_LAG.set(lag)
+        LOOP_LAG_SECONDS.observe(lag)
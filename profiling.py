@@ -0,0 +1,226 @@
+import asyncio
+import contextvars
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger("OCPP_Server")
+
+PHASE_SECONDS = metrics.register(metrics.Histogram(
+    "ocpp_phase_duration_seconds", "Mesaj işleme aşamaları (sadece profiling açıkken)", ("action", "phase")
+))
+
+_current = contextvars.ContextVar("ocpp_span", default=None)
+
+
+def current():
+    """İçinde bulunulan mesajın Span'i; profiling kapalıysa None."""
+    return _current.get()
+
+
+class Span:
+    """Tek bir gelen mesajın aşama süreleri (saniye).
+
+    handler, içindeki db süresini de kapsar. framework: doğrulama, case dönüşümü
+    ve cevabın JSON'a çevrilmesi (toplamdan kalan).
+    """
+
+    __slots__ = ("cp_id", "action", "size", "started", "parse", "handler", "db", "send")
+
+    def __init__(self, cp_id, size):
+        self.cp_id = cp_id
+        self.action = None
+        self.size = size
+        self.started = time.perf_counter()
+        self.parse = 0.0
+        self.handler = 0.0
+        self.db = 0.0
+        self.send = 0.0
+
+
+class StackSampler(threading.Thread):
+    """Bir thread'in (event loop) stack'ini `hz` sıklıkta örnekleyip katlar.
+
+    Çıktı flamegraph.pl / speedscope'un okuduğu "a;b;c sayı" formatında.
+    """
+
+    def __init__(self, thread_id, hz=100):
+        super().__init__(name="ocpp-stack-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = 1.0 / hz
+        self.stacks = {}  # "a;b;c" -> örnek sayısı
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join(reversed(names))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in dict(self.stacks).items())
+
+
+class _SlowCallbackCapture(logging.Filter):
+    # asyncio debug modunda "Executing <Handle ...> took 0.2 seconds" uyarılarını da saklar
+    def __init__(self, profiler):
+        super().__init__()
+        self.profiler = profiler
+
+    def filter(self, record):
+        if isinstance(record.msg, str) and record.msg.startswith("Executing "):
+            self.profiler.slow_callbacks.append({"ts": record.created, "message": record.getMessage()})
+        return True
+
+
+class Profiler:
+    """Opt-in ölçüm: mesaj aşamaları, yavaş çağrılar, örnekleyici profiler, yavaş callback'ler.
+
+    Hepsi çalışırken açılıp kapatılabilir (http_api /debug/profiling). Kapalıyken
+    sıcak yoldaki maliyet bir bayrak kontrolü.
+    """
+
+    def __init__(self, tracing=False, slow_threshold=0.1, max_slow=200):
+        self.tracing = tracing
+        self.slow_threshold = slow_threshold
+        self.slow_calls = deque(maxlen=max_slow)
+        self.slow_callbacks = deque(maxlen=max_slow)
+        self.phases = {}  # (action, phase) -> toplam saniye
+        self.sampler = None
+        self._last_folded = ""
+        self._callback_filter = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            tracing=os.getenv("PROFILING", "0") == "1",
+            slow_threshold=float(os.getenv("PROFILING_SLOW_MS", 100)) / 1000,
+            max_slow=int(os.getenv("PROFILING_MAX_SLOW", 200)),
+        )
+
+    # ----- Mesaj aşamaları -----
+
+    def begin(self, cp_id, raw_msg):
+        span = Span(cp_id, len(raw_msg))
+        return span, _current.set(span)
+
+    def end(self, span, token):
+        _current.reset(token)
+        if span.action is None:
+            return  # CALL değil (CallResult/CallError) ya da parse edilemedi
+        total = time.perf_counter() - span.started
+        framework = max(0.0, total - span.parse - span.handler - span.send)
+        values = {"parse": span.parse, "framework": framework, "handler": span.handler,
+                  "db": span.db, "send": span.send}
+        for phase, seconds in values.items():
+            key = (span.action, phase)
+            self.phases[key] = self.phases.get(key, 0.0) + seconds
+            PHASE_SECONDS.observe(seconds, span.action, phase)
+        if total >= self.slow_threshold:
+            entry = {"ts": time.time(), "cp_id": span.cp_id, "action": span.action, "size": span.size,
+                     "total_ms": round(total * 1000, 3)}
+            entry.update({f"{phase}_ms": round(seconds * 1000, 3) for phase, seconds in values.items()})
+            self.slow_calls.append(entry)
+            logger.warning("🐢 Yavaş mesaj - ID: %s, Action: %s, Süre: %.1f ms", span.cp_id, span.action, total * 1000)
+
+    def wrap(self, handler):
+        """Route handler'ını saran fonksiyon; süre içinde bulunulan Span'e yazılır."""
+        async def timed(**kwargs):
+            span = _current.get()
+            started = time.perf_counter()
+            try:
+                response = handler(**kwargs)
+                if inspect.isawaitable(response):
+                    response = await response
+                return response
+            finally:
+                if span is not None:
+                    span.handler += time.perf_counter() - started
+        return timed
+
+    def phases_folded(self):
+        # Aşama süreleri mikro saniye ağırlıklı katlanmış stack olarak: ocpp;Action;handler;db
+        lines = []
+        for (action, phase), seconds in self.phases.items():
+            if phase == "db":
+                stack = f"ocpp;{action};handler;db"
+            elif phase == "handler":
+                # db ayrı satırda; handler sadece kendi payı
+                seconds -= self.phases.get((action, "db"), 0.0)
+                stack = f"ocpp;{action};handler"
+            else:
+                stack = f"ocpp;{action};{phase}"
+            lines.append(f"{stack} {max(0, int(seconds * 1e6))}\n")
+        return "".join(lines)
+
+    # ----- Örnekleyici profiler -----
+
+    def start_sampling(self, hz=100):
+        if self.sampler is not None:
+            return
+        # Çağıran event loop thread'i; örneklenecek olan o
+        self.sampler = StackSampler(threading.get_ident(), hz)
+        self.sampler.start()
+        logger.info("🔬 Örnekleyici profiler açıldı - %d Hz", hz)
+
+    def stop_sampling(self):
+        if self.sampler is None:
+            return self._last_folded
+        self.sampler.stop()
+        self._last_folded = self.sampler.folded()
+        logger.info("🔬 Örnekleyici profiler kapandı - %d örnek", self.sampler.samples)
+        self.sampler = None
+        return self._last_folded
+
+    def sampled_folded(self):
+        return self.sampler.folded() if self.sampler is not None else self._last_folded
+
+    # ----- asyncio yavaş callback tespiti -----
+
+    def enable_slow_callbacks(self, threshold=0.1):
+        loop = asyncio.get_running_loop()
+        loop.slow_callback_duration = threshold
+        loop.set_debug(True)
+        if self._callback_filter is None:
+            self._callback_filter = _SlowCallbackCapture(self)
+            logging.getLogger("asyncio").addFilter(self._callback_filter)
+
+    def disable_slow_callbacks(self):
+        asyncio.get_running_loop().set_debug(False)
+        if self._callback_filter is not None:
+            logging.getLogger("asyncio").removeFilter(self._callback_filter)
+            self._callback_filter = None
+
+    def status(self):
+        loop = asyncio.get_running_loop()
+        return {
+            "tracing": self.tracing,
+            "slow_ms": self.slow_threshold * 1000,
+            "slow_calls": len(self.slow_calls),
+            "sampling": self.sampler is not None,
+            "samples": self.sampler.samples if self.sampler is not None else 0,
+            "slow_callbacks": loop.get_debug(),
+            "callback_ms": loop.slow_callback_duration * 1000,
+        }
+
+
+profiler = Profiler.from_env()
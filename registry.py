@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import time
+
+from ocpp.exceptions import OCPPError
+
+logger = logging.getLogger("OCPP_Server")
+
+
+class FanOutResult:
+    """Toplu CALL sonucunun özeti: istasyon bazında cevap veya hata."""
+
+    def __init__(self):
+        self.succeeded = {}  # cp_id -> call_result payload
+        self.failed = {}  # cp_id -> hata açıklaması
+        self.timed_out = []
+        self.offline = []
+        self.duration = 0.0
+
+    def summary(self):
+        return {
+            "succeeded": len(self.succeeded),
+            "failed": len(self.failed),
+            "timed_out": len(self.timed_out),
+            "offline": len(self.offline),
+            "duration_s": round(self.duration, 3),
+        }
+
+
+class Registry:
+    """Bağlı ChargePoint nesneleri, id ile.
+
+    Bütün erişim event loop thread'inden yapıldığı için düz dict yeterli; okuma
+    tarafında kilit yok. Çok process'li modda her worker sadece kendi
+    bağlantılarını görür.
+    """
+
+    def __init__(self):
+        self._stations = {}
+
+    def add(self, cp):
+        # Aynı id ile önceki bağlantı varsa döner; çağıran kapatır
+        previous = self._stations.get(cp.id)
+        self._stations[cp.id] = cp
+        return previous
+
+    def remove(self, cp):
+        if self._stations.get(cp.id) is cp:
+            del self._stations[cp.id]
+
+    def get(self, cp_id):
+        return self._stations.get(cp_id)
+
+    def ids(self):
+        return list(self._stations)
+
+    def __contains__(self, cp_id):
+        return cp_id in self._stations
+
+    def __len__(self):
+        return len(self._stations)
+
+    async def call(self, cp_id, payload, timeout=30.0):
+        """Tek istasyona CALL gönderir. Bağlı değilse KeyError, CallError gelirse OCPPError."""
+        cp = self._stations.get(cp_id)
+        if cp is None:
+            raise KeyError(cp_id)
+        return await asyncio.wait_for(cp.call(payload, suppress=False), timeout)
+
+    async def fan_out(self, cp_ids, payload, concurrency=500, timeout=30.0, on_response=None):
+        """Aynı CALL'u birçok istasyona eşzamanlı gönderir.
+
+        `payload` bir call payload'ı ya da `cp_id` alıp payload dönen fonksiyon olabilir.
+        Aynı anda en fazla `concurrency` CALL uçuşta olur; her CALL `timeout` ile sınırlı.
+        `on_response(cp_id, cevap)` her cevap geldiğinde çağrılır; tur iptal edilse de
+        o ana kadar gelenler kaybolmaz.
+        """
+        result = FanOutResult()
+        started = time.perf_counter()
+        pending = iter(cp_ids)
+
+        async def worker():
+            for cp_id in pending:
+                cp = self._stations.get(cp_id)
+                if cp is None:
+                    result.offline.append(cp_id)
+                    continue
+                try:
+                    # Fabrika hatası yalnızca o istasyonu düşürür, turu değil
+                    request = payload(cp_id) if callable(payload) else payload
+                    result.succeeded[cp_id] = response = await asyncio.wait_for(cp.call(request, suppress=False), timeout)
+                    if on_response is not None:
+                        on_response(cp_id, response)
+                except asyncio.TimeoutError:
+                    result.timed_out.append(cp_id)
+                except OCPPError as e:
+                    result.failed[cp_id] = f"{e.code}: {e.description}"
+                except Exception as e:
+                    result.failed[cp_id] = str(e)
+
+        # Her istasyon için task açmak yerine sabit sayıda worker aynı iteratörü tüketir
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))), return_exceptions=True)
+        result.duration = time.perf_counter() - started
+        logger.info(f"📡 Toplu CALL tamamlandı - {result.summary()}")
+        return result
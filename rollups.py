@@ -0,0 +1,309 @@
+import asyncio
+import logging
+import os
+from datetime import timedelta
+
+logger = logging.getLogger("OCPP_Server")
+
+ENERGY_REGISTER = "Energy.Active.Import.Register"
+
+# Saatlik enerji (Wh) istasyon/connector başına. Sunucu register farklarını bellekte
+# toplayıp artımlı yazar; günlük/aylık raporlar ham meter_samples yerine buradan okunur.
+DDL = """
+    CREATE TABLE IF NOT EXISTS energy_hourly (
+        cp_id TEXT NOT NULL,
+        connector_id INTEGER NOT NULL,
+        hour TIMESTAMP NOT NULL,
+        energy_wh DOUBLE PRECISION NOT NULL,
+        samples INTEGER NOT NULL,
+        PRIMARY KEY (cp_id, connector_id, hour)
+    );
+
+    CREATE INDEX IF NOT EXISTS energy_hourly_hour_idx ON energy_hourly (hour);
+
+    -- Mevcut geçmiş açılışta değil, arka planda parça parça doldurulur (EnergyRollup._backfill).
+    -- `cutoff` öncesi örnekler backfill'in, sonrası canlı rollup'ın; `next_from` ilerleme
+    CREATE TABLE IF NOT EXISTS energy_hourly_backfill (
+        singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+        cutoff TIMESTAMP NOT NULL,
+        next_from TIMESTAMP
+    );
+
+    INSERT INTO energy_hourly_backfill (cutoff) VALUES (timezone('utc', now()));
+"""
+
+# [$1, $2) aralığındaki örneklerin saatlik farkları. Aralığın ilk okumasının farkı,
+# aralıktan önceki son kayıtlı okumaya göre (COALESCE ikinci argümanı gerektiğinde çalışır).
+BACKFILL = """
+    INSERT INTO energy_hourly (cp_id, connector_id, hour, energy_wh, samples)
+    SELECT cp_id, connector_id, date_trunc('hour', timestamp), sum(delta), count(*)
+    FROM (
+        SELECT cp_id, connector_id, timestamp,
+               value - COALESCE(lag(value) OVER (PARTITION BY cp_id, connector_id ORDER BY timestamp), (
+                   SELECT p.value FROM meter_samples p
+                   WHERE p.cp_id = s.cp_id AND p.connector_id = s.connector_id
+                     AND p.measurand = 'Energy.Active.Import.Register' AND p.phase IS NULL
+                     AND p.timestamp < $1
+                   ORDER BY p.timestamp DESC LIMIT 1
+               )) AS delta
+        FROM meter_samples s
+        WHERE measurand = 'Energy.Active.Import.Register' AND phase IS NULL
+          AND timestamp >= $1 AND timestamp < $2
+    ) readings
+    WHERE delta > 0
+    GROUP BY 1, 2, 3
+    ON CONFLICT (cp_id, connector_id, hour) DO UPDATE
+    SET energy_wh = energy_hourly.energy_wh + EXCLUDED.energy_wh,
+        samples = energy_hourly.samples + EXCLUDED.samples
+"""
+
+# Bu süreçte ilk kez görülen connector'ların, okumadan önceki son kayıtlı register'ı
+LATEST = """
+    SELECT k.i, p.value
+    FROM unnest($1::text[], $2::integer[], $3::timestamp[]) WITH ORDINALITY AS k(cp_id, connector_id, ts, i)
+    CROSS JOIN LATERAL (
+        SELECT m.value FROM meter_samples m
+        WHERE m.cp_id = k.cp_id AND m.connector_id = k.connector_id
+          AND m.measurand = 'Energy.Active.Import.Register' AND m.phase IS NULL
+          AND m.timestamp < k.ts
+        ORDER BY m.timestamp DESC LIMIT 1
+    ) p
+"""
+
+UPSERT = """
+    INSERT INTO energy_hourly (cp_id, connector_id, hour, energy_wh, samples)
+    SELECT * FROM unnest($1::text[], $2::integer[], $3::timestamp[], $4::double precision[], $5::integer[])
+    ON CONFLICT (cp_id, connector_id, hour) DO UPDATE
+    SET energy_wh = energy_hourly.energy_wh + EXCLUDED.energy_wh,
+        samples = energy_hourly.samples + EXCLUDED.samples
+"""
+
+
+TABLE = "energy_hourly"
+
+
+async def upsert(conn, rows):
+    """(cp_id, connector_id, saat, Wh, örnek) satırları; spool'dan yüklenirken de bu kullanılır."""
+    await conn.execute(UPSERT, *(list(column) for column in zip(*rows)))
+
+
+class EnergyRollup:
+    """Energy.Active.Import.Register okumalarından saatlik enerji, artımlı.
+
+    Her connector'ın son register okuması (zaman, değer) bellekte; yeni okumayla
+    aradaki fark okumanın saatine eklenir. Son okumadan eski zamanlı (geç gelen)
+    okumalar atlanır; daha yeni ama küçük değer sayaç sıfırlanması (sayaç değişimi)
+    sayılır, fark yazılmaz. Bu süreçte ilk kez görülen connector'ın (yeniden başlatma,
+    başka worker'dan gelen istasyon) ilk okumasının farkı flush'ta veritabanındaki son
+    kayıtlı okumaya göre hesaplanır. Birikenler `flush_interval` saniyede bir tek
+    upsert ile eklenir; yazılamazsa bir sonraki tura kalır. Migration öncesi geçmiş
+    `backfill_chunk`'lık parçalarla arka planda doldurulur; doldurma sürerken `cutoff`
+    öncesi zamanlı (geç gelen) okumalar backfill'e bırakılır, farkları burada sayılmaz.
+    İstasyon bağlantısı kapanınca `forget` ile son okumaları bırakılır; istasyon başka
+    worker'a geçip geri gelirse o arada sayılanlar tekrar sayılmaz.
+    """
+
+    def __init__(self, pool=None, flush_interval=10.0, backfill_chunk=timedelta(days=1), backfill_pause=1.0):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.backfill_chunk = backfill_chunk
+        self.backfill_pause = backfill_pause
+        self.last = {}  # (cp_id, connector_id) -> (zaman, register Wh); zaman None ise bilinmiyor
+        self.first = {}  # (cp_id, connector_id, zaman) -> öncesi bilinmeyen ilk okuma (Wh)
+        self.pending = {}  # (cp_id, connector_id, saat) -> [Wh, örnek]
+        self.writer = None  # WriteBehind verilmişse satırlar onun üzerinden (spool dahil)
+        self.out_of_order = 0
+        self.resets = 0
+        self.before_cutoff = 0
+        self.cutoff = None  # Backfill sürerken sınırı; öncesi zamanlı okumalar backfill'in
+        self.backfilled_until = None
+        self._task = None
+        self._backfill_task = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            flush_interval=float(os.getenv("ROLLUP_FLUSH_INTERVAL", 10)),
+            backfill_chunk=timedelta(hours=float(os.getenv("ROLLUP_BACKFILL_CHUNK_HOURS", 24))),
+            backfill_pause=float(os.getenv("ROLLUP_BACKFILL_PAUSE", 1)),
+        )
+
+    def seed(self, cp_id, connector_id, value, timestamp=None):
+        # StartTransaction'daki meterStart; ilk MeterValues'tan önceki enerji kaybolmasın
+        key = (cp_id, connector_id)
+        last = self.last.get(key)
+        if last is None or last[0] is None or timestamp is None or timestamp >= last[0]:
+            self.last[key] = (timestamp, value)
+
+    def forget(self, cp_id):
+        # Bağlantı kapandı; istasyon başka worker'a geçebilir, dönerse son okuma veritabanından
+        for key in [key for key in self.last if key[0] == cp_id]:
+            del self.last[key]
+
+    def reading(self, cp_id, connector_id, value, timestamp):
+        key = (cp_id, connector_id)
+        if self.cutoff is not None and timestamp < self.cutoff:
+            # Farkı backfill sayar; sadece sonraki okuma için başlangıç
+            self.before_cutoff += 1
+            self.seed(cp_id, connector_id, value, timestamp)
+            return
+        last = self.last.get(key)
+        if last is None:
+            # Öncesi bu süreçte bilinmiyor; farkı flush'ta kayıtlı son okumadan
+            self.last[key] = (timestamp, value)
+            self.first[key + (timestamp,)] = value
+            return
+        if last[0] is not None and timestamp < last[0]:
+            self.out_of_order += 1
+            return
+        self.last[key] = (timestamp, value)
+        if value < last[1]:
+            self.resets += 1
+            return
+        if value > last[1]:
+            self._add(cp_id, connector_id, timestamp, value - last[1])
+
+    def _add(self, cp_id, connector_id, timestamp, energy):
+        bucket = (cp_id, connector_id, timestamp.replace(minute=0, second=0, microsecond=0))
+        entry = self.pending.get(bucket)
+        if entry is None:
+            self.pending[bucket] = [energy, 1]
+        else:
+            entry[0] += energy
+            entry[1] += 1
+
+    def meter(self, cp_id, connector_id, rows):
+        """meter_samples.parse_meter_value satırlarından toplam register okumaları."""
+        for row in rows:
+            if row[5] == ENERGY_REGISTER and row[6] is None:
+                self.reading(cp_id, connector_id, row[1], row[0])
+
+    async def _resolve_first(self):
+        if not self.first or self.pool is None:
+            return
+        first, self.first = self.first, {}
+        keys = list(first)
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(LATEST, [key[0] for key in keys], [key[1] for key in keys],
+                                        [key[2] for key in keys])
+        except Exception as e:
+            for key, value in first.items():
+                self.first.setdefault(key, value)
+            logger.error(f"⚠️ Son register okunamadı - Connector: {len(first)}: {str(e)}")
+            return
+        for i, stored in rows:
+            key = keys[i - 1]
+            value = first[key]
+            if value > stored:
+                self._add(key[0], key[1], key[2], value - stored)
+
+    async def flush(self):
+        await self._resolve_first()
+        spool = self.writer.spool if self.writer is not None else None
+        if not self.pending or (self.pool is None and spool is None):
+            return
+        pending, self.pending = self.pending, {}
+        rows = [(cp_id, connector_id, hour, energy, samples)
+                for (cp_id, connector_id, hour), (energy, samples) in pending.items()]
+        if self.writer is not None:
+            written = await self.writer.write(TABLE, rows)
+        else:
+            try:
+                async with self.pool.acquire() as conn:
+                    await upsert(conn, rows)
+                written = True
+            except Exception as e:
+                logger.error(f"⚠️ Saatlik enerji yazma hatası - Kova: {len(pending)}: {str(e)}")
+                written = False
+        if not written:
+            # Aradaki yeni okumalarla birleştirip sonra tekrar dene
+            for bucket, (energy, samples) in pending.items():
+                entry = self.pending.setdefault(bucket, [0.0, 0])
+                entry[0] += energy
+                entry[1] += samples
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        if self._backfill_task is None:
+            self._backfill_task = asyncio.create_task(self._backfill())
+
+    async def stop(self):
+        for task in (self._task, self._backfill_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._backfill_task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def _backfill_step(self):
+        """Bir parça doldurur; iş bittiyse (ya da yoksa) True."""
+        async with self.pool.acquire() as conn:
+            # Migration 9'u doldurma tablosundan önceki haliyle uygulamış veritabanı
+            if await conn.fetchval("SELECT to_regclass('energy_hourly_backfill')") is None:
+                return True
+            # Satırı başka worker tutuyor olsa da canlı okumalar sınırı bilsin
+            self.cutoff = await conn.fetchval("SELECT cutoff FROM energy_hourly_backfill")
+            if self.cutoff is None:
+                return True
+            async with conn.transaction():
+                # Birden fazla worker: satırı tutan doldurur, diğerleri sonra tekrar bakar
+                state = await conn.fetchrow(
+                    "SELECT cutoff, next_from FROM energy_hourly_backfill FOR UPDATE SKIP LOCKED"
+                )
+                if state is None:
+                    return not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM energy_hourly_backfill)")
+                start = state["next_from"]
+                if start is None:
+                    start = await conn.fetchval(
+                        "SELECT min(timestamp) FROM meter_samples WHERE timestamp < $1", state["cutoff"]
+                    )
+                    if start is None:
+                        await conn.execute("DELETE FROM energy_hourly_backfill")
+                        self.cutoff = None
+                        return True
+                end = min(start + self.backfill_chunk, state["cutoff"])
+                await conn.execute(BACKFILL, start, end)
+                if end >= state["cutoff"]:
+                    await conn.execute("DELETE FROM energy_hourly_backfill")
+                    self.cutoff = None
+                    logger.info("✅ Saatlik enerji geçmişi dolduruldu")
+                    return True
+                await conn.execute("UPDATE energy_hourly_backfill SET next_from = $1", end)
+                self.backfilled_until = end
+                return False
+
+    async def _backfill(self):
+        while True:
+            if self.pool is None:
+                await asyncio.sleep(self.flush_interval)
+                continue
+            try:
+                if await self._backfill_step():
+                    return
+                await asyncio.sleep(self.backfill_pause)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"⚠️ Saatlik enerji geçmişi doldurma hatası: {str(e)}")
+                await asyncio.sleep(self.flush_interval)
+
+    def stats(self):
+        return {
+            "connectors": len(self.last),
+            "pending_buckets": len(self.pending),
+            "unresolved_first": len(self.first),
+            "out_of_order": self.out_of_order,
+            "resets": self.resets,
+            "before_cutoff": self.before_cutoff,
+            "backfilled_until": self.backfilled_until.isoformat() + "Z" if self.backfilled_until else None,
+        }
@@ -2,264 +2,519 @@ import asyncio
 import logging
 import datetime
 from datetime import datetime  # timestamp parse için
+import http
 import os
+import signal
+import sys
+import time
+import uuid
 import websockets
-import asyncpg
 from ocpp.routing import on
 from ocpp.v16 import ChargePoint as CP
-from ocpp.v16 import call_result
+from ocpp.v16 import call, call_result
+
+import admission as admission_module
+import analytics as analytics_module
+import auth_cache as auth_cache_module
+import codec
+import db
+import http_api
+import meter_samples
+import liveness as liveness_module
+import logs
+import metrics
+import profiling
+import rollups
+import smart_charging as smart_charging_module
+import spool as spool_module
+import transactions as transactions_module
+from registry import Registry
+from utils import parse_timestamp
+from write_behind import WriteBehind
 
 # 📋 Log formatı
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Log yazımı arka plan thread'inde; LOG_FORMAT=json|text, LOG_LEVEL
+logs.setup()
 logger = logging.getLogger("OCPP_Server")
+station_log = logs.StationLog.from_env()  # İstasyon bazlı seviye ve örnekleme
 
 db_pool = None  # Global veritabanı havuzu
-
-
-class ChargePoint(CP):
-    def __init__(self, id, connection):
-        super().__init__(id, connection)
-        self.db_pool = None
-
-    async def set_db_pool(self, pool):
-        self.db_pool = pool
+writer = WriteBehind.from_env()  # INSERT'ler için toplu yazma kuyruğu
+auth_cache = auth_cache_module.AuthCache.from_env()  # id_tag -> yetki durumu
+ownership = None  # Çok process'li modda supervisor.WorkerOwnership
+listener_task = None  # users LISTEN döngüsü; attach_db başlatır
+listener_conn = None
+closing = set()  # Yerine yenisi bağlanan eski bağlantıların kapanış task'ları
+registry = Registry()  # Bağlı istasyonlar; sunucudan CALL göndermek için
+liveness = liveness_module.Liveness.from_env()  # Son görülme zamanı ve çevrimdışı tespiti
+transactions = transactions_module.TransactionStore.from_env()  # Aktif transaction'lar ve anlık enerji
+rollup = rollups.EnergyRollup.from_env()  # energy_hourly için saatlik enerji farkları
+admission = admission_module.Admission.from_env()  # Handshake sınırları ve boot fırtınası yumuşatma
+smart_charging = smart_charging_module.SmartCharging.from_env(registry)  # Saha güç sınırı altında yük yönetimi
+analytics = analytics_module.AnalyticsServer.from_env()  # ANALYTICS_PORT tanımlıysa geçmiş veri API'si
+# Bellekte biriken durumlar da write-behind yolundan yazılır; veritabanı yokken spool'a
+for component, module in ((transactions, transactions_module), (liveness, liveness_module), (rollup, rollups)):
+    component.writer = writer
+    writer.register(module.TABLE, module.upsert)
+writer.register(transactions_module.STOPS, transactions_module.update_stops)
+
+# Scrape anında okunan gauge'lar; sıcak yolda ek iş yok
+metrics.register(metrics.Gauge("ocpp_connected_stations", "Bu süreçte bağlı istasyon", collect=lambda: len(registry)))
+metrics.register(metrics.Gauge("ocpp_online_stations", "Heartbeat süresi dolmamış istasyon", collect=lambda: liveness.online_count))
+metrics.register(metrics.Gauge(
+    "ocpp_write_behind_queue_depth", "Yazılmayı bekleyen kayıt", ("table",),
+    collect=lambda: {table: len(queue) for table, queue in writer.queues.items()},
+))
+metrics.register(metrics.Gauge(
+    "ocpp_write_behind_rejected_rows", "Veri hatası yüzünden atılan kayıt", ("table",),
+    collect=lambda: {table: counters["rejected"] for table, counters in writer.counters.items()},
+))
+metrics.register(metrics.Gauge("ocpp_write_behind_last_flush_seconds", "Son toplu yazma süresi",
+                               collect=lambda: writer.last_flush_ms / 1000))
+metrics.register(metrics.Gauge("ocpp_spool_pending_records", "Diskte veritabanına yüklenmeyi bekleyen batch",
+                               collect=lambda: writer.spool.pending if writer.spool else None))
+metrics.register(metrics.Gauge("ocpp_spool_disk_bytes", "Spool segmentlerinin disk boyutu",
+                               collect=lambda: writer.spool.disk_bytes() if writer.spool else None))
+metrics.register(metrics.Gauge("ocpp_liveness_pending_flush", "Yazılmayı bekleyen liveness güncellemesi",
+                               collect=lambda: len(liveness.dirty)))
+metrics.register(metrics.Gauge("ocpp_active_transactions", "Bu süreçte açık transaction",
+                               collect=lambda: len(transactions.sessions)))
+metrics.register(metrics.Gauge("ocpp_energy_rollup_pending_buckets", "Yazılmayı bekleyen saatlik enerji kovası",
+                               collect=lambda: len(rollup.pending)))
+metrics.register(metrics.Gauge("ocpp_admission", "Bağlantı kabul kontrolü", ("stat",), collect=lambda: admission.stats()))
+metrics.register(metrics.Gauge(
+    "ocpp_site_power_watts", "Yük yönetimi sahalarında güç", ("site", "kind"),
+    collect=lambda: {(site_id, kind): site.to_dict()[f"{kind}_w"] for site_id, site in smart_charging.sites.items()
+                     for kind in ("limit", "measured", "allocated")},
+))
+metrics.register(metrics.Gauge("ocpp_log_queue_depth", "Yazılmayı bekleyen log kaydı", collect=logs.queue_depth))
+metrics.register(metrics.Gauge("ocpp_log_dropped", "Kuyruk dolu olduğu için düşen log kaydı", collect=logs.dropped))
+metrics.register(metrics.Gauge(
+    "ocpp_auth_cache", "id_tag önbelleği", ("stat",),
+    collect=lambda: auth_cache.stats(),
+))
+metrics.register(metrics.Gauge(
+    "ocpp_db_pool_connections", "Havuz bağlantıları", ("state",),
+    collect=lambda: {"in_use": db_pool.in_use(), "idle": db_pool.get_idle_size()} if db_pool else None,
+))
+
+
+# Boşta bekleyen on binlerce bağlantıda websocket tamponları RAM'in büyük kısmı.
+# compact modda sıkıştırma kapalı ve tamponlar OCPP mesaj boyutlarına göre küçük.
+CONNECTION_MODES = {
+    "standard": {},
+    "compact": {
+        "compression": None,
+        "max_size": 64 * 1024,
+        "max_queue": 4,
+        "read_limit": 8 * 1024,
+        "write_limit": 8 * 1024,
+    },
+}
+
+
+connection_mode = os.getenv("CONNECTION_MODE", "standard")
+_NO_HEADERS = websockets.Headers()
+
+
+def websocket_options(mode=None):
+    mode = mode or connection_mode
+    options = dict(CONNECTION_MODES[mode])
+    # Tek tek ayarlar moddan bağımsız ezilebilir
+    for key, env in (("max_size", "WS_MAX_SIZE"), ("max_queue", "WS_MAX_QUEUE"),
+                     ("read_limit", "WS_READ_LIMIT"), ("write_limit", "WS_WRITE_LIMIT")):
+        if os.getenv(env):
+            options[key] = int(os.getenv(env))
+    return options
+
+
+class _RouteView:
+    """ocpp'nin beklediği `route_map` arayüzü.
+
+    Route tablosu sınıf seviyesinde bir kez kurulur; handler sadece mesaj geldiğinde
+    bağlantıya bağlanır. Böylece her bağlantı için ayrı route sözlüğü tutulmaz.
+    """
+
+    __slots__ = ("_cp",)
+
+    def __init__(self, cp):
+        self._cp = cp
+
+    def __getitem__(self, action):
+        on_action, after_action, skip_validation = type(self._cp).route_table()[action]
+        handlers = {"_skip_schema_validation": skip_validation}
+        if on_action is not None:
+            handlers["_on_action"] = on_action.__get__(self._cp)
+            if profiling.current() is not None:
+                handlers["_on_action"] = profiling.profiler.wrap(handlers["_on_action"])
+        if after_action is not None:
+            handlers["_after_action"] = after_action.__get__(self._cp)
+        return handlers
+
+
+class ChargePoint(codec.CodecMixin, CP):
+    # ocpp'nin __init__'i her bağlantı için route_map, Lock ve Queue kurar. Burada
+    # route tablosu sınıfta paylaşılır, Lock/Queue ancak ilk CALL'da oluşturulur;
+    # sadece Heartbeat gönderen bir istasyon bunlara hiç ihtiyaç duymaz.
+    # JSON çözme/kodlama ve şema doğrulama codec.CodecMixin üzerinden (OCPP_JSON_BACKEND,
+    # OCPP_TRUSTED_STATIONS).
+    __slots__ = ("id", "_connection", "_response_timeout", "_lock", "_responses")
+
+    db_pool = None  # Bütün bağlantılar aynı havuzu kullanır; main() atar
+    _unique_id_generator = staticmethod(uuid.uuid4)
+
+    def __init__(self, id, connection, response_timeout=30):
+        self.id = id
+        self._connection = connection
+        self._response_timeout = response_timeout
+        self._lock = None
+        self._responses = None
+
+    @classmethod
+    def route_table(cls):
+        table = cls.__dict__.get("_route_table")
+        if table is None:
+            table = {}
+            for name in dir(cls):
+                func = getattr(cls, name, None)
+                for option in ("_on_action", "_after_action"):
+                    action = getattr(func, option, None)
+                    if action is None:
+                        continue
+                    on_action, after_action, skip = table.get(action, (None, None, False))
+                    if option == "_on_action":
+                        on_action, skip = func, getattr(func, "_skip_schema_validation", False)
+                    else:
+                        after_action = func
+                    table[action] = (on_action, after_action, skip)
+            cls._route_table = table
+        return table
+
+    @property
+    def route_map(self):
+        return _RouteView(self)
+
+    @property
+    def _call_lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @property
+    def _response_queue(self):
+        if self._responses is None:
+            self._responses = asyncio.Queue()
+        return self._responses
+
+    async def route_message(self, raw_msg):
+        # OCPP'ye göre istasyondan gelen her mesaj canlılık işaretidir
+        liveness.touch(self.id)
+        admission.seen(self._connection)
+        if not profiling.profiler.tracing:
+            await super().route_message(raw_msg)
+            return
+        span, token = profiling.profiler.begin(self.id, raw_msg)
+        try:
+            await super().route_message(raw_msg)
+        finally:
+            profiling.profiler.end(span, token)
+
+    async def _handle_call(self, msg):
+        started = time.perf_counter()
+        span = profiling.current()
+        if span is not None:
+            span.action = msg.action
+            span.parse = started - span.started
+        try:
+            await super()._handle_call(msg)
+        finally:
+            # Bilinmeyen action'lar tek etikette toplanır; istasyon etiket sayısını şişiremez
+            action = msg.action if msg.action in type(self).route_table() else "unknown"
+            metrics.MESSAGES.inc(action)
+            metrics.HANDLER_SECONDS.observe(time.perf_counter() - started, action)
+
+    async def _send(self, message):
+        span = profiling.current()
+        if span is None:
+            await super()._send(message)
+            return
+        started = time.perf_counter()
+        try:
+            await super()._send(message)
+        finally:
+            span.send += time.perf_counter() - started
 
     async def start(self):
-        logger.info(f"🔌 Yeni cihaz bağlandı - ID: {self.id}")
+        station_log.info(self.id, "Connect", "🔌 Yeni cihaz bağlandı - ID: %s", self.id)
         try:
             await super().start()
         except websockets.exceptions.ConnectionClosedError as e:
-            logger.warning(f"❌ Bağlantı koptu - ID: {self.id}, Sebep: {str(e)}")
+            station_log.warning(self.id, "Disconnect", "❌ Bağlantı koptu - ID: %s, Sebep: %s", self.id, str(e))
         except Exception as e:
-            logger.error(f"⚠️ Cihaz hatası - ID: {self.id}: {str(e)}")
+            station_log.error(self.id, "Disconnect", "⚠️ Cihaz hatası - ID: %s: %s", self.id, str(e))
 
     @on("BootNotification")
     async def on_boot_notification(self, charge_point_model, charge_point_vendor, **kwargs):
         current_time = datetime.utcnow()
-        logger.info(f"🔄 BootNotification - ID: {self.id}, Model: {charge_point_model}, Vendor: {charge_point_vendor}")
+        station_log.info(self.id, "BootNotification", "🔄 BootNotification - ID: %s, Model: %s, Vendor: %s",
+                         self.id, charge_point_model, charge_point_vendor)
 
-        if self.db_pool:
-            try:
-                async with self.db_pool.acquire() as conn:
-                    await conn.execute("""
-                        INSERT INTO boot_notifications (cp_id, model, vendor, timestamp)
-                        VALUES ($1, $2, $3, $4)
-                    """, self.id, charge_point_model, charge_point_vendor, current_time)
-            except Exception as e:
-                logger.error(f"⚠️ BootNotification DB kaydı hatası - ID: {self.id}: {str(e)}")
+        # Boot fırtınasında istasyon Pending ile dağıtılmış bir süre sonra tekrar dener; kayıt o zaman yazılır
+        retry = admission.defer_boot()
+        if retry is not None:
+            station_log.info(self.id, "BootNotification", "⏳ BootNotification ertelendi - ID: %s, Tekrar: %ss", self.id, retry)
+            return call_result.BootNotificationPayload(
+                current_time=current_time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                interval=retry,
+                status="Pending"
+            )
+
+        await writer.put("boot_notifications", (self.id, charge_point_model, charge_point_vendor, current_time))
+
+        # Aralık bağlı istasyon sayısına göre uzar; çevrimdışı son tarihi de buna göre
+        interval = liveness.heartbeat_interval()
+        liveness.touch(self.id, interval)
 
         return call_result.BootNotificationPayload(
             current_time=current_time.strftime("%Y-%m-%dT%H:%M:%SZ"),
-            interval=30,
+            interval=interval,
             status="Accepted"
         )
 
     @on("Heartbeat")
     async def on_heartbeat(self):
+        # Veritabanına yazılmaz; son görülme zamanını route_message günceller,
+        # liveness periyodik olarak charge_point_liveness tablosuna toplu yazar
         current_time = datetime.utcnow()
-        logger.info(f"💓 Heartbeat - ID: {self.id}")
-
-        if self.db_pool:
-            try:
-                async with self.db_pool.acquire() as conn:
-                    await conn.execute("""
-                        INSERT INTO heartbeats (cp_id, timestamp)
-                        VALUES ($1, $2)
-                    """, self.id, current_time)
-            except Exception as e:
-                logger.error(f"⚠️ Heartbeat DB kaydı hatası - ID: {self.id}: {str(e)}")
+        station_log.info(self.id, "Heartbeat", "💓 Heartbeat - ID: %s", self.id)
 
         return call_result.HeartbeatPayload(
             current_time=current_time.strftime("%Y-%m-%dT%H:%M:%SZ")
         )
 
+    async def lookup_id_tag(self, id_tag):
+        # Önce önbellek; yoksa users tablosu. Sonuç (bilinmeyen tag dahil) önbelleğe yazılır
+        if not self.db_pool:
+            return "Accepted"
+        status = auth_cache.get(id_tag)
+        if status is None:
+            generation = auth_cache.generation
+            try:
+                # Yavaş ya da kopuk veritabanı istasyonun cevabını bekletmesin
+                found = await asyncio.wait_for(self._user_exists(id_tag), auth_cache.lookup_timeout)
+            except Exception as e:
+                if not db.unavailable(e):
+                    raise
+                status = auth_cache.stale(id_tag)
+                station_log.warning(self.id, "Authorize", "⚠️ id_tag veritabanında aranamadı, çevrimdışı karar - ID: %s, Tag: %s, Durum: %s: %s",
+                                    self.id, id_tag, status, str(e) or type(e).__name__)
+                return status
+            status = "Accepted" if found else "Invalid"
+            auth_cache.put(id_tag, status, generation)
+        return status
+
+    async def _user_exists(self, id_tag):
+        async with self.db_pool.acquire() as conn:
+            return await db.fetchval(conn, "user_exists", id_tag)
+
     @on("Authorize")
     async def on_authorize(self, id_tag):
-        logger.info(f"🪪 Authorize - ID: {self.id}, Tag: {id_tag}")
+        station_log.info(self.id, "Authorize", "🪪 Authorize - ID: %s, Tag: %s", self.id, id_tag)
         status = "Invalid"
         try:
-            if self.db_pool:
-                async with self.db_pool.acquire() as conn:
-                    user = await conn.fetchrow("SELECT * FROM users WHERE id_tag = $1", id_tag)
-                    status = "Accepted" if user else "Invalid"
-                    await conn.execute("""
-                        INSERT INTO authorizations (cp_id, id_tag, status, timestamp)
-                        VALUES ($1, $2, $3, NOW())
-                    """, self.id, id_tag, status)
-            else:
-                status = "Accepted"
+            status = await self.lookup_id_tag(id_tag)
+            # Denetim kaydı cevabı bekletmesin
+            await writer.put("authorizations", (self.id, id_tag, status, datetime.utcnow()))
         except Exception as e:
-            logger.error(f"⚠️ Authorize hatası - ID: {self.id}: {str(e)}")
+            station_log.error(self.id, "Authorize", "⚠️ Authorize hatası - ID: %s: %s", self.id, str(e))
             status = "Invalid"
 
         return call_result.AuthorizePayload(id_tag_info={"status": status})
 
     @on("StartTransaction")
     async def on_start_transaction(self, connector_id, id_tag, meter_start, timestamp, **kwargs):
-        logger.info(f"⚡ StartTransaction - ID: {self.id}, Connector: {connector_id}, Tag: {id_tag}, MeterStart: {meter_start}")
+        station_log.info(self.id, "StartTransaction", "⚡ StartTransaction - ID: %s, Connector: %s, Tag: %s, MeterStart: %s",
+                         self.id, connector_id, id_tag, meter_start)
         try:
-            tx_id = 1234
-            if self.db_pool:
-                async with self.db_pool.acquire() as conn:
-                    tx_id = await conn.fetchval("""
-                        INSERT INTO transactions (id_tag, connector_id, start_value, start_time)
-                        VALUES ($1, $2, $3, $4) RETURNING id
-                    """, id_tag, connector_id, meter_start, timestamp)
-                    logger.info(f"💾 Transaction başlatıldı - TX ID: {tx_id}")
-            return call_result.StartTransactionPayload(transaction_id=tx_id, id_tag_info={"status": "Accepted"})
+            status = await self.lookup_id_tag(id_tag)
+            # Id önceden alınmış bloktan; satır transactions flusher'ı ile yazılır
+            session, duplicate = await transactions.start(self.id, connector_id, id_tag, meter_start, timestamp)
+            if duplicate:
+                station_log.warning(self.id, "StartTransaction", "🔁 Tekrarlanan StartTransaction - ID: %s, TX ID: %s",
+                                    self.id, session.tx_id)
+            else:
+                rollup.seed(self.id, connector_id, meter_start, session.start_time)
+                smart_charging.started(self.id, connector_id)
+                station_log.info(self.id, "StartTransaction", "💾 Transaction başlatıldı - TX ID: %s", session.tx_id)
+            return call_result.StartTransactionPayload(transaction_id=session.tx_id, id_tag_info={"status": status})
         except Exception as e:
-            logger.error(f"⚠️ StartTransaction hatası - ID: {self.id}: {str(e)}")
+            station_log.error(self.id, "StartTransaction", "⚠️ StartTransaction hatası - ID: %s: %s", self.id, str(e))
             return call_result.StartTransactionPayload(transaction_id=-1, id_tag_info={"status": "Invalid"})
 
     @on("StopTransaction")
     async def on_stop_transaction(self, transaction_id, meter_stop, timestamp, **kwargs):
-        logger.info(f"🛑 StopTransaction - ID: {self.id}, TxID: {transaction_id}, MeterStop: {meter_stop}")
+        station_log.info(self.id, "StopTransaction", "🛑 StopTransaction - ID: %s, TxID: %s, MeterStop: %s",
+                         self.id, transaction_id, meter_stop)
         try:
-            if self.db_pool:
-                async with self.db_pool.acquire() as conn:
-                    await conn.execute("""
-                        UPDATE transactions
-                        SET stop_value = $1,
-                            stop_time = $2,
-                            total_energy = $1 - start_value
-                        WHERE id = $3
-                    """, meter_stop, timestamp, transaction_id)
-                    logger.info(f"💾 Transaction durduruldu - TX ID: {transaction_id}")
+            session, duplicate = transactions.stop(transaction_id, meter_stop, timestamp)
+            if duplicate:
+                station_log.warning(self.id, "StopTransaction", "🔁 Tekrarlanan StopTransaction - ID: %s, TX ID: %s",
+                                    self.id, transaction_id)
+            elif session is not None:
+                rollup.reading(self.id, session.connector_id, meter_stop, session.stop_time)
+                smart_charging.stopped(self.id, session.connector_id)
+                station_log.info(self.id, "StopTransaction", "💾 Transaction durduruldu - TX ID: %s, Enerji: %s Wh",
+                                 transaction_id, session.energy())
+            else:
+                # Başka bir süreçte ya da yeniden başlatmadan önce açılmış; enerji SQL'de hesaplanır.
+                # Kuyruktan yazılır, veritabanı yoksa spool'a gider
+                await writer.put(transactions_module.STOPS, (transaction_id, self.id, meter_stop, parse_timestamp(timestamp)))
+                station_log.info(self.id, "StopTransaction", "💾 Transaction durduruldu - TX ID: %s", transaction_id)
             return call_result.StopTransactionPayload(id_tag_info={"status": "Accepted"})
         except Exception as e:
-            logger.error(f"⚠️ StopTransaction hatası - ID: {self.id}: {str(e)}")
+            station_log.error(self.id, "StopTransaction", "⚠️ StopTransaction hatası - ID: %s: %s", self.id, str(e))
             return call_result.StopTransactionPayload(id_tag_info={"status": "Invalid"})
 
     @on("StatusNotification")
-    async def on_status_notification(self, connectorId, errorCode, status, **kwargs):
+    async def on_status_notification(self, connector_id, error_code, status, **kwargs):
+        # ocpp kütüphanesi payload anahtarlarını snake_case'e çevirir
         timestamp_str = kwargs.get("timestamp")
-        vendor_id = kwargs.get("vendorId")
-        logger.info(f"📥 StatusNotification - ID: {self.id}, Connector: {connectorId}, Status: {status}, Error: {errorCode}")
+        vendor_id = kwargs.get("vendor_id")
+        station_log.info(self.id, "StatusNotification", "📥 StatusNotification - ID: %s, Connector: %s, Status: %s, Error: %s",
+                         self.id, connector_id, status, error_code)
 
         timestamp = None
         if timestamp_str:
             try:
-                timestamp = datetime.fromisoformat(timestamp_str.replace("Z", "+00:00"))
+                timestamp = parse_timestamp(timestamp_str)
             except Exception as e:
-                logger.warning(f"⚠️ Timestamp parse hatası: {timestamp_str} - {e}")
+                station_log.warning(self.id, "StatusNotification", "⚠️ Timestamp parse hatası: %s - %s", timestamp_str, str(e))
 
         try:
-            if self.db_pool:
-                async with self.db_pool.acquire() as conn:
-                    await conn.execute("""
-                        INSERT INTO status_notifications (cp_id, connector_id, status, error_code, timestamp, vendor_id)
-                        VALUES ($1, $2, $3, $4, $5, $6)
-                    """, self.id, connectorId, status, errorCode, timestamp, vendor_id)
+            await writer.put("status_notifications", (self.id, connector_id, status, error_code, timestamp, vendor_id))
             return call_result.StatusNotificationPayload()
         except Exception as e:
-            logger.error(f"⚠️ StatusNotification hatası - ID: {self.id}: {str(e)}")
+            station_log.error(self.id, "StatusNotification", "⚠️ StatusNotification hatası - ID: %s: %s", self.id, str(e))
             return call_result.StatusNotificationPayload()
 
     # ----- EKLEMELER -----
 
     @on("MeterValues")
     async def on_meter_values(self, connector_id, meter_value, **kwargs):
-        timestamp_str = kwargs.get("timestamp")
-        logger.info(f"🔢 MeterValues - ID: {self.id}, Connector: {connector_id}, MeterValue: {meter_value}")
-
-        timestamp = None
-        if timestamp_str:
-            try:
-                timestamp = datetime.fromisoformat(timestamp_str.replace("Z", "+00:00"))
-            except Exception as e:
-                logger.warning(f"⚠️ MeterValues timestamp parse hatası: {timestamp_str} - {e}")
 
         try:
-            if self.db_pool:
-                async with self.db_pool.acquire() as conn:
-                    # meter_value genelde array şeklinde gelir, JSON olarak kaydetmek pratik
-                    await conn.execute("""
-                        INSERT INTO meter_values (cp_id, connector_id, meter_value, timestamp)
-                        VALUES ($1, $2, $3, $4)
-                    """, self.id, connector_id, str(meter_value), timestamp)
+            # Her sampledValue meter_samples tablosunda ayrı, tipli bir satır olur
+            rows = meter_samples.parse_meter_value(self.id, connector_id, meter_value, kwargs.get("transaction_id"))
+            # Anlık enerji/güç oturumda; canlı sorgular veritabanına gitmez
+            session = transactions.meter(self.id, connector_id, kwargs.get("transaction_id"), rows)
+            if session is not None and session.power is not None:
+                smart_charging.reading(self.id, session.connector_id, session.power)
+            rollup.meter(self.id, connector_id, rows)
+            # Payload'ın tamamı loglanmaz; sadece örnek sayısı
+            station_log.info(self.id, "MeterValues", "🔢 MeterValues - ID: %s, Connector: %s, Örnek: %d",
+                             self.id, connector_id, len(rows))
+            await writer.put_many("meter_samples", rows)
             return call_result.MeterValuesPayload()
         except Exception as e:
-            logger.error(f"⚠️ MeterValues DB kaydı hatası - ID: {self.id}: {str(e)}")
+            station_log.error(self.id, "MeterValues", "⚠️ MeterValues DB kaydı hatası - ID: %s: %s", self.id, str(e))
             return call_result.MeterValuesPayload()
 
     @on("FirmwareStatusNotification")
     async def on_firmware_status_notification(self, status, **kwargs):
-        logger.info(f"📦 FirmwareStatusNotification - ID: {self.id}, Status: {status}")
+        station_log.info(self.id, "FirmwareStatusNotification", "📦 FirmwareStatusNotification - ID: %s, Status: %s", self.id, status)
         try:
-            if self.db_pool:
-                async with self.db_pool.acquire() as conn:
-                    await conn.execute("""
-                        INSERT INTO firmware_status_notifications (cp_id, status, timestamp)
-                        VALUES ($1, $2, NOW())
-                    """, self.id, status)
+            await writer.put("firmware_status_notifications", (self.id, status, datetime.utcnow()))
             return call_result.FirmwareStatusNotificationPayload()
         except Exception as e:
-            logger.error(f"⚠️ FirmwareStatusNotification DB kaydı hatası - ID: {self.id}: {str(e)}")
+            station_log.error(self.id, "FirmwareStatusNotification", "⚠️ FirmwareStatusNotification DB kaydı hatası - ID: %s: %s", self.id, str(e))
             return call_result.FirmwareStatusNotificationPayload()
 
     @on("DiagnosticsStatusNotification")
     async def on_diagnostics_status_notification(self, status, **kwargs):
-        logger.info(f"🛠 DiagnosticsStatusNotification - ID: {self.id}, Status: {status}")
+        station_log.info(self.id, "DiagnosticsStatusNotification", "🛠 DiagnosticsStatusNotification - ID: %s, Status: %s", self.id, status)
         try:
-            if self.db_pool:
-                async with self.db_pool.acquire() as conn:
-                    await conn.execute("""
-                        INSERT INTO diagnostics_status_notifications (cp_id, status, timestamp)
-                        VALUES ($1, $2, NOW())
-                    """, self.id, status)
+            await writer.put("diagnostics_status_notifications", (self.id, status, datetime.utcnow()))
             return call_result.DiagnosticsStatusNotificationPayload()
         except Exception as e:
-            logger.error(f"⚠️ DiagnosticsStatusNotification DB kaydı hatası - ID: {self.id}: {str(e)}")
+            station_log.error(self.id, "DiagnosticsStatusNotification", "⚠️ DiagnosticsStatusNotification DB kaydı hatası - ID: %s: %s", self.id, str(e))
             return call_result.DiagnosticsStatusNotificationPayload()
 
-    @on("RemoteStartTransaction")
-    async def on_remote_start_transaction(self, connector_id, id_tag, **kwargs):
-        logger.info(f"▶ RemoteStartTransaction - ID: {self.id}, Connector: {connector_id}, Tag: {id_tag}")
-        # Bu komut serverdan charge point'e gönderilir, burada payload döner
-        # Uygulamanda gerekli ise transaction başlatma işlemi yapabilirsin
-        return call_result.RemoteStartTransactionPayload(status="Accepted")
-
-    @on("RemoteStopTransaction")
-    async def on_remote_stop_transaction(self, transaction_id, **kwargs):
-        logger.info(f"⏹ RemoteStopTransaction - ID: {self.id}, Transaction ID: {transaction_id}")
-        # Uygulamanda gerekli ise transaction durdurma işlemi yapabilirsin
-        return call_result.RemoteStopTransactionPayload(status="Accepted")
-
-    @on("ReserveNow")
-    async def on_reserve_now(self, connector_id, expiry_date, id_tag, **kwargs):
-        logger.info(f"📅 ReserveNow - ID: {self.id}, Connector: {connector_id}, Tag: {id_tag}, Expiry: {expiry_date}")
-        # Rezervasyon işlemini burada kaydet veya onayla
-        # Basit örnek: her zaman kabul
-        return call_result.ReserveNowPayload(status="Accepted")
-
-    @on("CancelReservation")
-    async def on_cancel_reservation(self, reservation_id, **kwargs):
-        logger.info(f"❌ CancelReservation - ID: {self.id}, Reservation ID: {reservation_id}")
-        # Rezervasyon iptali işlemini burada yap
-        # Basit örnek: her zaman kabul
-        return call_result.CancelReservationPayload(status="Accepted")
+    # ----- Sunucudan istasyona giden komutlar (CALL) -----
+
+    async def remote_start_transaction(self, id_tag, connector_id=None, charging_profile=None):
+        station_log.info(self.id, "RemoteStartTransaction", "▶ RemoteStartTransaction gönderiliyor - ID: %s, Connector: %s, Tag: %s",
+                         self.id, connector_id, id_tag)
+        return await self.call(call.RemoteStartTransactionPayload(
+            id_tag=id_tag, connector_id=connector_id, charging_profile=charging_profile
+        ), suppress=False)
+
+    async def remote_stop_transaction(self, transaction_id):
+        station_log.info(self.id, "RemoteStopTransaction", "⏹ RemoteStopTransaction gönderiliyor - ID: %s, Transaction ID: %s",
+                         self.id, transaction_id)
+        return await self.call(call.RemoteStopTransactionPayload(transaction_id=transaction_id), suppress=False)
+
+    async def change_configuration(self, key, value):
+        station_log.info(self.id, "ChangeConfiguration", "⚙ ChangeConfiguration gönderiliyor - ID: %s, %s=%s", self.id, key, value)
+        return await self.call(call.ChangeConfigurationPayload(key=key, value=value), suppress=False)
+
+    async def reset(self, type="Soft"):
+        station_log.info(self.id, "Reset", "🔁 Reset gönderiliyor - ID: %s, Tip: %s", self.id, type)
+        return await self.call(call.ResetPayload(type=type), suppress=False)
+
+    async def set_charging_profile(self, connector_id, cs_charging_profiles):
+        station_log.info(self.id, "SetChargingProfile", "📈 SetChargingProfile gönderiliyor - ID: %s, Connector: %s", self.id, connector_id)
+        return await self.call(call.SetChargingProfilePayload(
+            connector_id=connector_id, cs_charging_profiles=cs_charging_profiles
+        ), suppress=False)
+
+    async def reserve_now(self, reservation_id, connector_id, id_tag, expiry_date):
+        station_log.info(self.id, "ReserveNow", "📅 ReserveNow gönderiliyor - ID: %s, Connector: %s, Tag: %s, Expiry: %s",
+                         self.id, connector_id, id_tag, expiry_date)
+        response = await self.call(call.ReserveNowPayload(
+            connector_id=connector_id,
+            expiry_date=expiry_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            id_tag=id_tag,
+            reservation_id=reservation_id
+        ), suppress=False)
+        await writer.put("reservations", (reservation_id, self.id, connector_id, id_tag, expiry_date, response.status))
+        return response
+
+    async def cancel_reservation(self, reservation_id):
+        station_log.info(self.id, "CancelReservation", "❌ CancelReservation gönderiliyor - ID: %s, Reservation ID: %s", self.id, reservation_id)
+        return await self.call(call.CancelReservationPayload(reservation_id=reservation_id), suppress=False)
 
 
 async def on_connect(websocket, path):
     charge_point_id = path.strip("/") or f"CP_{id(websocket)}"
-    logger.info(f"🌐 Yeni bağlantı isteği - Path: {path}, Atanan ID: {charge_point_id}")
+    station_log.info(charge_point_id, "Connect", "🌐 Yeni bağlantı isteği - Path: %s, Atanan ID: %s", path, charge_point_id)
+    if connection_mode == "compact":
+        # Handshake başlıkları (~3 KB) bağlantı boyunca kullanılmıyor
+        websocket.request_headers = websocket.response_headers = _NO_HEADERS
     cp = ChargePoint(charge_point_id, websocket)
-    if 'db_pool' in globals():
-        await cp.set_db_pool(db_pool)
-    await cp.start()
+    previous = registry.add(cp)
+    if previous is not None:
+        # Aynı istasyon yeniden bağlandı; eski bağlantı arka planda kapatılır (close
+        # handshake'i close_timeout'a kadar sürebilir, yeni bağlantı beklemesin)
+        task = asyncio.create_task(previous._connection.close(code=1000, reason="Replaced by new connection"))
+        closing.add(task)
+        task.add_done_callback(closing.discard)
+    if ownership:
+        await ownership.claim(charge_point_id, websocket)
+    try:
+        await cp.start()
+    finally:
+        registry.remove(cp)
+        if charge_point_id not in registry:
+            liveness.disconnected(charge_point_id)
+            station_log.forget(charge_point_id)
+            rollup.forget(charge_point_id)
+        if ownership:
+            await ownership.release(charge_point_id, websocket)
 
 
 async def create_db_pool():
     try:
-        pool = await asyncpg.create_pool(
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASS"),
-            database=os.getenv("DB_NAME"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),
-            min_size=1,
-            max_size=10
-        )
+        pool = await db.create_pool()
         logger.info("✅ Veritabanı bağlantı havuzu oluşturuldu")
         return pool
     except Exception as e:
@@ -267,119 +522,241 @@ async def create_db_pool():
         return None
 
 
-async def main():
+async def connect_db():
+    """Migration'lar, havuz ve partition'lar; veritabanına ulaşılamazsa None."""
+    try:
+        applied = await db.migrate_database()
+        logger.info(f"✅ Veritabanı şeması hazır - Uygulanan migration: {applied or 'yok'}")
+    except Exception as e:
+        logger.error(f"⚠️ Migration hatası: {str(e)}")
+    pool = await create_db_pool()
+
+    if pool:
+        try:
+            async with pool.acquire() as conn:
+                await meter_samples.ensure_partitions(conn)
+        except Exception as e:
+            logger.error(f"⚠️ Partition oluşturma hatası: {str(e)}")
+    return pool
+
+
+def attach_db(pool):
     global db_pool
-    db_pool = await create_db_pool()
+    db_pool = pool
+    ChargePoint.db_pool = pool
+    writer.pool = pool
+    liveness.pool = pool
+    transactions.pool = pool
+    rollup.pool = pool
+    # Geç bağlanılsa da (reconnect_db) users değişiklikleri dinlenir
+    global listener_task
+    if pool is not None and listener_task is None:
+        listener_task = asyncio.create_task(listen_user_changes(float(os.getenv("DB_RETRY_INTERVAL", 10))))
+
+
+async def reconnect_db(interval):
+    # Açılışta veritabanı yoksa bulunana kadar dener; bu sürede kayıtlar spool'da,
+    # transaction'lar ve liveness bellekte bekler
+    while True:
+        await asyncio.sleep(interval)
+        pool = await connect_db()
+        if pool:
+            attach_db(pool)
+            logger.info("✅ Veritabanına bağlanıldı, spool yükleniyor")
+            return
+
+
+async def listen_user_changes(interval):
+    # users değişince ilgili id_tag önbellekten düşer. Bağlantı koparsa (termination
+    # listener ya da `interval`'da bir yapılan ping) yeniden abone olunur; aradaki
+    # değişiklikler kaçmış olabileceği için önbellek temizlenir
+    global listener_conn
+    while True:
+        lost = asyncio.Event()
+        try:
+            listener_conn = await db_pool.acquire()
+            await listener_conn.add_listener(auth_cache_module.CHANNEL, auth_cache.on_notify)
+            listener_conn.add_termination_listener(lambda conn: lost.set())
+            auth_cache.invalidate()
+            logger.info("👂 users LISTEN aktif")
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), interval)
+                except asyncio.TimeoutError:
+                    await asyncio.wait_for(listener_conn.fetchval("SELECT 1"), interval)
+            logger.warning("⚠️ users LISTEN bağlantısı koptu, yeniden abone olunacak")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"⚠️ users LISTEN hatası: {str(e)}")
+        await release_listener()
+        await asyncio.sleep(interval)
 
-    if db_pool:
+
+async def release_listener():
+    global listener_conn
+    conn, listener_conn = listener_conn, None
+    if conn is None:
+        return
+    try:
+        await db_pool.release(conn)
+    except Exception as e:
+        logger.warning(f"⚠️ users LISTEN bağlantısı bırakılamadı: {str(e)}")
+
+
+async def partition_maintenance():
+    # Ay dönümünde yeni partition'lar hazır olsun diye günde bir kontrol
+    while True:
+        await asyncio.sleep(24 * 3600)
+        if db_pool is None:
+            continue
         try:
             async with db_pool.acquire() as conn:
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        id SERIAL PRIMARY KEY,
-                        id_tag VARCHAR(50) UNIQUE NOT NULL,
-                        name VARCHAR(100),
-                        created_at TIMESTAMP DEFAULT NOW()
-                    );
-
-                    CREATE TABLE IF NOT EXISTS transactions (
-                        id SERIAL PRIMARY KEY,
-                        id_tag VARCHAR(50) NOT NULL,
-                        connector_id INTEGER NOT NULL,
-                        start_value INTEGER NOT NULL,
-                        stop_value INTEGER,
-                        start_time TIMESTAMP NOT NULL,
-                        stop_time TIMESTAMP,
-                        total_energy INTEGER,
-                        created_at TIMESTAMP DEFAULT NOW()
-                    );
-
-                    CREATE TABLE IF NOT EXISTS status_notifications (
-                        id SERIAL PRIMARY KEY,
-                        cp_id TEXT NOT NULL,
-                        connector_id INTEGER,
-                        status TEXT,
-                        error_code TEXT,
-                        vendor_id TEXT,
-                        timestamp TIMESTAMP,
-                        created_at TIMESTAMP DEFAULT NOW()
-                    );
-
-                    CREATE TABLE IF NOT EXISTS boot_notifications (
-                        id SERIAL PRIMARY KEY,
-                        cp_id TEXT NOT NULL,
-                        model TEXT,
-                        vendor TEXT,
-                        timestamp TIMESTAMP,
-                        created_at TIMESTAMP DEFAULT NOW()
-                    );
-
-                    CREATE TABLE IF NOT EXISTS heartbeats (
-                        id SERIAL PRIMARY KEY,
-                        cp_id TEXT NOT NULL,
-                        timestamp TIMESTAMP,
-                        created_at TIMESTAMP DEFAULT NOW()
-                    );
-
-                    CREATE TABLE IF NOT EXISTS authorizations (
-                        id SERIAL PRIMARY KEY,
-                        cp_id TEXT NOT NULL,
-                        id_tag VARCHAR(50),
-                        status TEXT,
-                        timestamp TIMESTAMP,
-                        created_at TIMESTAMP DEFAULT NOW()
-                    );
-
-                    CREATE TABLE IF NOT EXISTS meter_values (
-                        id SERIAL PRIMARY KEY,
-                        cp_id TEXT NOT NULL,
-                        connector_id INTEGER,
-                        meter_value TEXT,
-                        timestamp TIMESTAMP,
-                        created_at TIMESTAMP DEFAULT NOW()
-                    );
-
-                    CREATE TABLE IF NOT EXISTS firmware_status_notifications (
-                        id SERIAL PRIMARY KEY,
-                        cp_id TEXT NOT NULL,
-                        status TEXT,
-                        timestamp TIMESTAMP DEFAULT NOW(),
-                        created_at TIMESTAMP DEFAULT NOW()
-                    );
-
-                    CREATE TABLE IF NOT EXISTS diagnostics_status_notifications (
-                        id SERIAL PRIMARY KEY,
-                        cp_id TEXT NOT NULL,
-                        status TEXT,
-                        timestamp TIMESTAMP DEFAULT NOW(),
-                        created_at TIMESTAMP DEFAULT NOW()
-                    );
-
-                    CREATE TABLE IF NOT EXISTS reservations (
-                        id SERIAL PRIMARY KEY,
-                        cp_id TEXT NOT NULL,
-                        connector_id INTEGER,
-                        id_tag VARCHAR(50),
-                        expiry_date TIMESTAMP,
-                        status TEXT,
-                        created_at TIMESTAMP DEFAULT NOW()
-                    );
-                """)
-                logger.info("✅ Veritabanı tabloları hazır")
+                await meter_samples.ensure_partitions(conn)
         except Exception as e:
-            logger.error(f"⚠️ Tablo oluşturma hatası: {str(e)}")
+            logger.error(f"⚠️ Partition bakım hatası: {str(e)}")
+
+
+def reload_station_levels():
+    path = os.getenv("LOG_STATION_LEVELS_FILE")
+    if not path:
+        logger.warning("⚠️ LOG_STATION_LEVELS_FILE tanımlı değil, log seviyeleri değişmedi")
+        return
+    try:
+        station_log.load(path)
+    except Exception as e:
+        logger.error(f"⚠️ Log seviyeleri okunamadı - {path}: {str(e)}")
+
+
+@http_api.route("/debug/transactions")
+async def debug_transactions(path, request_headers):
+    """Açık transaction'lar ve anlık enerjileri; ?cp_id=CP_1 ile tek istasyon."""
+    sessions = transactions.active_sessions(http_api.query(path).get("cp_id"))
+    return http_api.json_response(http.HTTPStatus.OK, {"transactions": [session.to_dict() for session in sessions],
+                                        "stats": transactions.stats()})
+
+
+@http_api.route("/debug/smart-charging")
+async def debug_smart_charging(path, request_headers):
+    """Sahalar ve connector payları; ?site=S&limit_w=80000 ile saha sınırı anında değişir."""
+    params = http_api.query(path)
+    site_id = params.get("site")
+    if site_id is not None and site_id not in smart_charging.sites:
+        return http_api.json_response(http.HTTPStatus.NOT_FOUND, {"error": f"unknown site: {site_id}"})
+    if site_id is not None and "limit_w" in params:
+        try:
+            smart_charging.set_limit(site_id, params["limit_w"])
+        except ValueError as e:
+            return http_api.json_response(http.HTTPStatus.BAD_REQUEST, {"error": str(e)})
+    sites = [smart_charging.sites[site_id]] if site_id is not None else smart_charging.sites.values()
+    return http_api.json_response(http.HTTPStatus.OK, {
+        "sites": [dict(site.to_dict(), connectors=site.connectors() if site_id is not None else None)
+                  for site in sites],
+        "stats": smart_charging.stats(),
+    })
+
+
+async def check_db():
+    if db_pool is None:
+        return False
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval("SELECT 1") == 1
+
+
+async def main(reuse_port=False):
+    # Veritabanına yazılamayan kayıtlar diskte; her worker kendi dizininde
+    spool_dir = os.getenv("SPOOL_DIR", "spool")
+    if spool_dir and ownership:
+        spool_dir = os.path.join(spool_dir, f"worker-{ownership.slot}")
+    writer.spool = spool_module.Spool.from_env(spool_dir)
+    if writer.spool is not None:
+        writer.spool.open()
+        writer.spool.start()
+    # Veritabanısız verilen transaction id'leri: slot başına ayrı aralık, kirası spool dizininde
+    # TX_LOCAL_ID_INSTANCE: aynı veritabanını kullanan her sunucuya ayrı numara
+    transactions.use_local_ids(
+        ownership.slot if ownership else 0, spool_dir or None,
+        instance=int(os.getenv("TX_LOCAL_ID_INSTANCE", 0)),
+        # Rolling restart'ta slot'lar 0..2*WORKERS-1
+        slots=2 * int(os.getenv("WORKERS", 1)) if ownership else 1,
+    )
+    if not spool_dir:
+        logger.warning("⚠️ SPOOL_DIR boş; veritabanısız verilen transaction id'leri yeniden başlatmada tekrarlanabilir")
+
+    attach_db(await connect_db())
+    reconnect = None if db_pool else asyncio.create_task(reconnect_db(float(os.getenv("DB_RETRY_INTERVAL", 10))))
+
+    ChargePoint.codec.warm()
+    writer.start()
+    liveness.start()
+    transactions.start_flusher()
+    rollup.start()
+    if analytics is not None:
+        await analytics.start(reuse_port=reuse_port)
+    maintenance = asyncio.create_task(partition_maintenance())
+    loop_lag = asyncio.create_task(metrics.monitor_loop_lag())
+    http_api.ready_checks.append(("db", check_db))
+    admission_module.Protocol.admission = admission
 
     server = await websockets.serve(
         on_connect,
         host="0.0.0.0",
         port=int(os.environ.get("PORT", 8080)),
         subprotocols=["ocpp1.6"],
-        ping_interval=20,
-        ping_timeout=30
+        ping_interval=float(os.getenv("WS_PING_INTERVAL", 20)),
+        ping_timeout=float(os.getenv("WS_PING_TIMEOUT", 30)),
+        reuse_port=reuse_port,
+        # Kaynak başına hız, eşzamanlı handshake sınırı, takılı bağlantıların kapatılması
+        create_protocol=admission_module.Protocol,
+        # /health, /ready, /metrics aynı portta düz HTTP ile
+        process_request=http_api.process_request,
+        **websocket_options()
     )
-    logger.info("✅ OCPP 1.6 Sunucusu dinlemede...")
+    logger.info(f"✅ OCPP 1.6 Sunucusu dinlemede... PID: {os.getpid()}")
+    if ownership:
+        ownership.start()
+
+    # SIGTERM/SIGINT gelince yeni bağlantıları kapat, kuyrukları boşalt
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    # SIGUSR1: istasyon log seviyelerini LOG_STATION_LEVELS_FILE'dan yeniden oku
+    loop.add_signal_handler(signal.SIGUSR1, reload_station_levels)
+    await stop.wait()
+
+    logger.info("🛑 Sunucu kapanıyor...")
+    if ownership:
+        ownership.stop()
+    server.close()
     await server.wait_closed()
+    maintenance.cancel()
+    if reconnect:
+        reconnect.cancel()
+    loop_lag.cancel()
+    if listener_task:
+        listener_task.cancel()
+        await release_listener()
+    await liveness.stop()
+    await transactions.stop_flusher()
+    await rollup.stop()
+    if analytics is not None:
+        await analytics.stop()
+    await writer.stop()
+    logger.info(f"💾 Write-behind kuyrukları boşaltıldı: {writer.stats()}")
+    if writer.spool is not None:
+        await writer.spool.stop()
+        writer.spool.close()
+    if db_pool:
+        await db_pool.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if int(os.getenv("WORKERS", 1)) > 1:
+        # supervisor `import server` yapar; modül ikinci kez çalışıp metrikleri,
+        # log filtrelerini ve global durumu ikiler. __main__ zaten server'dır
+        sys.modules["server"] = sys.modules["__main__"]
+        import supervisor
+        supervisor.run()
+    else:
+        asyncio.run(main())
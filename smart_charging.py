@@ -0,0 +1,423 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+import numpy as np
+from ocpp.v16 import call
+
+logger = logging.getLogger("OCPP_Server")
+
+FAIR = "fair"
+PRIORITY = "priority"
+
+
+def waterfill(capacity, demand, weight):
+    """Ağırlıklı max-min adil paylaşım: her biri min(talep, λ·ağırlık), toplamı kapasite.
+
+    Talepler ağırlığa oranına göre sıralanır; talebi seviyenin altında kalanlar tamamen
+    karşılanır, kalan kapasite diğerlerine ağırlıkla bölünür. O(n log n), döngüsüz.
+    """
+    if capacity <= 0 or demand.size == 0:
+        return np.zeros_like(demand)
+    if demand.sum() <= capacity:
+        return demand.copy()
+    ratio = demand / weight
+    order = np.argsort(ratio, kind="stable")
+    sorted_demand = demand[order]
+    sorted_weight = weight[order]
+    # k'dan öncekiler tamamen karşılanırsa harcanan, k ve sonrasının ağırlık toplamı
+    below = np.concatenate(([0.0], np.cumsum(sorted_demand)[:-1]))
+    above = np.cumsum(sorted_weight[::-1])[::-1]
+    total = below + ratio[order] * above
+    k = int(np.searchsorted(total, capacity))
+    level = (capacity - below[k]) / above[k]
+    return np.minimum(demand, level * weight)
+
+
+def _watts(name, value, minimum=0.0):
+    value = float(value)
+    if not np.isfinite(value) or value < minimum:
+        raise ValueError(f"{name} must be a finite number >= {minimum:g}, got {value}")
+    return value
+
+
+class Site:
+    """Bir sahanın connector'ları; her alan ayrı bir numpy dizisi, satır = connector slot'u.
+
+    Slot'lar ilk görüldüklerinde (Start ya da MeterValues) açılır ve kapanmaz; diziler
+    dolunca iki katına büyür.
+    """
+
+    def __init__(self, site_id, limit_w, mode=FAIR, stations=None, connector_max_w=22000.0, connector_min_w=0.0):
+        self.site_id = site_id
+        self.limit_w = _watts("limit_w", limit_w)
+        self.mode = mode
+        self.stations = stations or {}  # cp_id -> {"priority", "max_w", "min_w"}
+        self.connector_max_w = _watts("connector_max_w", connector_max_w)
+        self.connector_min_w = _watts("connector_min_w", connector_min_w)
+        # Tanım hatası slot açılırken değil yüklemede yakalansın; sıfır öncelik
+        # waterfill'de sıfıra bölme (NaN pay) demek
+        for cp_id, options in self.stations.items():
+            priority = float(options.get("priority", 1))
+            if not np.isfinite(priority) or priority <= 0:
+                raise ValueError(f"{cp_id}: priority must be a finite number > 0, got {priority}")
+            for name in ("max_w", "min_w"):
+                if name in options:
+                    _watts(f"{cp_id}: {name}", options[name])
+        self.slots = {}  # (cp_id, connector_id) -> slot
+        self.keys = []  # slot -> (cp_id, connector_id)
+        self.size = 0
+        self.power = np.full(0, np.nan)  # son ölçülen güç (W); ölçüm yoksa NaN
+        self.active = np.zeros(0, dtype=bool)  # transaction açık mı
+        self.weight = np.ones(0)  # öncelik
+        self.max_w = np.zeros(0)
+        self.min_w = np.zeros(0)
+        self.started = np.zeros(0)  # başlama sırası; minimum güç yetmezse önce yeniler bekler
+        self.alloc = np.zeros(0)  # son hesaplanan pay (W)
+        self.sent = np.full(0, np.nan)  # istasyona son kabul ettirilen limit (W)
+        self.dirty = False
+        self.generation = 0  # her yeni hesapta artar; eski gönderim tekrar deneme planlamaz
+        self.push = None  # uçuştaki gönderim task'ı
+        self.handle = None
+        self.recomputes = 0
+        self.last_recompute_ms = 0.0
+
+    def slot(self, cp_id, connector_id):
+        key = (cp_id, connector_id)
+        slot = self.slots.get(key)
+        if slot is not None:
+            return slot
+        if self.size == self.power.size:
+            self._grow(max(16, self.size * 2))
+        slot = self.size
+        self.size += 1
+        self.slots[key] = slot
+        self.keys.append(key)
+        options = self.stations.get(cp_id) or {}
+        self.weight[slot] = float(options.get("priority", 1))
+        self.max_w[slot] = float(options.get("max_w", self.connector_max_w))
+        self.min_w[slot] = float(options.get("min_w", self.connector_min_w))
+        return slot
+
+    def _grow(self, capacity):
+        for name, fill in (("power", np.nan), ("active", False), ("weight", 1.0), ("max_w", 0.0),
+                           ("min_w", 0.0), ("started", 0.0), ("alloc", 0.0), ("sent", np.nan)):
+            old = getattr(self, name)
+            new = np.full(capacity, fill, dtype=old.dtype)
+            new[:old.size] = old
+            setattr(self, name, new)
+
+    def allocate(self, utilization=0.9, headroom=0.1):
+        """Aktif connector'ların payını yeniden hesaplar; `alloc` güncellenir."""
+        n = self.size
+        alloc = np.zeros(n)
+        active = np.flatnonzero(self.active[:n])
+        if active.size:
+            power = self.power[active]
+            max_w = self.max_w[active]
+            min_w = np.minimum(self.min_w[active], max_w)
+            weight = self.weight[active]
+            # Payını kullanan (ya da henüz ölçümü olmayan) araç en fazlasını ister; kullanmayanın
+            # talebi ölçülenin biraz üstü, artanı diğerlerine kalır
+            using = np.isnan(power) | (power >= self.alloc[active] * utilization)
+            demand = np.where(using, max_w, np.clip(np.nan_to_num(power) * (1 + headroom), min_w, max_w))
+            # Minimum güç herkese yetmiyorsa yüksek öncelikli ve önce başlayanlar alır, diğerleri 0
+            order = np.lexsort((self.started[active], -weight))
+            served = np.zeros(active.size, dtype=bool)
+            served[order[np.cumsum(min_w[order]) <= self.limit_w]] = True
+            floor = np.where(served, min_w, 0.0)
+            extra_demand = np.where(served, demand - floor, 0.0)
+            spare = self.limit_w - floor.sum()
+            if self.mode == PRIORITY:
+                # Üst seviye tamamen doyurulmadan alt seviyeye pay kalmaz
+                extra = np.zeros(active.size)
+                for level in np.unique(weight)[::-1]:
+                    mask = weight == level
+                    extra[mask] = waterfill(spare, extra_demand[mask], np.ones(int(mask.sum())))
+                    spare -= extra[mask].sum()
+            else:
+                extra = waterfill(spare, extra_demand, weight)
+            alloc[active] = floor + extra
+        self.alloc[:n] = alloc
+        return alloc
+
+    def changes(self, threshold_w):
+        """Limiti `threshold_w`'den fazla değişen aktif connector'lar: [(slot, W)]."""
+        n = self.size
+        sent = self.sent[:n]
+        alloc = self.alloc[:n]
+        changed = self.active[:n] & (np.isnan(sent) | (np.abs(alloc - sent) > threshold_w))
+        return [(int(slot), float(alloc[slot])) for slot in np.flatnonzero(changed)]
+
+    def to_dict(self):
+        n = self.size
+        return {
+            "site_id": self.site_id,
+            "mode": self.mode,
+            "limit_w": self.limit_w,
+            "measured_w": float(np.nansum(self.power[:n][self.active[:n]])),
+            "allocated_w": float(self.alloc[:n].sum()),
+            "active": int(self.active[:n].sum()),
+            "connectors": n,
+            "recomputes": self.recomputes,
+            "last_recompute_ms": round(self.last_recompute_ms, 3),
+        }
+
+    def connectors(self):
+        n = self.size
+        return [
+            {
+                "cp_id": cp_id,
+                "connector_id": connector_id,
+                "active": bool(self.active[slot]),
+                "power_w": None if np.isnan(self.power[slot]) else float(self.power[slot]),
+                "allocated_w": float(self.alloc[slot]),
+                "sent_w": None if np.isnan(self.sent[slot]) else float(self.sent[slot]),
+                "priority": float(self.weight[slot]),
+            }
+            for slot, (cp_id, connector_id) in enumerate(self.keys[:n])
+        ]
+
+
+class SmartCharging:
+    """Saha güç sınırı altında connector'lara güç paylaştıran yük yönetimi.
+
+    MeterValues'tan gelen anlık güç, Start/Stop ile açılıp kapanan connector'lar sahanın
+    dizilerine yazılır ve saha kirli işaretlenir. Kirli saha en fazla `delay` saniyede
+    bir yeniden hesaplanır (okumalar birleştirilir), hesap vektörel. Payı `threshold_w`'den
+    fazla değişen connector'lara TxDefaultProfile registry.fan_out ile gönderilir; istasyon
+    kabul ederse gönderilen limit kaydedilir, reddeder ya da cevap vermezse `retry_interval`
+    sonra tekrar denenir. Gönderim hesabı bekletmez: yeni hesap uçuştaki gönderimi iptal edip
+    güncel payları gönderir, cevap vermeyen bir istasyon sahayı dondurmaz. Oturum bitince
+    connector'ın profili ClearChargingProfile ile silinir.
+
+    Sahalar SMART_CHARGING_SITES_FILE (JSON) dosyasından:
+    {"saha": {"limit_w": 150000, "mode": "fair|priority", "connector_max_w": 22000,
+              "connector_min_w": 4140, "stations": {"CP_1": {"priority": 2, "max_w": 11000}}}}
+    Çok process'li modda her worker sadece kendi istasyonlarını görür; bir sahanın
+    istasyonları aynı worker'da olmalı (ya da WORKERS=1).
+    """
+
+    def __init__(self, registry, sites=(), threshold_w=500.0, delay=0.2, retry_interval=30.0, unit="W",
+                 voltage=230.0, phases=3, profile_id=9000, stack_level=1, utilization=0.9, headroom=0.1,
+                 concurrency=200, timeout=30.0):
+        self.registry = registry
+        self.sites = {}
+        self.by_station = {}  # cp_id -> Site
+        self.threshold_w = threshold_w
+        self.delay = delay
+        self.retry_interval = retry_interval
+        self.unit = unit
+        self.voltage = voltage
+        self.phases = phases
+        self.profile_id = profile_id
+        self.stack_level = stack_level
+        self.utilization = utilization
+        self.headroom = headroom
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.sequence = 0
+        self.pushed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.superseded = 0
+        self.cleared = 0
+        self._tasks = set()
+        for site in sites:
+            self.add_site(site)
+
+    @classmethod
+    def from_env(cls, registry):
+        engine = cls(
+            registry,
+            threshold_w=float(os.getenv("SMART_CHARGING_THRESHOLD_W", 500)),
+            delay=float(os.getenv("SMART_CHARGING_DELAY", 0.2)),
+            retry_interval=float(os.getenv("SMART_CHARGING_RETRY", 30)),
+            unit=os.getenv("SMART_CHARGING_UNIT", "W"),
+            voltage=float(os.getenv("SMART_CHARGING_VOLTAGE", 230)),
+            phases=int(os.getenv("SMART_CHARGING_PHASES", 3)),
+        )
+        path = os.getenv("SMART_CHARGING_SITES_FILE")
+        if path:
+            try:
+                engine.load(path)
+            except Exception as e:
+                logger.error(f"⚠️ Saha tanımları okunamadı - {path}: {str(e)}")
+        return engine
+
+    def load(self, path):
+        with open(path) as f:
+            config = json.load(f)
+        for site_id, options in config.items():
+            stations = options.get("stations") or {}
+            if isinstance(stations, list):
+                stations = {cp_id: {} for cp_id in stations}
+            self.add_site(Site(
+                site_id, options["limit_w"], mode=options.get("mode", FAIR), stations=stations,
+                connector_max_w=options.get("connector_max_w", 22000.0),
+                connector_min_w=options.get("connector_min_w", 0.0),
+            ))
+        logger.info("⚡ Yük yönetimi sahaları yüklendi - %d saha", len(config))
+
+    def add_site(self, site):
+        self.sites[site.site_id] = site
+        for cp_id in site.stations:
+            self.by_station[cp_id] = site
+
+    # ----- Olaylar (sıcak yol: sadece dizilere yazar) -----
+
+    def started(self, cp_id, connector_id):
+        site = self.by_station.get(cp_id)
+        if site is None:
+            return
+        slot = site.slot(cp_id, connector_id)
+        self.sequence += 1
+        site.active[slot] = True
+        site.started[slot] = self.sequence
+        site.power[slot] = np.nan
+        # Önceki oturumdan kalan limite güvenilmez; yeni pay mutlaka gönderilir
+        site.sent[slot] = np.nan
+        self._mark(site)
+
+    def stopped(self, cp_id, connector_id):
+        site = self.by_station.get(cp_id)
+        if site is None:
+            return
+        slot = site.slot(cp_id, connector_id)
+        site.active[slot] = False
+        site.power[slot] = np.nan
+        site.sent[slot] = np.nan
+        self._mark(site)
+        if self.registry is not None:
+            # Eski limit bir sonraki oturuma kalmasın
+            self._spawn(self._clear(cp_id, connector_id))
+
+    def reading(self, cp_id, connector_id, power_w):
+        site = self.by_station.get(cp_id)
+        if site is None:
+            return
+        slot = site.slot(cp_id, connector_id)
+        site.power[slot] = power_w
+        if site.active[slot]:
+            self._mark(site)
+
+    def set_limit(self, site_id, limit_w):
+        site = self.sites[site_id]
+        site.limit_w = _watts("limit_w", limit_w)
+        self._mark(site)
+
+    # ----- Hesap ve gönderim -----
+
+    def _mark(self, site):
+        site.dirty = True
+        if site.handle is None:
+            site.handle = asyncio.get_running_loop().call_later(self.delay, self._run, site)
+
+    def _run(self, site):
+        site.handle = None
+        self._spawn(self.recompute(site))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def recompute(self, site):
+        site.dirty = False
+        started = time.perf_counter()
+        site.allocate(self.utilization, self.headroom)
+        changes = site.changes(self.threshold_w)
+        site.recomputes += 1
+        site.last_recompute_ms = (time.perf_counter() - started) * 1000
+        if self.registry is None:
+            return
+        if site.push is not None and not site.push.done():
+            # Uçuştaki paylar eskidi; kabul edilmeyenler `changes`'te tekrar var
+            site.push.cancel()
+            self.superseded += 1
+        site.generation += 1
+        site.push = self._spawn(self._push(site, changes, site.generation)) if changes else None
+
+    def profile(self, connector_id, limit_w):
+        if self.unit == "A":
+            limit = round(limit_w / (self.voltage * self.phases), 1)
+        else:
+            limit = int(limit_w)
+        return call.SetChargingProfilePayload(connector_id=connector_id, cs_charging_profiles={
+            # Aynı id önceki profilin yerine geçer
+            "charging_profile_id": self.profile_id + connector_id,
+            "stack_level": self.stack_level,
+            "charging_profile_purpose": "TxDefaultProfile",
+            "charging_profile_kind": "Relative",
+            "charging_schedule": {
+                "charging_rate_unit": self.unit,
+                "charging_schedule_period": [{"start_period": 0, "limit": limit}],
+            },
+        })
+
+    async def _clear(self, cp_id, connector_id):
+        try:
+            await self.registry.call(cp_id, call.ClearChargingProfilePayload(
+                id=self.profile_id + connector_id, connector_id=connector_id,
+                charging_profile_purpose="TxDefaultProfile", stack_level=self.stack_level,
+            ), timeout=self.timeout)
+            self.cleared += 1
+        except KeyError:
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ Şarj profili silinemedi - ID: {cp_id}, Connector: {connector_id}: {str(e) or type(e).__name__}")
+
+    async def _push(self, site, changes, generation):
+        try:
+            await self._send(site, changes, generation)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"⚠️ Şarj profili gönderilemedi - Saha: {site.site_id}: {str(e)}")
+
+    async def _send(self, site, changes, generation):
+        # Bir istasyona aynı anda tek CALL gider; çok connector'lu istasyonlar turlara bölünür
+        queued = {}
+        for slot, limit in changes:
+            queued.setdefault(site.keys[slot][0], []).append((slot, limit))
+        retry = False
+        while queued:
+            batch = {cp_id: items.pop() for cp_id, items in queued.items()}
+            queued = {cp_id: items for cp_id, items in queued.items() if items}
+
+            def accepted(cp_id, response, batch=batch):
+                # Kabul edilen limit istasyonda; gönderim sonradan iptal edilse de kaydedilir
+                if response.status == "Accepted":
+                    site.sent[batch[cp_id][0]] = batch[cp_id][1]
+                    self.pushed += 1
+
+            result = await self.registry.fan_out(
+                list(batch),
+                lambda cp_id: self.profile(site.keys[batch[cp_id][0]][1], batch[cp_id][1]),
+                concurrency=self.concurrency, timeout=self.timeout, on_response=accepted,
+            )
+            if generation != site.generation:
+                # Bu arada yeni pay hesaplandı; kalan turlar ve tekrar deneme onun işi
+                return
+            rejected = sum(response.status != "Accepted" for response in result.succeeded.values())
+            if rejected:
+                self.rejected += rejected
+                retry = True
+            if result.failed or result.timed_out:
+                self.failed += len(result.failed) + len(result.timed_out)
+                retry = True
+        if retry:
+            asyncio.get_running_loop().call_later(self.retry_interval, self._mark, site)
+
+    def stats(self):
+        return {
+            "sites": len(self.sites),
+            "pushed": self.pushed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "superseded": self.superseded,
+            "cleared": self.cleared,
+        }
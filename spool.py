@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import mmap
+import os
+import pickle
+import struct
+import zlib
+
+logger = logging.getLogger("OCPP_Server")
+
+# Kayıt: uzunluk (u32), crc32 (u32), durum (u8), sonra pickle'lanmış (tablo, satırlar).
+# Durum crc'ye dahil değil; replay sonrası yerinde 1 yapılır. Uzunluk 0 = segmentin sonu.
+HEADER = struct.Struct("<IIB")
+PENDING = 0
+CONSUMED = 1
+PAGE = mmap.PAGESIZE
+
+
+class _Segment:
+    __slots__ = ("seq", "path", "size", "file", "map", "end", "read", "pending")
+
+    def __init__(self, seq, path, size):
+        self.seq = seq
+        self.path = path
+        self.size = size
+        self.file = None
+        self.map = None
+        self.end = 0  # yazma konumu
+        self.read = 0  # ilk tüketilmemiş kaydın konumu
+        self.pending = 0
+
+    def open(self, create):
+        fd = os.open(self.path, os.O_RDWR | (os.O_CREAT if create else 0), 0o600)
+        self.file = os.fdopen(fd, "r+b")
+        if create:
+            # Seyrek dosya; diskte sadece yazılan sayfalar yer kaplar
+            os.ftruncate(fd, self.size)
+        else:
+            self.size = os.fstat(fd).st_size
+        self.map = mmap.mmap(fd, self.size)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+            self.map = self.file = None
+
+    def records(self, start=0):
+        """(konum, durum, payload) sırayla; bozuk ya da yarım kayıtta durur."""
+        offset = start
+        while offset + HEADER.size <= self.size:
+            length, crc, state = HEADER.unpack_from(self.map, offset)
+            if length == 0:
+                return
+            body = offset + HEADER.size
+            if body + length > self.size:
+                return
+            payload = self.map[body:body + length]
+            if zlib.crc32(payload) != crc or state not in (PENDING, CONSUMED):
+                return
+            yield offset, state, payload
+            offset = body + length
+
+
+class Record:
+    __slots__ = ("segment", "offset", "table", "rows")
+
+    def __init__(self, segment, offset, table, rows):
+        self.segment = segment
+        self.offset = offset
+        self.table = table
+        self.rows = rows
+
+
+class Spool:
+    """Veritabanına yazılamayan kayıtlar için diskte, sadece sona eklenen kuyruk.
+
+    Kayıtlar `segment_bytes` boyutlu, mmap'lenmiş segment dosyalarına (table, satırlar)
+    olarak yazılır ve eklendikleri sırayla geri okunur. Toplam boyut `max_bytes`'ı
+    geçecekse yeni kayıt kabul edilmez (düşürülür ve sayılır). Açılışta segmentler
+    taranır: crc'si tutmayan ya da yarım kalan ilk kayıttan sonrası (çökme anında
+    yazılan kuyruk) sıfırlanır, tüketilmiş kayıtlar atlanır.
+
+    `sync` açıkken eklemeler ve tüketmeler `sync_interval` saniyede bir topluca
+    (group commit) fsync ile diske indirilir. fsync executor'da çalışır (mmap.flush
+    GIL'i bırakmadığı için kullanılmaz); kesinti sırasında her batch'te event loop
+    durmasın. Süreç çökerse son `sync_interval` içindeki kayıtlar işletim sisteminde
+    kalır; makine çökerse bunlar kaybolabilir.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, max_bytes=1024 * 1024 * 1024, sync=True,
+                 sync_interval=0.1):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.sync = sync
+        self.sync_interval = sync_interval
+        self.segments = []  # seq sırasıyla; sonuncusu yazılan segment
+        self.unsynced = set()  # son fsync'ten beri değişen segmentler
+        self.pending = 0
+        self.appended = 0
+        self.consumed = 0
+        self.dropped = 0
+        self.truncated = 0
+        self.syncs = 0
+        self._task = None
+
+    @classmethod
+    def from_env(cls, directory=None):
+        """SPOOL_DIR boşsa spool kapalı: None."""
+        directory = directory if directory is not None else os.getenv("SPOOL_DIR", "spool")
+        if not directory:
+            return None
+        return cls(
+            directory,
+            segment_bytes=int(os.getenv("SPOOL_SEGMENT_MB", 64)) * 1024 * 1024,
+            max_bytes=int(os.getenv("SPOOL_MAX_MB", 1024)) * 1024 * 1024,
+            sync=os.getenv("SPOOL_SYNC", "1") == "1",
+            sync_interval=float(os.getenv("SPOOL_SYNC_INTERVAL", 0.1)),
+        )
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f"segment-{seq:012d}.spool")
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith("segment-") and name.endswith(".spool"):
+                segment = _Segment(int(name[8:-6]), os.path.join(self.directory, name), 0)
+                segment.open(create=False)
+                self._recover(segment)
+                if segment.pending:
+                    self.segments.append(segment)
+                else:
+                    self._remove(segment)
+        if self.pending:
+            logger.warning(f"💽 Spool'da bekleyen kayıt var - Kayıt: {self.pending}, Segment: {len(self.segments)}")
+        return self
+
+    def _recover(self, segment):
+        first = None
+        end = 0
+        for offset, state, _ in segment.records():
+            end = offset + HEADER.size + HEADER.unpack_from(segment.map, offset)[0]
+            if state == PENDING:
+                segment.pending += 1
+                if first is None:
+                    first = offset
+        if end + HEADER.size <= segment.size and HEADER.unpack_from(segment.map, end)[0] != 0:
+            # Çökme sırasında yarım kalmış kayıt(lar); sonraki eklemeler temiz alana yazılsın
+            self.truncated += 1
+            logger.warning(f"💽 Spool segmenti bozuk kuyruktan kesildi - {segment.path}, Konum: {end}")
+            chunk = bytes(1024 * 1024)
+            for offset in range(end, segment.size, len(chunk)):
+                segment.map[offset:min(offset + len(chunk), segment.size)] = chunk[:segment.size - offset]
+            segment.map.flush()
+        segment.end = end
+        segment.read = first if first is not None else end
+        self.pending += segment.pending
+
+    def _remove(self, segment):
+        self.unsynced.discard(segment)
+        segment.close()
+        try:
+            os.unlink(segment.path)
+        except FileNotFoundError:
+            pass
+
+    def disk_bytes(self):
+        return sum(segment.size for segment in self.segments)
+
+    def append(self, table, rows):
+        """Kaydı diske yazar; sınır aşılıyorsa False."""
+        payload = pickle.dumps((table, rows), protocol=pickle.HIGHEST_PROTOCOL)
+        needed = HEADER.size + len(payload)
+        segment = self.segments[-1] if self.segments else None
+        # Sondaki uzunluk-0 işaretine de yer kalmalı
+        if segment is None or segment.end + needed + HEADER.size > segment.size:
+            size = max(self.segment_bytes, -(-(needed + HEADER.size) // PAGE) * PAGE)
+            if self.disk_bytes() + size > self.max_bytes:
+                self.dropped += len(rows)
+                logger.error(f"❌ Spool dolu, kayıtlar düşürüldü - Tablo: {table}, Kayıt: {len(rows)}")
+                return False
+            if segment is not None and not segment.pending:
+                self.segments.remove(segment)
+                self._remove(segment)
+            seq = self.segments[-1].seq + 1 if self.segments else (segment.seq + 1 if segment else 0)
+            segment = _Segment(seq, self._path(seq), size)
+            segment.open(create=True)
+            self.segments.append(segment)
+        offset = segment.end
+        body = offset + HEADER.size
+        segment.map[body:body + len(payload)] = payload
+        # Başlık en son: yarım kalan yazma uzunluk-0 ya da crc hatası olarak görünür
+        HEADER.pack_into(segment.map, offset, len(payload), zlib.crc32(payload), PENDING)
+        segment.end = body + len(payload)
+        if self.sync:
+            self.unsynced.add(segment)
+        segment.pending += 1
+        self.pending += 1
+        self.appended += 1
+        return True
+
+    def peek(self):
+        """Sıradaki tüketilmemiş kayıt ya da None."""
+        for segment in self.segments:
+            if not segment.pending:
+                continue
+            for offset, state, payload in segment.records(segment.read):
+                if state == PENDING:
+                    table, rows = pickle.loads(payload)
+                    return Record(segment, offset, table, rows)
+        return None
+
+    def consume(self, record):
+        segment = record.segment
+        segment.map[record.offset + HEADER.size - 1] = CONSUMED
+        if self.sync:
+            self.unsynced.add(segment)
+        segment.read = record.offset + HEADER.size + HEADER.unpack_from(segment.map, record.offset)[0]
+        segment.pending -= 1
+        self.pending -= 1
+        self.consumed += 1
+        # Yazılan segment dışındaki boşalan segmentler silinir
+        if not segment.pending and segment is not self.segments[-1]:
+            self.segments.remove(segment)
+            self._remove(segment)
+
+    async def flush(self):
+        """Değişen segmentleri fsync'ler (paylaşılan mmap sayfaları dahil); loop beklemez."""
+        if not self.unsynced:
+            return
+        fds = [segment.file.fileno() for segment in self.unsynced]
+        self.unsynced.clear()
+        loop = asyncio.get_running_loop()
+        for fd in fds:
+            try:
+                await loop.run_in_executor(None, os.fsync, fd)
+            except OSError as e:
+                # Arada silinip kapanan segment; içinde bekleyen kayıt kalmamıştı
+                logger.warning(f"⚠️ Spool fsync hatası: {str(e)}")
+        self.syncs += 1
+
+    def start(self):
+        if self.sync and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            await self.flush()
+
+    def close(self):
+        # Kapanışta kalan değişiklikler beklenerek diske
+        for segment in self.unsynced:
+            os.fsync(segment.file.fileno())
+        self.unsynced.clear()
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "segments": len(self.segments),
+            "disk_bytes": self.disk_bytes(),
+            "appended": self.appended,
+            "consumed": self.consumed,
+            "dropped_rows": self.dropped,
+            "truncated": self.truncated,
+            "syncs": self.syncs,
+        }
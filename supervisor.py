@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import queue
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.managers import SyncManager
+
+import logs
+import server
+
+logger = logging.getLogger("OCPP_Server")
+
+
+def _ignore_sigint():
+    # Ctrl+C bütün process grubuna gider; manager en son kapanmalı
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Ownership:
+    """charge_point_id -> sahibi olan worker slot'u (bütün worker'lar arasında paylaşılır).
+
+    Bir istasyon başka bir worker'a yeniden bağlanırsa yeni bağlantı kazanır; eski
+    sahibin gelen kutusuna (inbox) tahliye mesajı bırakılır ve eski bağlantı kapatılır.
+    """
+
+    def __init__(self, manager, ctx, slots):
+        self.owners = manager.dict()  # cp_id -> (slot, seq)
+        self.lock = manager.Lock()
+        self.seq = manager.Value("q", 0)
+        self.inboxes = [ctx.Queue() for _ in range(slots)]
+
+    def claim(self, cp_id, slot):
+        # seq sahiplik sırasını belirler; eski tahliye mesajı yeni bağlantıyı kapatmasın
+        with self.lock:
+            self.seq.value += 1
+            seq = self.seq.value
+            previous = self.owners.get(cp_id)
+            self.owners[cp_id] = (slot, seq)
+        if previous is not None and previous[0] != slot:
+            self.inboxes[previous[0]].put((cp_id, seq))
+        return seq
+
+    def release(self, cp_id, slot, seq):
+        with self.lock:
+            if self.owners.get(cp_id) == (slot, seq):
+                del self.owners[cp_id]
+
+    def release_all(self, slot):
+        # Çöken worker'ın kayıtlarını temizle
+        with self.lock:
+            for cp_id in [cp_id for cp_id, owner in self.owners.items() if owner[0] == slot]:
+                del self.owners[cp_id]
+
+
+class WorkerOwnership:
+    """Worker içindeki taraf: yerel bağlantılar ve tahliye dinleyicisi.
+
+    Manager çağrıları (her bağlanma/kopma bir IPC turu) kendi thread havuzlarında; boot
+    fırtınasında loop'un varsayılan executor'ını (spool fsync'leri) doldurmazlar.
+    """
+
+    def __init__(self, shared, stats, slot, stats_interval=10.0, threads=8):
+        self.shared = shared
+        self.stats = stats
+        self.slot = slot
+        self.stats_interval = stats_interval
+        self.local = {}  # cp_id -> [websocket, seq]
+        self._superseded = {}  # claim'i sürerken gelen tahliyeler: cp_id -> seq
+        self._tasks = []
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="ownership")
+        # Gelen kutusu sürekli bekler; claim/release thread'lerinden birini tutmasın
+        self._inbox_executor = ThreadPoolExecutor(1, thread_name_prefix="ownership-inbox")
+
+    async def claim(self, cp_id, websocket):
+        loop = asyncio.get_running_loop()
+        # Aynı worker'daki eski bağlantıyı server.on_connect (registry) kapatır
+        entry = [websocket, None]  # [websocket, seq]; seq claim tamamlanınca dolar
+        self.local[cp_id] = entry
+        try:
+            entry[1] = await loop.run_in_executor(self._executor, self.shared.claim, cp_id, self.slot)
+        except Exception as e:
+            logger.error(f"⚠️ Sahiplik kaydı hatası - ID: {cp_id}: {str(e)}")
+            return
+        # claim sürerken başka worker daha yeni bir sahiplik aldıysa bu bağlantı kaybeder
+        if self._superseded.pop(cp_id, 0) > entry[1]:
+            await self._evict(cp_id, entry)
+
+    async def release(self, cp_id, websocket):
+        entry = self.local.get(cp_id)
+        if entry is None or entry[0] is not websocket:
+            return
+        del self.local[cp_id]
+        if entry[1] is None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self.shared.release, cp_id, self.slot, entry[1])
+        except Exception as e:
+            logger.error(f"⚠️ Sahiplik bırakma hatası - ID: {cp_id}: {str(e)}")
+
+    async def _evict(self, cp_id, entry):
+        if self.local.get(cp_id) is entry:
+            del self.local[cp_id]
+        logger.info(f"🔀 Bağlantı başka worker'a geçti, kapatılıyor - ID: {cp_id}")
+        await entry[0].close(code=1000, reason="Owned by another worker")
+
+    def start(self):
+        self._tasks = [
+            asyncio.create_task(self._evictions()),
+            asyncio.create_task(self._report()),
+        ]
+        self.stats[self.slot] = self._snapshot(ready=True)
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        # claim/release havuzu açık kalır; kapanışta kopan bağlantılar sahipliği bırakır
+        self._inbox_executor.shutdown(wait=False)
+
+    async def _evictions(self):
+        loop = asyncio.get_running_loop()
+        inbox = self.shared.inboxes[self.slot]
+        while True:
+            try:
+                # Kısa timeout: kapanışta executor thread'i takılı kalmasın
+                message = await loop.run_in_executor(self._inbox_executor, inbox.get, True, 1.0)
+            except queue.Empty:
+                continue
+            cp_id, seq = message
+            entry = self.local.get(cp_id)
+            if entry is None:
+                continue
+            if entry[1] is None:
+                self._superseded[cp_id] = max(self._superseded.get(cp_id, 0), seq)
+            elif entry[1] < seq:
+                await self._evict(cp_id, entry)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            try:
+                self.stats[self.slot] = self._snapshot(ready=True)
+            except Exception as e:
+                logger.error(f"⚠️ Worker istatistik hatası: {str(e)}")
+
+    def _snapshot(self, ready):
+        writer_stats = server.writer.stats()
+        return {
+            "pid": os.getpid(),
+            "ready": ready,
+            "connections": len(self.local),
+            "queued": sum(q["depth"] for q in writer_stats["queues"].values()),
+            "flushes": writer_stats["flushes"],
+            "auth_cache": server.auth_cache.stats(),
+            "liveness": server.liveness.stats(),
+            "transactions": server.transactions.stats(),
+            "rollup": server.rollup.stats(),
+            "admission": server.admission.stats(),
+            "smart_charging": server.smart_charging.stats(),
+            "logging": server.station_log.stats(),
+            "updated_at": time.time(),
+        }
+
+
+def _worker_main(shared, stats, slot, stats_interval):
+    # Supervisor'ın sinyal handler'ları fork ile geldi; worker kendi handler'larını kurar
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)  # server.main kendi handler'ını kurana kadar
+    server.ownership = WorkerOwnership(shared, stats, slot, stats_interval,
+                                       threads=int(os.getenv("OWNERSHIP_THREADS", 8)))
+    try:
+        asyncio.run(server.main(reuse_port=True))
+    finally:
+        # multiprocessing çocuğu atexit çalıştırmadan çıkar; kuyruktaki loglar yazılsın
+        logs.stop()
+
+
+class Supervisor:
+    """N adet worker process'i SO_REUSEPORT ile aynı portta çalıştırır.
+
+    SIGTERM/SIGINT: hepsini düzgünce kapatır. SIGHUP: worker'ları tek tek yeniden
+    başlatır (yenisi hazır olunca eskisi kapanır). Ölen worker yeniden başlatılır.
+    """
+
+    def __init__(self, workers, grace=30.0, stats_interval=10.0):
+        self.workers = workers
+        self.grace = grace
+        self.stats_interval = stats_interval
+        self.ctx = mp.get_context("fork")
+        self.processes = {}  # slot -> Process
+        self._stopping = False
+        self._restart = False
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            workers=int(os.getenv("WORKERS", os.cpu_count() or 1)),
+            grace=float(os.getenv("WORKER_GRACE", 30)),
+            stats_interval=float(os.getenv("WORKER_STATS_INTERVAL", 10)),
+        )
+
+    def run(self):
+        self.manager = SyncManager(ctx=self.ctx)
+        self.manager.start(initializer=_ignore_sigint)
+        # Rolling restart sırasında eski ve yeni worker ayrı slot kullanır
+        self.shared = Ownership(self.manager, self.ctx, self.workers * 2)
+        self.stats = self.manager.dict()
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_restart)
+        signal.signal(signal.SIGUSR1, self._on_reload_logging)
+
+        logger.info(f"🚀 Supervisor başladı - PID: {os.getpid()}, Worker: {self.workers}")
+        # İlk worker tabloları hazırlasın, diğerleri sonra gelsin
+        for slot in range(self.workers):
+            self._spawn(slot)
+            if slot == 0:
+                self._wait_ready(slot)
+
+        last_report = time.monotonic()
+        while not self._stopping:
+            time.sleep(1)
+            self._reap()
+            if self._restart:
+                self._restart = False
+                self._rolling_restart()
+            if time.monotonic() - last_report >= self.stats_interval:
+                last_report = time.monotonic()
+                self._log_stats()
+
+        self._shutdown()
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _on_restart(self, signum, frame):
+        self._restart = True
+
+    def _on_reload_logging(self, signum, frame):
+        # İstasyon log seviyeleri her worker'da ayrı tutulur
+        for process in self.processes.values():
+            os.kill(process.pid, signal.SIGUSR1)
+
+    def _spawn(self, slot):
+        process = self.ctx.Process(
+            target=_worker_main,
+            args=(self.shared, self.stats, slot, self.stats_interval),
+            name=f"ocpp-worker-{slot}",
+        )
+        process.start()
+        self.processes[slot] = process
+        logger.info(f"👷 Worker başlatıldı - Slot: {slot}, PID: {process.pid}")
+
+    def _wait_ready(self, slot):
+        deadline = time.monotonic() + self.grace
+        while time.monotonic() < deadline and not self._stopping:
+            if self.stats.get(slot, {}).get("ready") and self.stats[slot]["pid"] == self.processes[slot].pid:
+                return True
+            if not self.processes[slot].is_alive():
+                return False
+            time.sleep(0.2)
+        return False
+
+    def _stop_worker(self, slot):
+        process = self.processes.pop(slot)
+        process.terminate()  # SIGTERM: server.main kuyrukları boşaltıp çıkar
+        process.join(self.grace)
+        if process.is_alive():
+            logger.warning(f"⚠️ Worker süresinde kapanmadı, öldürülüyor - PID: {process.pid}")
+            process.kill()
+            process.join()
+        self.stats.pop(slot, None)
+        self.shared.release_all(slot)
+
+    def _reap(self):
+        for slot, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            logger.error(f"❌ Worker çöktü - Slot: {slot}, PID: {process.pid}, Kod: {process.exitcode}")
+            del self.processes[slot]
+            self.stats.pop(slot, None)
+            self.shared.release_all(slot)
+            if not self._stopping:
+                self._spawn(slot)
+
+    def _rolling_restart(self):
+        logger.info("🔁 Worker'lar sırayla yeniden başlatılıyor")
+        for slot in list(self.processes):
+            if self._stopping:
+                return
+            new_slot = (slot + self.workers) % (self.workers * 2)
+            self._spawn(new_slot)
+            if not self._wait_ready(new_slot):
+                logger.error(f"❌ Yeni worker hazır olmadı, restart durduruldu - Slot: {new_slot}")
+                return
+            self._stop_worker(slot)
+
+    def _log_stats(self):
+        stats = dict(self.stats)
+        total = sum(s.get("connections", 0) for s in stats.values())
+        logger.info(f"📊 Worker istatistikleri - Toplam bağlantı: {total}, Worker: {stats}")
+
+    def _shutdown(self):
+        logger.info("🛑 Supervisor kapanıyor...")
+        for process in self.processes.values():
+            process.terminate()
+        for slot in list(self.processes):
+            self._stop_worker(slot)
+        self.manager.shutdown()
+
+
+def run():
+    Supervisor.from_env().run()
+
+
+if __name__ == "__main__":
+    run()
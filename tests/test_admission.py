@@ -0,0 +1,101 @@
+import http
+
+from websockets.datastructures import Headers
+
+import admission
+from admission import Admission, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeWebSocket:
+    def __init__(self, ip="10.0.0.1"):
+        self.remote_address = (ip, 40000)
+
+
+def use_clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def status(response):
+    return None if response is None else response[0]
+
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(rate=2.0, burst=3, now=0.0)
+    assert [bucket.take(0.0) for _ in range(4)] == [True, True, True, False]
+    # 0.5 sn'de bir token
+    assert not bucket.take(0.4)
+    assert bucket.take(0.5)
+    assert not bucket.full(1.0)
+    assert bucket.full(10.0)
+    bucket.take(100.0)
+    # Birikim burst'ü aşmaz
+    assert bucket.tokens == 2
+
+
+def test_source_rate_limit(monkeypatch):
+    clock = use_clock(monkeypatch)
+    gate = Admission(source_rate=1.0, source_burst=2, max_handshakes=0)
+    headers = Headers()
+    results = [status(gate.admit(FakeWebSocket(), headers)) for _ in range(3)]
+    assert results == [None, None, http.HTTPStatus.TOO_MANY_REQUESTS]
+    # Başka kaynak etkilenmez
+    assert gate.admit(FakeWebSocket("10.0.0.2"), headers) is None
+    clock.now += 1.0
+    assert gate.admit(FakeWebSocket(), headers) is None
+    assert gate.rate_limited == 1
+
+
+def test_rejection_carries_retry_after(monkeypatch):
+    use_clock(monkeypatch)
+    gate = Admission(source_rate=1.0, source_burst=1, retry_after=30)
+    gate.admit(FakeWebSocket(), Headers())
+    code, headers, _ = gate.admit(FakeWebSocket(), Headers())
+    assert code == http.HTTPStatus.TOO_MANY_REQUESTS
+    assert 1 <= int(dict(headers)["Retry-After"]) <= 30
+
+
+def test_forwarded_source_behind_proxy(monkeypatch):
+    use_clock(monkeypatch)
+    gate = Admission(source_rate=1.0, source_burst=1, proxy_hops=1)
+    proxy = FakeWebSocket("192.168.0.1")
+    first = Headers({"X-Forwarded-For": "10.1.1.1"})
+    second = Headers({"X-Forwarded-For": "10.1.1.2"})
+    assert gate.admit(proxy, first) is None
+    # Aynı proxy adresi, farklı istemci: ayrı kova
+    assert gate.admit(proxy, second) is None
+    assert status(gate.admit(proxy, first)) == http.HTTPStatus.TOO_MANY_REQUESTS
+
+
+def test_handshake_limit_frees_on_first_message(monkeypatch):
+    clock = use_clock(monkeypatch)
+    gate = Admission(source_rate=100.0, source_burst=100, max_handshakes=2, handshake_timeout=30)
+    first, second = FakeWebSocket(), FakeWebSocket()
+    assert gate.admit(first, Headers()) is None
+    assert gate.admit(second, Headers()) is None
+    assert status(gate.admit(FakeWebSocket(), Headers())) == http.HTTPStatus.SERVICE_UNAVAILABLE
+    gate.seen(first)
+    assert gate.admit(FakeWebSocket(), Headers()) is None
+    # Süresi geçen handshake sınırdan düşer, takılı sayılır
+    clock.now += 31
+    assert gate.admit(FakeWebSocket(), Headers()) is None
+    assert gate.stats()["idle"] == 2
+
+
+def test_boot_burst_then_pending(monkeypatch):
+    use_clock(monkeypatch)
+    gate = Admission(boot_rate=1.0, boot_burst=3, pending_min=10, pending_max=60)
+    assert [gate.defer_boot() for _ in range(3)] == [None, None, None]
+    intervals = [gate.defer_boot() for _ in range(50)]
+    assert all(10 <= interval <= 60 for interval in intervals)
+    assert gate.pending_boots == 50
+    assert gate.stats()["boot_backlog"] == 50
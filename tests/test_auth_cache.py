@@ -0,0 +1,84 @@
+import auth_cache
+from auth_cache import AuthCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def use_clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(auth_cache.time, "monotonic", clock)
+    return clock
+
+
+def test_accepted_expires_after_ttl(monkeypatch):
+    clock = use_clock(monkeypatch)
+    cache = AuthCache(ttl=300, negative_ttl=60)
+    cache.put("TAG", "Accepted")
+    clock.now += 299
+    assert cache.get("TAG") == "Accepted"
+    clock.now += 2
+    assert cache.get("TAG") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_unknown_tag_uses_negative_ttl(monkeypatch):
+    clock = use_clock(monkeypatch)
+    cache = AuthCache(ttl=300, negative_ttl=60)
+    cache.put("UNKNOWN", "Invalid")
+    clock.now += 59
+    assert cache.get("UNKNOWN") == "Invalid"
+    clock.now += 2
+    assert cache.get("UNKNOWN") is None
+
+
+def test_expired_entry_is_used_when_database_is_down(monkeypatch):
+    clock = use_clock(monkeypatch)
+    cache = AuthCache(ttl=300, offline_status="Accepted")
+    cache.put("REVOKED", "Invalid")
+    clock.now += 3600
+    assert cache.get("REVOKED") is None
+    assert cache.stale("REVOKED") == "Invalid"
+    assert cache.stale("NEVER_SEEN") == "Accepted"
+
+
+def test_notify_invalidates_one_tag_or_all():
+    cache = AuthCache()
+    cache.put("A", "Accepted")
+    cache.put("B", "Accepted")
+    cache.on_notify(None, 0, auth_cache.CHANNEL, "A")
+    assert cache.get("A") is None
+    assert cache.get("B") == "Accepted"
+    # TRUNCATE: boş payload bütün önbelleği temizler
+    cache.on_notify(None, 0, auth_cache.CHANNEL, "")
+    assert cache.get("B") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_lookup_racing_an_invalidation_is_not_cached():
+    cache = AuthCache()
+    generation = cache.generation
+    # Sorgu sürerken users değişti
+    cache.on_notify(None, 0, auth_cache.CHANNEL, "TAG")
+    cache.put("TAG", "Accepted", generation)
+    assert cache.get("TAG") is None
+    assert cache.stats()["discarded"] == 1
+    cache.put("TAG", "Invalid", cache.generation)
+    assert cache.get("TAG") == "Invalid"
+
+
+def test_lru_evicts_oldest():
+    cache = AuthCache(max_size=2)
+    cache.put("A", "Accepted")
+    cache.put("B", "Accepted")
+    assert cache.get("A") == "Accepted"
+    cache.put("C", "Accepted")
+    assert cache.get("B") is None
+    assert cache.get("A") == "Accepted"
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,90 @@
+import copy
+
+import pytest
+from ocpp.exceptions import OCPPError, ValidationError
+from ocpp.messages import Call, CallResult, MessageType, validate_payload
+
+from codec import Codec
+
+NOW = "2024-01-01T00:00:00Z"
+
+VALID = {
+    (MessageType.Call, "BootNotification"): {"chargePointModel": "M", "chargePointVendor": "V"},
+    (MessageType.Call, "Authorize"): {"idTag": "TAG"},
+    (MessageType.Call, "StartTransaction"): {"connectorId": 1, "idTag": "TAG", "meterStart": 0, "timestamp": NOW},
+    (MessageType.Call, "StopTransaction"): {"transactionId": 1, "meterStop": 10, "timestamp": NOW},
+    (MessageType.Call, "StatusNotification"): {"connectorId": 1, "errorCode": "NoError", "status": "Available"},
+    (MessageType.Call, "MeterValues"): {"connectorId": 1, "meterValue": [{"timestamp": NOW, "sampledValue": [
+        {"value": "100", "measurand": "Energy.Active.Import.Register", "unit": "Wh"},
+    ]}]},
+    (MessageType.CallResult, "SetChargingProfile"): {"status": "Accepted"},
+    (MessageType.CallResult, "ClearChargingProfile"): {"status": "Unknown"},
+}
+KEYS = sorted(VALID, key=str)
+
+
+def mutations(payload):
+    """Geçerli payload'dan türetilen geçerli ve geçersiz varyantlar."""
+    yield payload
+    for key in payload:
+        dropped = dict(payload)
+        del dropped[key]
+        yield dropped
+        for value in (None, True, 1, 1.5, "x", "x" * 600, [], {}, "NotAnEnumValue"):
+            yield dict(payload, **{key: value})
+    yield dict(payload, unknownKey=1)
+    if "meterValue" in payload:
+        broken = copy.deepcopy(payload)
+        broken["meterValue"][0]["sampledValue"] = []
+        yield broken
+        broken = copy.deepcopy(payload)
+        broken["meterValue"][0]["sampledValue"][0]["unit"] = "Parsec"
+        yield broken
+
+
+def message(message_type_id, action, payload):
+    if message_type_id == MessageType.Call:
+        return Call("1", action, payload)
+    return CallResult("1", payload, action)
+
+
+def jsonschema_accepts(msg):
+    try:
+        validate_payload(msg, "1.6")
+        return True
+    except (OCPPError, ValidationError):
+        return False
+
+
+@pytest.mark.parametrize("key", KEYS, ids=[action for _, action in KEYS])
+def test_compiled_validator_matches_validate_payload(key):
+    codec = Codec(backend="json")
+    message_type_id, action = key
+    check = codec._check(message_type_id, action)
+    assert check is not None, f"{action} şeması derlenmedi"
+    for payload in mutations(VALID[key]):
+        msg = message(message_type_id, action, payload)
+        assert check(payload) == jsonschema_accepts(msg), payload
+
+
+@pytest.mark.parametrize("key", KEYS, ids=[action for _, action in KEYS])
+def test_validate_raises_same_error_as_ocpp(key):
+    codec = Codec(backend="json")
+    message_type_id, action = key
+    for payload in mutations(VALID[key]):
+        msg = message(message_type_id, action, payload)
+        try:
+            validate_payload(msg, "1.6")
+            expected = None
+        except (OCPPError, ValidationError) as e:
+            expected = type(e)
+        if expected is None:
+            codec.validate(msg)
+        else:
+            with pytest.raises(expected):
+                codec.validate(msg)
+
+
+def test_warm_compiles_most_schemas():
+    result = Codec(backend="json").warm()
+    assert result["compiled"] > result["jsonschema"]
@@ -0,0 +1,90 @@
+import asyncio
+
+import liveness
+from liveness import Liveness
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeWriter:
+    spool = None
+
+    def __init__(self):
+        self.rows = []
+
+    async def write(self, table, rows):
+        self.rows.extend(rows)
+        return True
+
+
+def make(monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(liveness.time, "monotonic", clock)
+    tracker = Liveness(pool=object(), base_interval=10, grace=2.5, **kwargs)
+    tracker.writer = FakeWriter()
+    return tracker, clock
+
+
+def test_missed_heartbeats_mark_station_offline(monkeypatch):
+    tracker, clock = make(monkeypatch)
+    tracker.touch("CP_1", 10)
+    assert tracker.is_online("CP_1")
+    # Son tarih 10 sn * 2.5
+    tracker.advance(clock.now + 24)
+    assert tracker.is_online("CP_1")
+    tracker.advance(clock.now + 26)
+    assert not tracker.is_online("CP_1")
+    assert tracker.stats()["online"] == 0
+
+
+def test_heartbeats_keep_station_online_across_wheel_turns(monkeypatch):
+    tracker, clock = make(monkeypatch, wheel_size=8)
+    tracker.touch("CP_1", 10)
+    for _ in range(20):
+        clock.now += 10
+        tracker.touch("CP_1")
+        tracker.advance()
+    assert tracker.is_online("CP_1")
+    # Wheel'de her istasyon en fazla bir kez
+    assert sum(bucket.count(0) for bucket in tracker.wheel) == 1
+    clock.now += 26
+    tracker.advance()
+    assert not tracker.is_online("CP_1")
+
+
+def test_disconnected_slot_is_reused_after_flush(monkeypatch):
+    tracker, clock = make(monkeypatch)
+    tracker.touch("TEMP_1", 10)
+    slot = tracker.slots["TEMP_1"]
+    tracker.disconnected("TEMP_1")
+    assert not tracker.is_online("TEMP_1")
+
+    asyncio.run(tracker.flush())
+    # Çevrimdışı durumu yazıldıktan sonra slot boşalır
+    assert tracker.writer.rows[-1][0] == "TEMP_1"
+    assert tracker.writer.rows[-1][2] is False
+    assert "TEMP_1" not in tracker.slots
+
+    tracker.touch("CP_2", 10)
+    assert tracker.slots["CP_2"] == slot
+    assert len(tracker.ids) == 1
+    assert tracker.is_online("CP_2")
+
+
+def test_reconnect_before_flush_keeps_slot(monkeypatch):
+    tracker, clock = make(monkeypatch)
+    tracker.touch("CP_1", 10)
+    tracker.disconnected("CP_1")
+    tracker.touch("CP_1", 10)
+    asyncio.run(tracker.flush())
+    assert tracker.is_online("CP_1")
+    assert tracker.free == []
+    # Son tarih yeniden bağlanmadaki touch'a göre
+    tracker.advance(clock.now + 24)
+    assert tracker.is_online("CP_1")
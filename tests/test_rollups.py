@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime
+
+from rollups import EnergyRollup
+
+
+def at(hour, minute=0):
+    return datetime(2024, 1, 1, hour, minute)
+
+
+def hourly(rollup):
+    return {hour.hour: energy for (_, _, hour), (energy, _) in rollup.pending.items()}
+
+
+def test_deltas_land_in_reading_hour():
+    rollup = EnergyRollup()
+    rollup.seed("CP", 1, 1000, at(9, 50))
+    rollup.reading("CP", 1, 1200, at(9, 55))
+    rollup.reading("CP", 1, 1500, at(10, 5))
+    assert hourly(rollup) == {9: 200, 10: 300}
+
+
+def test_out_of_order_reading_is_ignored():
+    rollup = EnergyRollup()
+    rollup.seed("CP", 1, 1000, at(10))
+    rollup.reading("CP", 1, 1500, at(10, 30))
+    # Geç gelen eski okuma farkı tekrar saydırmaz
+    rollup.reading("CP", 1, 1200, at(10, 15))
+    rollup.reading("CP", 1, 1600, at(10, 45))
+    assert hourly(rollup) == {10: 600}
+    assert rollup.out_of_order == 1
+
+
+def test_meter_reset_is_not_counted():
+    rollup = EnergyRollup()
+    rollup.seed("CP", 1, 90000, at(10))
+    rollup.reading("CP", 1, 90500, at(10, 10))
+    # Sayaç değişti: küçük değer yeni başlangıç
+    rollup.reading("CP", 1, 100, at(10, 20))
+    rollup.reading("CP", 1, 400, at(10, 30))
+    assert hourly(rollup) == {10: 800}
+    assert rollup.resets == 1
+
+
+def test_readings_before_backfill_cutoff_are_left_to_backfill():
+    rollup = EnergyRollup()
+    rollup.cutoff = at(12)
+    rollup.reading("CP", 1, 1000, at(11, 50))
+    rollup.reading("CP", 1, 1300, at(12, 10))
+    assert hourly(rollup) == {12: 300}
+    assert rollup.before_cutoff == 1
+    assert not rollup.first
+
+
+def test_forget_resolves_next_reading_from_database():
+    class Conn:
+        async def fetch(self, query, cp_ids, connector_ids, timestamps):
+            # Başka worker'ın yazdığı son register
+            return [(1, 1800)]
+
+    class Pool:
+        def acquire(self):
+            return self
+
+        async def __aenter__(self):
+            return Conn()
+
+        async def __aexit__(self, *exc):
+            pass
+
+    async def run():
+        rollup = EnergyRollup(pool=Pool())
+        rollup.seed("CP", 1, 1000, at(10))
+        rollup.reading("CP", 1, 1500, at(10, 10))
+        rollup.forget("CP")
+        # İstasyon başka worker'a gidip döndü; 1500 -> 1800 orada sayıldı
+        rollup.reading("CP", 1, 2000, at(10, 40))
+        await rollup._resolve_first()
+        assert hourly(rollup) == {10: 500 + 200}
+
+    asyncio.run(run())
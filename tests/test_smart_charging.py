@@ -0,0 +1,112 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from registry import FanOutResult
+from smart_charging import PRIORITY, Site, SmartCharging, waterfill
+
+
+def test_waterfill_fills_small_demands_and_splits_the_rest():
+    alloc = waterfill(30.0, np.array([5.0, 20.0, 20.0]), np.ones(3))
+    assert alloc.tolist() == pytest.approx([5.0, 12.5, 12.5])
+
+
+def test_waterfill_respects_weights_and_capacity():
+    alloc = waterfill(30.0, np.array([100.0, 100.0]), np.array([1.0, 2.0]))
+    assert alloc.tolist() == pytest.approx([10.0, 20.0])
+    assert waterfill(1000.0, np.array([5.0, 6.0]), np.ones(2)).tolist() == [5.0, 6.0]
+    assert waterfill(0.0, np.array([5.0]), np.ones(1)).tolist() == [0.0]
+
+
+def test_waterfill_never_exceeds_demand_or_capacity():
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        n = int(rng.integers(1, 20))
+        demand = rng.uniform(0, 22000, n)
+        weight = rng.uniform(0.5, 4, n)
+        capacity = float(rng.uniform(0, 100000))
+        alloc = waterfill(capacity, demand, weight)
+        assert np.all(alloc <= demand + 1e-6)
+        assert alloc.sum() == pytest.approx(min(capacity, demand.sum()))
+
+
+def start(site, *cp_ids):
+    for order, cp_id in enumerate(cp_ids):
+        slot = site.slot(cp_id, 1)
+        site.active[slot] = True
+        site.started[slot] = order
+
+
+def test_site_limit_is_never_exceeded():
+    site = Site("s", 50000, connector_max_w=22000)
+    start(site, "A", "B", "C", "D")
+    alloc = site.allocate()
+    assert alloc.sum() == pytest.approx(50000)
+    assert alloc.max() <= 22000
+
+
+def test_priority_mode_serves_higher_priority_first():
+    site = Site("s", 30000, mode=PRIORITY, connector_max_w=22000,
+                stations={"HIGH": {"priority": 2}, "LOW1": {}, "LOW2": {}})
+    start(site, "LOW1", "HIGH", "LOW2")
+    alloc = dict(zip((key[0] for key in site.keys), site.allocate()))
+    assert alloc["HIGH"] == pytest.approx(22000)
+    assert alloc["LOW1"] == pytest.approx(4000)
+    assert alloc["LOW2"] == pytest.approx(4000)
+
+
+def test_minimum_power_goes_to_earliest_sessions_when_short():
+    site = Site("s", 10000, connector_max_w=22000, connector_min_w=4140)
+    start(site, "A", "B", "C")
+    alloc = dict(zip((key[0] for key in site.keys), site.allocate()))
+    # İkisine minimum yeter; sonra başlayan bekler
+    assert alloc["C"] == 0
+    assert alloc["A"] >= 4140 and alloc["B"] >= 4140
+    assert sum(alloc.values()) == pytest.approx(10000)
+
+
+def test_invalid_site_definitions_are_rejected():
+    with pytest.raises(ValueError):
+        Site("s", float("nan"))
+    with pytest.raises(ValueError):
+        Site("s", 1000, stations={"A": {"priority": 0}})
+
+
+def test_slow_station_does_not_block_recompute():
+    class Registry:
+        def __init__(self):
+            self.pushed = []
+
+        async def fan_out(self, cp_ids, payload, concurrency, timeout, on_response):
+            self.pushed.append(list(cp_ids))
+            for cp_id in cp_ids:
+                if cp_id != "SLOW":
+                    on_response(cp_id, type("Response", (), {"status": "Accepted"})())
+            if "SLOW" in cp_ids:
+                await asyncio.sleep(3600)
+            return FanOutResult()
+
+        async def call(self, cp_id, payload, timeout):
+            self.pushed.append(("clear", cp_id))
+
+    async def run():
+        registry = Registry()
+        engine = SmartCharging(registry, delay=0.01)
+        engine.add_site(Site("s", 30000, stations={"SLOW": {}, "A": {}}))
+        engine.started("SLOW", 1)
+        await asyncio.sleep(0.05)
+        engine.started("A", 1)
+        await asyncio.sleep(0.05)
+        site = engine.sites["s"]
+        # SLOW cevap vermese de A'nın payı hesaplanıp gönderildi
+        assert site.sent[site.slots["A", 1]] == pytest.approx(15000)
+        assert engine.stats()["superseded"] == 1
+        engine.stopped("A", 1)
+        await asyncio.sleep(0.05)
+        assert ("clear", "A") in registry.pushed
+        for task in list(engine._tasks):
+            task.cancel()
+        await asyncio.gather(*engine._tasks, return_exceptions=True)
+
+    asyncio.run(run())
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import pickle
+
+from spool import HEADER, PAGE, Spool
+
+
+def segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".spool"))
+
+
+def drain(spool):
+    records = []
+    while True:
+        record = spool.peek()
+        if record is None:
+            return records
+        records.append((record.table, record.rows))
+        spool.consume(record)
+
+
+def test_records_survive_reopen_in_order(tmp_path):
+    spool = Spool(str(tmp_path)).open()
+    for i in range(5):
+        assert spool.append("authorizations", [("cp", i)])
+    spool.consume(spool.peek())
+    spool.close()
+
+    spool = Spool(str(tmp_path)).open()
+    assert spool.pending == 4
+    assert drain(spool) == [("authorizations", [("cp", i)]) for i in range(1, 5)]
+    spool.close()
+
+
+def test_torn_tail_is_truncated_and_appends_continue(tmp_path):
+    spool = Spool(str(tmp_path)).open()
+    for i in range(3):
+        spool.append("meter_samples", [("cp", i)])
+    segment = spool.segments[-1]
+    # Çökme anı: son kaydın başlığı yazılmış, gövdesi yarım kalmış
+    last = segment.end - len(pickle.dumps(("meter_samples", [("cp", 2)]), protocol=pickle.HIGHEST_PROTOCOL))
+    segment.map[last:segment.end] = b"\xff" * (segment.end - last)
+    spool.close()
+
+    spool = Spool(str(tmp_path)).open()
+    assert spool.truncated == 1
+    assert spool.pending == 2
+    # Kesilen yerden sonrası temiz; yeni kayıt okunabilir olmalı
+    spool.append("meter_samples", [("cp", 3)])
+    spool.close()
+
+    spool = Spool(str(tmp_path)).open()
+    assert spool.truncated == 0
+    assert drain(spool) == [("meter_samples", [("cp", i)]) for i in (0, 1, 3)]
+    spool.close()
+
+
+def test_partial_header_is_truncated(tmp_path):
+    spool = Spool(str(tmp_path)).open()
+    spool.append("authorizations", [("cp", 0)])
+    segment = spool.segments[-1]
+    # Yalnızca uzunluk yazılmış bir sonraki başlık (crc ve gövde yok)
+    HEADER.pack_into(segment.map, segment.end, 1000, 0, 0)
+    spool.close()
+
+    spool = Spool(str(tmp_path)).open()
+    assert spool.truncated == 1
+    assert drain(spool) == [("authorizations", [("cp", 0)])]
+    spool.close()
+
+
+def test_segment_rollover_and_removal(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=PAGE).open()
+    rows = [("cp", "x" * 1000)]
+    for i in range(10):
+        spool.append("boot_notifications", rows + [i])
+    assert len(spool.segments) > 1
+    assert len(segment_files(tmp_path)) == len(spool.segments)
+    first = spool.segments[0].path
+
+    spool.close()
+    spool = Spool(str(tmp_path), segment_bytes=PAGE).open()
+    assert spool.pending == 10
+    records = drain(spool)
+    assert [record[1][-1] for record in records] == list(range(10))
+    # Boşalan eski segmentler silinir, yazılan son segment kalır
+    assert not os.path.exists(first)
+    assert len(spool.segments) == 1
+    spool.close()
+
+
+def test_record_larger_than_segment(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=PAGE).open()
+    rows = [("cp", "y" * (3 * PAGE))]
+    assert spool.append("meter_samples", rows)
+    spool.close()
+    spool = Spool(str(tmp_path), segment_bytes=PAGE).open()
+    assert drain(spool) == [("meter_samples", rows)]
+    spool.close()
+
+
+def test_full_spool_drops(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=PAGE, max_bytes=2 * PAGE).open()
+    rows = [("cp", "z" * 1000)]
+    results = [spool.append("authorizations", rows) for _ in range(20)]
+    assert not all(results)
+    assert spool.dropped == results.count(False)
+    assert spool.disk_bytes() <= 2 * PAGE
+    spool.close()
+
+
+def test_group_commit_syncs_off_the_loop(tmp_path):
+    async def run():
+        spool = Spool(str(tmp_path), sync_interval=0.01).open()
+        spool.start()
+        spool.append("authorizations", [("cp", 0)])
+        assert spool.unsynced
+        await asyncio.sleep(0.1)
+        assert not spool.unsynced
+        assert spool.syncs >= 1
+        spool.consume(spool.peek())
+        await spool.stop()
+        assert not spool.unsynced
+        spool.close()
+
+    asyncio.run(run())
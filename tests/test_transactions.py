@@ -0,0 +1,104 @@
+import asyncio
+
+from transactions import ACTIVE, STOPPED, TransactionStore
+
+NOW = "2024-01-01T10:00:00Z"
+LATER = "2024-01-01T11:00:00Z"
+
+
+def energy_row(value):
+    # meter_samples.parse_meter_value satırı: (zaman, değer, ..., measurand, phase)
+    return (None, value, None, None, None, "Energy.Active.Import.Register", None)
+
+
+def test_duplicate_start_returns_same_transaction():
+    async def run():
+        store = TransactionStore()
+        first, duplicate = await store.start("CP", 1, "TAG", 0, NOW)
+        assert not duplicate
+        again, duplicate = await store.start("CP", 1, "TAG", 0, NOW)
+        assert duplicate
+        assert again is first
+        assert store.duplicates == 1
+        assert len(store.active_sessions()) == 1
+
+    asyncio.run(run())
+
+
+def test_duplicate_stop_is_acknowledged_once():
+    async def run():
+        store = TransactionStore()
+        session, _ = await store.start("CP", 1, "TAG", 100, NOW)
+        store.meter("CP", 1, session.tx_id, [energy_row(400)])
+        assert store.energy(session.tx_id) == 300
+
+        stopped, duplicate = store.stop(session.tx_id, 500, LATER)
+        assert not duplicate
+        assert stopped.state == STOPPED
+        assert stopped.energy() == 400
+        store.dirty.clear()
+
+        again, duplicate = store.stop(session.tx_id, 500, LATER)
+        assert duplicate
+        assert again is stopped
+        # Tekrar yazılacak bir şey yok
+        assert not store.dirty
+        # Biten transaction'ın Start'ı tekrar gelirse de aynı id
+        restarted, duplicate = await store.start("CP", 1, "TAG", 100, NOW)
+        assert duplicate and restarted.tx_id == session.tx_id
+
+    asyncio.run(run())
+
+
+def test_unknown_stop_is_left_to_the_caller():
+    store = TransactionStore()
+    assert store.stop(12345, 10, NOW) == (None, False)
+
+
+def test_new_start_closes_open_session_on_connector():
+    async def run():
+        store = TransactionStore()
+        old, _ = await store.start("CP", 1, "TAG", 0, NOW)
+        store.meter("CP", 1, None, [energy_row(250)])
+        new, duplicate = await store.start("CP", 1, "OTHER", 250, LATER)
+        assert not duplicate
+        assert old.state == STOPPED
+        assert old.meter_stop == 250
+        assert new.state == ACTIVE
+        assert store.active["CP", 1] is new
+
+    asyncio.run(run())
+
+
+def test_local_ids_survive_restart(tmp_path):
+    async def run():
+        store = TransactionStore(local_id_lease=10)
+        store.use_local_ids(1, str(tmp_path), instance=2, slots=4)
+        first, _ = await store.start("CP", 1, "TAG", 0, NOW)
+        # Aralık (2 * 4 + 1)
+        assert first.tx_id == store.local_id_base + 9 * store.local_id_span
+
+        restarted = TransactionStore(local_id_lease=10)
+        restarted.use_local_ids(1, str(tmp_path), instance=2, slots=4)
+        second, _ = await restarted.start("CP", 2, "TAG", 0, NOW)
+        # Kullanılmamış kiranın kalanı atlanır
+        assert second.tx_id == first.tx_id + 10
+
+    asyncio.run(run())
+
+
+def test_local_ids_skip_past_stored_ids_when_lease_is_lost(tmp_path):
+    class Conn:
+        async def fetchval(self, query, *args):
+            if "max(id)" in query:
+                return args[0] + 41
+            return []
+
+    async def run():
+        store = TransactionStore()
+        store.use_local_ids(0, str(tmp_path))
+        await store._check_local_ids(Conn())
+        session, _ = await store.start("CP", 1, "TAG", 0, NOW)
+        assert session.tx_id == store.local_id_base + 42
+
+    asyncio.run(run())
@@ -0,0 +1,118 @@
+import asyncio
+
+from spool import Spool
+from write_behind import WriteBehind
+
+
+class FakePool:
+    """COPY'leri tutan sahte havuz; `bad` satırı veri hatası, `down` iken bağlantı hatası verir."""
+
+    def __init__(self):
+        self.rows = []
+        self.down = False
+        self.fail_after = None  # bu kadar COPY'den sonra bağlantı kopar
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def copy_records_to_table(self, table, records, columns=None):
+        if self.fail_after is not None:
+            if self.fail_after == 0:
+                self.down = True
+            self.fail_after -= 1
+        if self.down:
+            raise ConnectionResetError("connection lost")
+        if any(record[1] == "bad" for record in records):
+            raise ValueError("invalid input")
+        self.rows.extend((table, record[1]) for record in records)
+
+
+def rows(values):
+    return [("cp", value, "tag", None) for value in values]
+
+
+def test_bad_row_is_rejected_and_rest_written():
+    async def run():
+        pool = FakePool()
+        writer = WriteBehind(pool)
+        await writer._write("authorizations", rows([0, 1, "bad", 3, 4, 5, 6]))
+        assert [value for _, value in pool.rows] == [0, 1, 3, 4, 5, 6]
+        counters = writer.counters["authorizations"]
+        assert counters["written"] == 6
+        assert counters["rejected"] == 1
+
+    asyncio.run(run())
+
+
+def test_unavailable_database_spools_and_replays_in_order(tmp_path):
+    async def run():
+        pool = FakePool()
+        pool.down = True
+        spool = Spool(str(tmp_path)).open()
+        writer = WriteBehind(pool, spool=spool)
+        await writer._write("authorizations", rows([0, 1]))
+        # Spool'da bekleyen varken yeni batch de sıraya girer
+        await writer._write("authorizations", rows([2]))
+        assert spool.pending == 2
+        assert pool.rows == []
+
+        pool.down = False
+        while spool.pending:
+            assert await writer._replay_record(spool.peek())
+            spool.consume(spool.peek())
+        assert [value for _, value in pool.rows] == [0, 1, 2]
+        spool.close()
+
+    asyncio.run(run())
+
+
+def test_split_interrupted_during_replay_stays_at_head(tmp_path):
+    async def run():
+        pool = FakePool()
+        spool = Spool(str(tmp_path)).open()
+        spool.append("authorizations", rows([0, 1, "bad", 3, 4, 5, 6, 7]))
+        spool.append("authorizations", rows(["later"]))
+        writer = WriteBehind(pool, spool=spool)
+
+        # Bölünürken bağlantı kopar: kayıt tüketilmez, kalan parçalar sonraki kayıttan önce
+        pool.fail_after = 3
+        record = spool.peek()
+        assert not await writer._replay_record(record)
+        assert spool.pending == 2
+        assert spool.peek().rows == record.rows
+
+        pool.fail_after = None
+        pool.down = False
+        while spool.pending:
+            assert await writer._replay_record(spool.peek())
+            spool.consume(spool.peek())
+        assert [value for _, value in pool.rows] == [0, 1, 3, 4, 5, 6, 7, "later"]
+        assert writer.counters["authorizations"]["rejected"] == 1
+        spool.close()
+
+    asyncio.run(run())
+
+
+def test_registered_upsert_table_is_queued():
+    async def run():
+        pool = FakePool()
+        written = []
+
+        async def upsert(conn, batch):
+            written.extend(batch)
+
+        writer = WriteBehind(pool)
+        writer.register("transaction_stops", upsert)
+        await writer.put("transaction_stops", (1, "cp", 100, None))
+        assert written == []
+        await writer.flush()
+        assert written == [(1, "cp", 100, None)]
+        assert writer.counters["transaction_stops"]["written"] == 1
+
+    asyncio.run(run())
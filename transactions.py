@@ -0,0 +1,382 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+
+import db
+from utils import parse_timestamp
+
+logger = logging.getLogger("OCPP_Server")
+
+TABLE = "transactions"
+
+ACTIVE = "Active"
+STOPPED = "Stopped"
+
+ENERGY_REGISTER = "Energy.Active.Import.Register"
+POWER = "Power.Active.Import"
+
+
+STOPS = "transaction_stops"  # Bu süreçte oturumu olmayan Stop'lar; tablo değil, transactions'a UPDATE
+
+
+class IdConflict(ValueError):
+    """Aynı id'li satır veritabanında başka bir transaction'a ait (istasyon/başlangıç farklı)."""
+
+
+async def upsert(conn, rows):
+    """Session satırları (tx_id, cp_id, id_tag, connector_id, meter_start, start_time, meter_stop,
+    stop_time, total) tek sorguyla; spool'dan yüklenirken de bu kullanılır.
+
+    Çakışan id'li satırlar yazılmaz ve IdConflict verilir. Upsert tekrarlanabilir olduğu için
+    write-behind batch'i bölüp tekrar dener; tek başına kalan satır loglanıp reddedilir.
+    """
+    written = await db.fetch(conn, "upsert_transactions", *(list(column) for column in zip(*rows)))
+    if len(written) != len(rows):
+        ids = {record[0] for record in written}
+        raise IdConflict(f"Transaction id çakışması: {sorted(row[0] for row in rows if row[0] not in ids)}")
+
+
+async def update_stops(conn, rows):
+    """Oturumu bu süreçte olmayan Stop'lar (tx_id, cp_id, meter_stop, stop_time); enerji SQL'de hesaplanır.
+
+    Eşleşmeyen satır (bilinmeyen id, başka istasyon ya da zaten durdurulmuş) tekrar denenince
+    düzelmez; sadece loglanır.
+    """
+    written = await db.fetch(conn, "stop_transactions", *(list(column) for column in zip(*rows)))
+    if len(written) != len(rows):
+        ids = {record[0] for record in written}
+        logger.warning(f"⚠️ Stop eşleşen transaction bulamadı - TX ID: {sorted(row[0] for row in rows if row[0] not in ids)}")
+
+
+class Session:
+    """Tek bir transaction'ın bellekteki durumu. Enerji Wh, güç W."""
+
+    __slots__ = ("tx_id", "cp_id", "connector_id", "id_tag", "meter_start", "start_time", "start_key",
+                 "meter_last", "power", "meter_stop", "stop_time", "state")
+
+    def __init__(self, tx_id, cp_id, connector_id, id_tag, meter_start, start_time, start_key):
+        self.tx_id = tx_id
+        self.cp_id = cp_id
+        self.connector_id = connector_id
+        self.id_tag = id_tag
+        self.meter_start = meter_start
+        self.start_time = start_time
+        self.start_key = start_key
+        self.meter_last = meter_start
+        self.power = None
+        self.meter_stop = None
+        self.stop_time = None
+        self.state = ACTIVE
+
+    def energy(self):
+        meter = self.meter_stop if self.state == STOPPED else self.meter_last
+        return meter - self.meter_start
+
+    def to_dict(self):
+        return {
+            "transaction_id": self.tx_id,
+            "cp_id": self.cp_id,
+            "connector_id": self.connector_id,
+            "id_tag": self.id_tag,
+            "state": self.state,
+            "meter_start": self.meter_start,
+            "meter_last": self.meter_last,
+            "energy_wh": self.energy(),
+            "power_w": self.power,
+            "start_time": self.start_time.isoformat() + "Z",
+            "stop_time": self.stop_time.isoformat() + "Z" if self.stop_time else None,
+        }
+
+
+class TransactionStore:
+    """İstasyon/connector bazlı transaction durumları, bellekte.
+
+    Durum makinesi: StartTransaction -> Active, MeterValues enerjiyi günceller,
+    StopTransaction -> Stopped. Aynı içerikle tekrar gelen Start (istasyonun yeniden
+    denemesi, mesaj id'si aynı ya da farklı) aynı transaction id'sini alır; biten bir
+    transaction için gelen Stop tekrar yazılmaz. Transaction id'leri sequence'ten
+    `block_size`'lık bloklar halinde önceden alınır. Değişen transaction'lar
+    `flush_interval` saniyede bir tek sorguyla (upsert) yazılır.
+
+    Veritabanı yokken ya da blok henüz gelmemişken Start beklemez; id yerel aralıktan
+    verilir. Her sunucu (instance) ve worker slot'unun `local_id_base + (instance * slots
+    + slot) * local_id_span` ile başlayan kendi aralığı vardır. Aralıkta kullanılan yer
+    `state_dir`'deki dosyada `local_id_lease`'lik kiralarla ilerletilir; yeniden başlatma
+    aynı id'leri tekrar vermez (kullanılmamış kiranın kalanı atlanır). Dosya kaybolsa da
+    veritabanına ilk bağlanışta aralığın yazılmış en büyük id'sinin ötesine geçilir.
+    """
+
+    def __init__(self, pool=None, block_size=100, flush_interval=0.5, max_recent=10000, local_id_base=1_000_000_000,
+                 local_id_span=10_000_000, local_id_lease=1000, refill_retry=5.0):
+        self.pool = pool
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.max_recent = max_recent
+        self.active = {}  # (cp_id, connector_id) -> Session
+        self.sessions = {}  # tx_id -> aktif Session
+        self.recent = OrderedDict()  # tx_id -> biten Session (tekrarlanan Stop için, LRU)
+        self.by_start = {}  # (cp_id, connector_id, id_tag, meter_start, timestamp) -> Session
+        self.dirty = set()
+        self.writer = None  # WriteBehind verilmişse satırlar onun üzerinden (spool dahil)
+        self.duplicates = 0
+        self.blocks = 0
+        self._ids = deque()
+        self._refill = None
+        self.refill_retry = refill_retry
+        self._refill_after = 0.0
+        # Yerel id'ler sequence'in ulaşmayacağı aralıkta; bağlantı gelince bu transaction'lar da yazılır
+        self.local_id_base = local_id_base
+        self.local_id_span = local_id_span
+        self.local_id_lease = local_id_lease
+        self.slot = 0
+        self.local_range = 0  # instance * slots + slot
+        self.state_dir = None
+        self.local_ids = 0
+        self.id_conflicts = 0
+        self._local_checked = False  # aralığın veritabanındaki en büyük id'si kontrol edildi mi
+        self._local_next = None  # slot aralığındaki sıradaki sıra no; ilk yerel id'de okunur
+        self._local_end = 0  # kiralanmış bölümün sonu
+        self._task = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            block_size=int(os.getenv("TX_ID_BLOCK", 100)),
+            flush_interval=float(os.getenv("TX_FLUSH_INTERVAL", 0.5)),
+            max_recent=int(os.getenv("TX_RECENT", 10000)),
+            local_id_base=int(os.getenv("TX_LOCAL_ID_BASE", 1_000_000_000)),
+            local_id_span=int(os.getenv("TX_LOCAL_ID_SPAN", 10_000_000)),
+        )
+
+    def use_local_ids(self, slot, state_dir=None, instance=0, slots=1):
+        """Yerel id aralığı: sunucu (instance), bu sunucudaki slot sayısı, worker slot'u ve
+        kira dosyasının dizini (spool dizini)."""
+        local_range = instance * slots + slot
+        if (self.local_id_base + (local_range + 1) * self.local_id_span - 1) > 2**31 - 1:
+            raise ValueError(f"Yerel transaction id aralığı int32'ye sığmıyor - Instance: {instance}, Slot: {slot}")
+        self.slot = slot
+        self.local_range = local_range
+        self.state_dir = state_dir
+        self._local_next = None
+        self._local_checked = False
+
+    # ----- Id blokları -----
+
+    async def allocate(self):
+        if self.pool is not None:
+            # Blok bitmeden bir sonrakini arka planda iste; Start hiç beklemesin
+            if (len(self._ids) <= self.block_size // 4 and self._refill is None
+                    and time.monotonic() >= self._refill_after):
+                self._refill = asyncio.create_task(self._fetch_block())
+            if self._ids:
+                return self._ids.popleft()
+        return self._local_id()
+
+    async def _fetch_block(self):
+        try:
+            async with self.pool.acquire() as conn:
+                ids = await db.fetchval(conn, "allocate_transaction_ids", self.block_size)
+                if not self._local_checked:
+                    await self._check_local_ids(conn)
+            self._ids.extend(sorted(ids))
+            self.blocks += 1
+            return True
+        except Exception as e:
+            # Veritabanı yokken her Start'ta tekrar denenmesin
+            self._refill_after = time.monotonic() + self.refill_retry
+            logger.error(f"⚠️ Transaction id bloğu alınamadı: {str(e)}")
+            return False
+        finally:
+            self._refill = None
+
+    async def _check_local_ids(self, conn):
+        # Kira dosyası silinmiş/taşınmış olabilir; veritabanına yazılmış id'ler tekrar verilmesin
+        first = self.local_id_base + self.local_range * self.local_id_span
+        stored = await db.fetchval(conn, "max_transaction_id_between", first, first + self.local_id_span)
+        self._local_checked = True
+        self._load_lease()
+        if stored is not None and stored - first + 1 > self._local_next:
+            logger.warning(f"⚠️ Yerel transaction id kirası veritabanındaki id'lerin gerisinde, ilerletildi - "
+                           f"Aralık: {self.local_range}, Sıradaki: {stored + 1}")
+            self._local_next = self._local_end = stored - first + 1
+
+    def _lease_path(self):
+        return os.path.join(self.state_dir, "transaction-local-ids") if self.state_dir else None
+
+    def _load_lease(self):
+        if self._local_next is not None:
+            return
+        self._local_next = 0
+        path = self._lease_path()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self._local_next = int(f.read().strip() or 0)
+        self._local_end = self._local_next
+
+    def _local_id(self):
+        self._load_lease()
+        if self._local_next >= self._local_end:
+            if self._local_end + self.local_id_lease > self.local_id_span:
+                raise RuntimeError(f"Yerel transaction id aralığı doldu - Aralık: {self.local_range}")
+            self._local_end += self.local_id_lease
+            path = self._lease_path()
+            if path:
+                # Kira id verilmeden önce diskte; çökme olursa sonraki açılış kiranın sonundan başlar
+                os.makedirs(self.state_dir, exist_ok=True)
+                with open(path + ".tmp", "w") as f:
+                    f.write(str(self._local_end))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(path + ".tmp", path)
+        tx_id = self.local_id_base + self.local_range * self.local_id_span + self._local_next
+        self._local_next += 1
+        self.local_ids += 1
+        return tx_id
+
+    # ----- Durum geçişleri -----
+
+    async def start(self, cp_id, connector_id, id_tag, meter_start, timestamp):
+        """(Session, tekrar mı) döner."""
+        key = (cp_id, connector_id, id_tag, meter_start, timestamp)
+        session = self.by_start.get(key)
+        if session is not None:
+            self.duplicates += 1
+            return session, True
+        tx_id = await self.allocate()
+        previous = self.active.get((cp_id, connector_id))
+        if previous is not None:
+            # Stop'u kaybolmuş transaction; son okunan sayaçla kapatılır
+            logger.warning(f"⚠️ Açık transaction kapatıldı - ID: {cp_id}, Connector: {connector_id}, "
+                           f"TX ID: {previous.tx_id}")
+            self._finish(previous, int(previous.meter_last), parse_timestamp(timestamp))
+        session = Session(tx_id, cp_id, connector_id, id_tag, meter_start, parse_timestamp(timestamp), key)
+        self.active[(cp_id, connector_id)] = session
+        self.sessions[tx_id] = session
+        self.by_start[key] = session
+        self.dirty.add(session)
+        return session, False
+
+    def stop(self, tx_id, meter_stop, timestamp):
+        """(Session, tekrar mı) döner; bu süreçte bilinmeyen transaction için (None, False)."""
+        session = self.sessions.get(tx_id)
+        if session is None:
+            session = self.recent.get(tx_id)
+            if session is not None:
+                self.duplicates += 1
+                return session, True
+            return None, False
+        self._finish(session, meter_stop, parse_timestamp(timestamp))
+        return session, False
+
+    def _finish(self, session, meter_stop, stop_time):
+        session.state = STOPPED
+        session.meter_stop = meter_stop
+        session.meter_last = meter_stop
+        session.stop_time = stop_time
+        session.power = None
+        del self.sessions[session.tx_id]
+        if self.active.get((session.cp_id, session.connector_id)) is session:
+            del self.active[(session.cp_id, session.connector_id)]
+        self.recent[session.tx_id] = session
+        while len(self.recent) > self.max_recent:
+            _, old = self.recent.popitem(last=False)
+            self.by_start.pop(old.start_key, None)
+        self.dirty.add(session)
+
+    def meter(self, cp_id, connector_id, tx_id, rows):
+        """meter_samples.parse_meter_value satırlarıyla oturumu günceller; DB'ye gitmez."""
+        session = self.sessions.get(tx_id) if tx_id is not None else self.active.get((cp_id, connector_id))
+        if session is None:
+            return None
+        phase_power = None
+        for row in rows:
+            value, measurand, phase = row[1], row[5], row[6]
+            if measurand == ENERGY_REGISTER and phase is None:
+                session.meter_last = value
+            elif measurand == POWER:
+                if phase is None:
+                    session.power = value
+                else:
+                    phase_power = (phase_power or 0.0) + value
+        if phase_power is not None and session.power is None:
+            session.power = phase_power
+        return session
+
+    # ----- Okuma -----
+
+    def get(self, tx_id):
+        return self.sessions.get(tx_id) or self.recent.get(tx_id)
+
+    def energy(self, tx_id):
+        session = self.get(tx_id)
+        return session.energy() if session is not None else None
+
+    def active_sessions(self, cp_id=None):
+        return [session for session in self.sessions.values() if cp_id is None or session.cp_id == cp_id]
+
+    # ----- Yazma -----
+
+    async def flush(self):
+        # Veritabanı (ya da spool) gelene kadar değişenler bellekte bekler
+        spool = self.writer.spool if self.writer is not None else None
+        if not self.dirty or (self.pool is None and spool is None):
+            return
+        sessions, self.dirty = self.dirty, set()
+        rows = [
+            (s.tx_id, s.cp_id, s.id_tag, s.connector_id, s.meter_start, s.start_time, s.meter_stop, s.stop_time,
+             s.meter_stop - s.meter_start if s.state == STOPPED else None)
+            for s in sessions
+        ]
+        if self.writer is not None:
+            written = await self.writer.write(TABLE, rows)
+        else:
+            try:
+                async with self.pool.acquire() as conn:
+                    await upsert(conn, rows)
+                written = True
+            except IdConflict as e:
+                # Tekrar denemek düzeltmez; çakışan satırlar loglanır, diğerleri yazıldı
+                self.id_conflicts += 1
+                logger.error(f"🚫 {str(e)}")
+                written = True
+            except Exception as e:
+                logger.error(f"⚠️ Transaction yazma hatası - Kayıt: {len(sessions)}: {str(e)}")
+                written = False
+        if not written:
+            # Bir sonraki turda tekrar denensin; aradaki değişiklikler zaten aynı nesnede
+            self.dirty.update(sessions)
+
+    def start_flusher(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            if self.pool is not None and self._refill is None:
+                self._refill = asyncio.create_task(self._fetch_block())
+
+    async def stop_flusher(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def stats(self):
+        return {
+            "active": len(self.sessions),
+            "recent": len(self.recent),
+            "duplicates": self.duplicates,
+            "pending_flush": len(self.dirty),
+            "id_blocks": self.blocks,
+            "ids_left": len(self._ids),
+            "local_ids": self.local_ids,
+            "id_conflicts": self.id_conflicts,
+        }
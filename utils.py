@@ -0,0 +1,10 @@
+from datetime import datetime, timezone
+
+
+def parse_timestamp(value):
+    # Kolonlar TIMESTAMP (timezone'suz); toplu yazmada tek bir hatalı kayıt
+    # bütün batch'i düşürmesin diye UTC'ye çevirip tzinfo'yu atıyoruz
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
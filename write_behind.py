@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+import db
+import meter_samples
+
+logger = logging.getLogger("OCPP_Server")
+
+# Tablo -> kolonlar. Handler'lar kayıtları bu sırada tuple olarak gönderir.
+TABLES = {
+    "boot_notifications": ("cp_id", "model", "vendor", "timestamp"),
+    "authorizations": ("cp_id", "id_tag", "status", "timestamp"),
+    "status_notifications": ("cp_id", "connector_id", "status", "error_code", "timestamp", "vendor_id"),
+    "meter_samples": meter_samples.COLUMNS,
+    "firmware_status_notifications": ("cp_id", "status", "timestamp"),
+    "diagnostics_status_notifications": ("cp_id", "status", "timestamp"),
+    "reservations": ("reservation_id", "cp_id", "connector_id", "id_tag", "expiry_date", "status"),
+}
+
+
+class WriteBehind:
+    """Handler'ların INSERT'lerini tablo başına kuyruklarda toplayıp toplu yazar.
+
+    Handler'lar `put()` ile kaydı kuyruğa bırakıp hemen cevap döner. Arka plandaki
+    flusher kuyrukları `batch_size` dolunca ya da `flush_interval` saniyede bir
+    `copy_records_to_table` ile boşaltır. Kuyruk `max_queue` sınırına gelirse
+    `put()` yer açılana kadar bekler (backpressure).
+
+    `spool` verilmişse veritabanı yokken, ulaşılamadığında ya da `write_timeout`
+    saniyeyi aştığında batch diske yazılır; kuyruk boşalmaya devam eder. Spool'da
+    bekleyen kayıt varken yeni batch'ler de sıraya girmek için spool'a gider ve
+    replay görevi hepsini eklenme sırasıyla veritabanına yükler. Kendi satırlarını
+    bellekte biriktiren bileşenler (transactions, liveness, saatlik enerji) `register`
+    ile upsert fonksiyonlarını verip `write` ile aynı yoldan (spool dahil) yazar. Veri hatasında
+    (unique ihlali, aralık dışı değer) batch ikiye bölünerek yazılır; tek başına
+    hata veren satırlar loglanıp atılır (`rejected`), diğerleri kaybolmaz.
+    """
+
+    def __init__(self, pool=None, batch_size=500, flush_interval=0.5, max_queue=10000, tables=TABLES,
+                 spool=None, write_timeout=5.0):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.spool = spool
+        self.write_timeout = write_timeout
+        self.spooled = 0
+        self.replayed = 0
+        self.tables = dict(tables)
+        self.queues = {table: deque() for table in self.tables}
+        self.counters = {table: {"enqueued": 0, "written": 0, "failed": 0, "rejected": 0} for table in self.tables}
+        self.flushes = 0
+        self.backpressure_waits = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._task = None
+        self._replay_task = None
+        self._stopping = False
+        self._flush_lock = asyncio.Lock()
+        self._unfinished = None  # ((segment, offset), parçalar): bölünürken yarım kalan spool kaydı
+        self.upserts = {}  # tablo -> async upsert(conn, satırlar); COPY yerine
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            batch_size=int(os.getenv("WB_BATCH_SIZE", 500)),
+            flush_interval=float(os.getenv("WB_FLUSH_INTERVAL", 0.5)),
+            max_queue=int(os.getenv("WB_MAX_QUEUE", 10000)),
+            write_timeout=float(os.getenv("WB_WRITE_TIMEOUT", 5)),
+        )
+
+    def register(self, table, upsert):
+        """COPY ile yazılamayan (upsert) tablo; satırları `write` ile hemen ya da `put` ile kuyruktan gelir."""
+        self.upserts[table] = upsert
+        self.queues.setdefault(table, deque())
+        self.counters.setdefault(table, {"enqueued": 0, "written": 0, "failed": 0, "rejected": 0})
+
+    async def write(self, table, rows):
+        """Satırları hemen yazar; veritabanı yoksa spool'a. Hiçbiri olmadıysa False (çağıran tutar)."""
+        failed = self.counters[table]["failed"]
+        self.counters[table]["enqueued"] += len(rows)
+        await self._write(table, rows)
+        return self.counters[table]["failed"] == failed
+
+    async def put(self, table, record):
+        # Veritabanı ve spool yoksa eski davranış: kayıt tutulmaz
+        if self.pool is None and self.spool is None:
+            return
+        queue = self.queues[table]
+        while len(queue) >= self.max_queue:
+            self.backpressure_waits += 1
+            self._drained.clear()
+            self._wakeup.set()
+            await self._drained.wait()
+        queue.append(record)
+        self.counters[table]["enqueued"] += 1
+        if len(queue) >= self.batch_size:
+            self._wakeup.set()
+
+    async def put_many(self, table, records):
+        for record in records:
+            await self.put(table, record)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        if self.spool is not None and self._replay_task is None:
+            self._replay_task = asyncio.create_task(self._replay())
+
+    async def stop(self):
+        # Kapanışta kuyrukta kalan her şeyi yaz
+        # Task iptal edilmez: wait_for(Event.wait()) iptali backpressure sonrası takılabiliyor;
+        # flusher bayrağı görüp kendi döngüsünden çıkar
+        if self._replay_task is not None:
+            # Yarıda kalan kayıt tüketilmemiş sayılır; sonraki açılışta tekrar yüklenir
+            self._replay_task.cancel()
+            try:
+                await self._replay_task
+            except asyncio.CancelledError:
+                pass
+            self._replay_task = None
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        await self.flush()
+        self._drained.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"⚠️ Write-behind flush hatası: {str(e)}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            for table, queue in self.queues.items():
+                while queue:
+                    count = min(len(queue), self.batch_size)
+                    batch = [queue.popleft() for _ in range(count)]
+                    await self._write(table, batch)
+                    self._drained.set()
+
+    async def _copy(self, table, batch):
+        async with self.pool.acquire() as conn:
+            upsert = self.upserts.get(table)
+            if upsert is not None:
+                operation = upsert(conn, batch)
+            else:
+                operation = conn.copy_records_to_table(table, records=batch, columns=self.tables[table])
+            await asyncio.wait_for(operation, self.write_timeout)
+
+    def _to_spool(self, table, batch):
+        if self.spool.append(table, batch):
+            self.spooled += len(batch)
+        else:
+            self.counters[table]["failed"] += len(batch)
+
+    def _defer(self, table, batch):
+        # Veritabanına şu an yazılamayan batch: spool varsa sonra yüklenir
+        if self.spool is not None:
+            self._to_spool(table, batch)
+        else:
+            self.counters[table]["failed"] += len(batch)
+
+    async def _split(self, table, batch):
+        """Veri hatası veren batch'i yarılayarak yazar; tek başına hata veren satır atılır.
+
+        Arada veritabanı koparsa yazılamayan parçaları sırasıyla döner (hepsi yazıldıysa boş).
+        """
+        middle = len(batch) // 2
+        parts = [batch[:middle], batch[middle:]]
+        for i, part in enumerate(parts):
+            try:
+                await self._copy(table, part)
+                self.counters[table]["written"] += len(part)
+            except Exception as e:
+                if db.unavailable(e):
+                    return parts[i:]
+                if len(part) == 1:
+                    self.counters[table]["rejected"] += 1
+                    logger.error(f"🚫 Kayıt reddedildi - Tablo: {table}, Kayıt: {part[0]!r}: {str(e) or type(e).__name__}")
+                else:
+                    rest = await self._split(table, part)
+                    if rest:
+                        return rest + parts[i + 1:]
+        return []
+
+    async def _write(self, table, batch):
+        if self.pool is None or (self.spool is not None and self.spool.pending):
+            # Veritabanı yok ya da spool'da sırası önce gelen kayıtlar var
+            if self.spool is not None:
+                self._to_spool(table, batch)
+            else:
+                self.counters[table]["failed"] += len(batch)
+            return
+        started = time.perf_counter()
+        try:
+            await self._copy(table, batch)
+            self.counters[table]["written"] += len(batch)
+        except Exception as e:
+            logger.error(f"⚠️ Toplu yazma hatası - Tablo: {table}, Kayıt: {len(batch)}: {str(e) or type(e).__name__}")
+            if db.unavailable(e):
+                self._defer(table, batch)
+            elif len(batch) == 1:
+                self.counters[table]["rejected"] += 1
+                logger.error(f"🚫 Kayıt reddedildi - Tablo: {table}, Kayıt: {batch[0]!r}")
+            else:
+                for rest in await self._split(table, batch):
+                    self._defer(table, rest)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.flushes += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+
+    async def _replay(self):
+        # Spool'daki kayıtları sırayla yükler; hata olursa artan aralıklarla tekrar dener
+        delay = 1.0
+        while True:
+            if self.pool is None or not self.spool.pending:
+                await asyncio.sleep(self.flush_interval)
+                continue
+            record = self.spool.peek()
+            if record is None:
+                await asyncio.sleep(self.flush_interval)
+                continue
+            if not await self._replay_record(record):
+                logger.error(f"⚠️ Spool replay hatası - Tablo: {record.table}, Kayıt: {len(record.rows)}, "
+                             f"{delay:.0f} sn sonra tekrar")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+                continue
+            delay = 1.0
+            self.spool.consume(record)
+            self.replayed += len(record.rows)
+            if not self.spool.pending:
+                logger.info(f"✅ Spool boşaltıldı - Toplam yüklenen kayıt: {self.replayed}")
+
+    async def _replay_record(self, record):
+        """Kaydı yazar; veritabanına ulaşılamazsa False (kayıt tüketilmez, başta kalır).
+
+        Veri hatası tekrar denemekle geçmez; kayıt bölünüp yazılır. Bölünürken bağlantı koparsa
+        yazılamayan parçalar bellekte tutulur ve aynı kayıt tekrar denenirken sadece onlar yazılır;
+        sonraki kayıtlar bunların önüne geçmez.
+        """
+        key = (record.segment, record.offset)
+        parts = [record.rows]
+        if self._unfinished is not None and self._unfinished[0] == key:
+            parts = self._unfinished[1]
+        self._unfinished = None
+        for i, part in enumerate(parts):
+            try:
+                await self._copy(record.table, part)
+                self.counters[record.table]["written"] += len(part)
+                continue
+            except Exception as e:
+                if db.unavailable(e):
+                    self._unfinished = (key, parts[i:])
+                    logger.error(f"⚠️ Spool kaydı yazılamadı - Tablo: {record.table}: {str(e) or type(e).__name__}")
+                    return False
+                logger.error(f"⚠️ Spool kaydında veri hatası - Tablo: {record.table}, Kayıt: {len(part)}: "
+                             f"{str(e) or type(e).__name__}")
+            if len(part) == 1:
+                self.counters[record.table]["rejected"] += 1
+                logger.error(f"🚫 Kayıt reddedildi - Tablo: {record.table}, Kayıt: {part[0]!r}")
+                continue
+            rest = await self._split(record.table, part)
+            if rest:
+                self._unfinished = (key, rest + parts[i + 1:])
+                return False
+        return True
+
+    def stats(self):
+        return {
+            "queues": {
+                table: dict(counters, depth=len(self.queues[table]) if table in self.queues else 0)
+                for table, counters in self.counters.items()
+            },
+            "flushes": self.flushes,
+            "backpressure_waits": self.backpressure_waits,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "spool": self.spool.stats() if self.spool is not None else None,
+        }